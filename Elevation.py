@@ -0,0 +1,220 @@
+import time
+
+import numpy as np
+from scipy import ndimage
+
+import Trace
+from Noise import GradientNoise
+from Plates import PLATE_MELTED_DISTANCE, PLATE_MELTED_THICKNESS, boundary_stress, plate_types
+from Shapes import SURFACES
+
+# Elevations are in units of about the height of a mountain range, everything under SEA_LEVEL is water
+SEA_LEVEL = 0.0
+# Elevation of a plate of each of the PLATE_TYPES, in that order, before any uplift or noise
+PLATE_TYPE_ELEVATIONS = (-0.4, 0.25)
+# Tiles the plate type elevations are smoothed over, which slopes the shelves between the plates
+SHELF_SMOOTHING = 4
+# Uplift of two plates closing in at full speed and the tiles it spreads over into a mountain range
+STRESS_UPLIFT = 0.5
+UPLIFT_SPREAD = 5
+# Noise layered over the plates when no GradientNoise is given
+ELEVATION_NOISE_FREQUENCY = 4
+ELEVATION_NOISE_OCTAVES = 4
+ELEVATION_NOISE_AMPLITUDE = 0.8
+# Erosion iterations HydraulicErosion runs unless told otherwise
+EROSION_ITERATIONS = 50
+# Water falling on every tile per iteration
+RAIN = 1.0
+# Elevation a stream carves out per iteration per unit of sqrt(drainage area) times slope
+ERODIBILITY = 0.03
+# Sediment a stream carries per unit of drainage area times slope before it starts dropping it
+TRANSPORT_CAPACITY = 0.05
+# Part of the sediment over the capacity dropped per iteration
+DEPOSITION_RATE = 0.2
+# Part of the difference to the average of its four neighbours a tile creeps toward per iteration
+HILLSLOPE_DIFFUSION = 0.02
+# Part of the drop to the tile downhill one iteration may erode or deposit, more would dig pits or build dams
+MAX_DROP_FRACTION = 0.5
+# Elevations relative to sea level and the RGBA colors ramped between them
+ELEVATION_COLORS = (
+    (-0.6, (0, 0, 110, 255)),
+    (0.0, (0, 70, 210, 255)),
+    (0.01, (200, 190, 130, 255)),
+    (0.05, (40, 160, 40, 255)),
+    (0.35, (110, 95, 60, 255)),
+    (0.7, (245, 245, 245, 255)),
+)
+# The eight neighbours of a tile as (dy, dx) and how far away they are
+NEIGHBOURS = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx]
+NEIGHBOUR_DISTANCES = [float(np.hypot(dy, dx)) for dy, dx in NEIGHBOURS]
+
+
+@Trace.traced()
+def elevation_field(tiles, plates, perlin=None, executor=None):
+    """Returns a float elevation for every tile of a TerrainGrid, worked out from the whole grid at once.
+
+    Every tile starts at the elevation of its plate's type, smoothed into shelves where the types meet. Plates closing
+    in push up mountains along their border, as far as boundary_stress finds them approaching, and the noise of
+    perlin, a GradientNoise with as many octaves as wanted, roughens it all up. The map wraps around in x.
+    """
+    rows, cols = tiles.shape
+    pixel_width = tiles.pixel_width
+    # Tiles without a plate get the oceanic elevation appended for label -1
+    type_elevations = np.append(np.asarray(PLATE_TYPE_ELEVATIONS)[plate_types(plates)], PLATE_TYPE_ELEVATIONS[0])
+    elevation = ndimage.gaussian_filter(type_elevations[tiles.plate_index], SHELF_SMOOTHING, mode=("nearest", "wrap"))
+
+    # The stress probes are PLATE_MELTED_DISTANCE + PLATE_MELTED_THICKNESS tiles long and measured in map widths,
+    # scaled back up it is the speed the plates close in at
+    stress = boundary_stress(tiles, plates) * cols / (PLATE_MELTED_DISTANCE + PLATE_MELTED_THICKNESS)
+    elevation += STRESS_UPLIFT * ndimage.gaussian_filter(stress, UPLIFT_SPREAD, mode=("nearest", "wrap"))
+
+    if perlin is None:
+        perlin = GradientNoise(ELEVATION_NOISE_FREQUENCY, octaves=ELEVATION_NOISE_OCTAVES)
+    xs = np.arange(cols) * pixel_width - pixel_width // 2
+    ys = np.arange(rows) * pixel_width - pixel_width // 2
+    elevation += ELEVATION_NOISE_AMPLITUDE * perlin.grid(xs / (cols * pixel_width), ys / (rows * pixel_width),
+                                                         executor)
+    return elevation
+
+
+def flow_receivers(elevation, sea_level=SEA_LEVEL):
+    """The steepest way downhill from every tile, to one of its eight neighbours.
+
+    Returns the flat index of the tile each tile drains to, elevation.size for tiles with no neighbour below them and
+    for tiles under sea level, the slope down to it, 0 where there is none, and the elevation of the lowest
+    neighbour. The map wraps around in x, water never runs off the top or bottom.
+    """
+    rows, cols = elevation.shape
+    padded = np.pad(elevation, ((1, 1), (0, 0)), constant_values=np.inf)
+    padded = np.concatenate((padded[:, -1:], padded, padded[:, :1]), axis=1)
+    slope = np.zeros(elevation.shape)
+    lowest = np.full(elevation.shape, np.inf)
+    steepest = np.full(elevation.shape, -1, dtype=np.int64)
+    neighbour_slope = np.empty(elevation.shape)
+    steeper = np.empty(elevation.shape, dtype=bool)
+    for i, ((dy, dx), distance) in enumerate(zip(NEIGHBOURS, NEIGHBOUR_DISTANCES)):
+        neighbour = padded[1 + dy:1 + dy + rows, 1 + dx:1 + dx + cols]
+        np.minimum(lowest, neighbour, out=lowest)
+        np.subtract(elevation, neighbour, out=neighbour_slope)
+        neighbour_slope *= 1 / distance
+        np.greater(neighbour_slope, slope, out=steeper)
+        np.copyto(slope, neighbour_slope, where=steeper)
+        np.copyto(steepest, i, where=steeper)
+
+    drains = (steepest >= 0) & (elevation >= sea_level)
+    slope[~drains] = 0
+    offsets = np.array(NEIGHBOURS)[steepest]
+    ys, xs = np.indices(elevation.shape)
+    receivers = (ys + offsets[..., 0]) * cols + (xs + offsets[..., 1]) % cols
+    return np.where(drains, receivers, elevation.size).reshape(-1), slope.reshape(-1), lowest.reshape(-1)
+
+
+def flow_accumulation(receivers, weights):
+    """Sums weights down the flow, every tile gets its own weight plus those of all the tiles draining through it.
+
+    receivers holds the flat index of the tile every tile drains to, len(receivers) where it drains nowhere. A way
+    downhill can cross the whole map, so instead of following it tile by tile the sums are built by pointer jumping:
+    after round k every tile holds the weights of the tiles up to 2 ** k - 1 steps upstream and points 2 ** k steps
+    downstream, so the rounds only grow with the log of the longest way.
+    """
+    size = len(receivers)
+    total = np.append(weights, 0.0)
+    jump = np.append(receivers, size)
+    # Tiles whose pointer hasn't run off the end of their way yet, the others have nothing left to pass on
+    active = np.flatnonzero(receivers < size)
+    rounds = 0
+    while len(active):
+        rounds += 1
+        targets = jump[active]
+        total += np.bincount(targets, weights=total[active], minlength=size + 1)
+        jump[active] = jump[targets]
+        active = active[jump[active] < size]
+    if Trace.enabled:
+        Trace.count("flow accumulation rounds", rounds)
+    return total[:size]
+
+
+def elevation_to_rects(tiles, elevation, sea_level=SEA_LEVEL):
+    # A copy of the TerrainGrid whose surface and color follow the elevation, tiles under sea level are water
+    new_tiles = tiles.copy()
+    new_tiles.surface = np.where(elevation < sea_level, SURFACES.index("WATER"), SURFACES.index("GRASS")).astype(
+        np.uint8)
+    heights = [height for height, _ in ELEVATION_COLORS]
+    colors = np.array([color for _, color in ELEVATION_COLORS], dtype=float)
+    relative = elevation - sea_level
+    new_tiles.color = np.stack([np.interp(relative, heights, colors[:, channel]) for channel in range(4)],
+                               axis=-1).round().astype(np.uint8)
+    return new_tiles
+
+
+class HydraulicErosion:
+    """Carves rivers and coastlines into an elevation grid, one iteration of the whole grid at a time.
+
+    Every iteration rain falls on every tile and runs to its steepest neighbour. The drainage area of every tile, the
+    rain of all the tiles upstream of it, comes out of flow_accumulation, and streams carve out the land in
+    proportion to the square root of it times the slope. The sediment they pick up is summed down the flow the same
+    way. Where more arrives than the stream can carry at that slope part of it settles, pits on land fill up with
+    whatever reaches them and the sea takes it at the coast, up to sea level, which builds out deltas. Last the
+    slopes creep toward their neighbours. Sediment that settles on the way still counts toward the loads further
+    down, the rates are small enough for that to stay a minor overestimate.
+    """
+
+    def __init__(self, elevation, sea_level=SEA_LEVEL, rain=RAIN, erodibility=ERODIBILITY,
+                 capacity=TRANSPORT_CAPACITY, deposition=DEPOSITION_RATE, diffusion=HILLSLOPE_DIFFUSION):
+        self.elevation = np.array(elevation, dtype=np.float64)
+        self.sea_level = sea_level
+        self.rain = rain
+        self.erodibility = erodibility
+        self.capacity = capacity
+        self.deposition = deposition
+        self.diffusion = diffusion
+        # Drainage area of every tile in the last iteration
+        self.area = np.zeros(self.elevation.shape)
+        self.iterations = 0
+        self.seconds = 0.0
+
+    @property
+    def iterations_per_second(self):
+        return self.iterations / self.seconds if self.seconds > 0 else 0.0
+
+    def run(self, iterations=EROSION_ITERATIONS, seconds=None):
+        # Runs up to iterations iterations, stopping early once seconds have gone by if given
+        start = time.perf_counter()
+        for _ in range(iterations):
+            if seconds is not None and time.perf_counter() - start >= seconds:
+                break
+            self.step()
+        self.seconds += time.perf_counter() - start
+        return self.elevation
+
+    def step(self):
+        self.iterations += 1
+        elevation = self.elevation.reshape(-1)
+        receivers, slope, lowest = flow_receivers(self.elevation, self.sea_level)
+        drains = receivers < elevation.size
+        drop = np.zeros(elevation.size)
+        drop[drains] = elevation[drains] - elevation[receivers[drains]]
+
+        area = flow_accumulation(receivers, np.full(elevation.size, self.rain))
+        erosion = np.minimum(self.erodibility * np.sqrt(area) * slope, MAX_DROP_FRACTION * drop)
+        incoming = flow_accumulation(receivers, erosion) - erosion
+
+        # Streams drop what they can't carry, pits and the sea keep what reaches them as far as there is room
+        overload = np.maximum(0, incoming - self.capacity * area * slope)
+        ocean = elevation < self.sea_level
+        room = np.maximum(0, np.where(ocean, self.sea_level, lowest) - elevation)
+        deposit = np.where(drains, np.minimum(self.deposition * overload, MAX_DROP_FRACTION * drop),
+                           np.minimum(incoming, MAX_DROP_FRACTION * room))
+        elevation += deposit - erosion
+
+        self.elevation += self.diffusion * neighbour_difference(self.elevation)
+        self.area = area.reshape(self.elevation.shape)
+        if Trace.enabled:
+            Trace.count("erosion iterations")
+
+
+def neighbour_difference(elevation):
+    # The average of the four neighbours minus the tile, wrapping in x and repeating the top and bottom rows
+    padded = np.pad(elevation, ((1, 1), (0, 0)), mode="edge")
+    neighbours = padded[:-2] + padded[2:] + np.roll(elevation, 1, axis=1) + np.roll(elevation, -1, axis=1)
+    return neighbours / 4 - elevation
@@ -1,69 +1,225 @@
+import math
 import random
 from collections import defaultdict
-from typing import List
+from itertools import chain
 import numpy as np
 import logging
-from perlin_noise import PerlinNoise
 
 from numpy import sign
-from scipy.spatial import Voronoi
+from scipy import ndimage
+from scipy.spatial import Voronoi, cKDTree
 
-from Shapes import TerrainTile
+import Trace
+from Noise import GradientNoise
+from Shapes import TerrainGrid, SURFACES, pack_colors, unpack_colors, random_surface_color
 
 NUM_PLATES = 15
 WIDTH, HEIGHT = 720, 720
 PLATE_MELTED_DISTANCE = 2
 PLATE_MELTED_THICKNESS = 2
+# The band highlight_tiles draws along a segment starts this many tiles to one side of it and is this many tiles wider
+HIGHLIGHT_BAND_START = 5
+HIGHLIGHT_BAND_WIDTH = 4
+# Tiles around the Voronoi borders highlight_edges probes: the blur moves the edges up to smoothing_radius tiles per
+# iteration and the probes reach PLATE_MELTED_DISTANCE + PLATE_MELTED_THICKNESS tiles further
+EDGE_SEARCH_REACH = 3 * 3 + PLATE_MELTED_DISTANCE + PLATE_MELTED_THICKNESS + 1
 WATER_DENSITY_THRESHOLD = 0.5
+# Seeds within this many average plate widths of a seam are copied over it for the Voronoi diagram
+SEAM_MARGIN = 4
+# Plate types in the order they are stored in PlateTable.type
+PLATE_TYPES = ("OCEANIC", "CONTINENTAL")
 # random.seed(20)
 PIXEL_WIDTH = 5
-noise = PerlinNoise(octaves=6)
+noise = GradientNoise(frequency=6)
 
 logger = logging.getLogger(__name__)
 
 
-def polygons_to_rects(plates):
-    max_x = WIDTH // PIXEL_WIDTH
-    max_y = HEIGHT // PIXEL_WIDTH
-    rectangles = np.empty((max_y, max_x), dtype=object)
-
-    for y in range(max_y):
+# With a Tiling.TiledExecutor the stages that take one run on bands of rows in parallel, with the same result
+@Trace.traced()
+def polygons_to_rects(plates, width=WIDTH, height=HEIGHT, pixel_width=PIXEL_WIDTH,
+                      water_density_threshold=WATER_DENSITY_THRESHOLD, executor=None):
+    if executor is None:
+        labels = rasterize_plates(plates, width, height, pixel_width)
+    else:
+        labels = executor.run(lambda start, stop: rasterize_plates(plates, width, height, pixel_width, (start, stop)),
+                              height // pixel_width)
+    return labels_to_rects(plates, labels, pixel_width, water_density_threshold)
+
+
+def labels_to_rects(plates, labels, pixel_width=PIXEL_WIDTH, water_density_threshold=WATER_DENSITY_THRESHOLD):
+    # A TerrainGrid with every tile taking the surface and color of the plate its label points to
+    densities = plate_densities(plates)
+    surfaces = np.where(densities > water_density_threshold, SURFACES.index("WATER"), SURFACES.index("GRASS"))
+    colors = plate_colors(plates)
+
+    return TerrainGrid(
+        *labels.shape,
+        pixel_width,
+        plate_index=labels.astype(np.int16),
+        surface=surfaces[labels].astype(np.uint8),
+        color=colors[labels]
+    )
+
+
+def tile_sample_points(width=WIDTH, height=HEIGHT, pixel_width=PIXEL_WIDTH, band=None, columns=None):
+    # The point every tile is classified by, (x * PIXEL_WIDTH, y * PIXEL_WIDTH), as an (rows, cols, 2) array, for
+    # the (start, stop) rows of band and columns if given
+    xs = np.arange(*(columns or (width // pixel_width,))) * pixel_width
+    ys = np.arange(*(band or (height // pixel_width,))) * pixel_width
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    return np.stack((grid_x, grid_y), axis=-1)
+
+
+def rasterize_plates(plates, width=WIDTH, height=HEIGHT, pixel_width=PIXEL_WIDTH, band=None, columns=None):
+    """Returns an int32 grid holding the index of the plate every tile lies in.
+
+    The plate polygons are the Voronoi cells of the plate centers, so the polygon containing a point is the one
+    belonging to the nearest center. A KD-tree over the centers answers that for every tile in a single query instead
+    of testing each tile against each polygon. The tree is periodic in x so the map wraps around like the cells do,
+    its y period is long enough that nothing wraps vertically. band and columns limit the grid to the (start, stop)
+    tile rows and columns.
+
+    A tile exactly as far from two centers goes to the lower plate index, like the first matching polygon of
+    rasterize_plates_reference. The tree would pick one depending on how it was built, which changes with every
+    center, so moving one plate could flip ties on the other side of the map.
+    """
+    seeded = np.flatnonzero(plate_has_polygon(plates)).astype(np.int32)
+    tree = cKDTree(plate_centers(plates)[seeded], boxsize=[width, 3 * height])
+    points = tile_sample_points(width, height, pixel_width, band, columns)
+    if len(seeded) < 2:
+        _, nearest = tree.query(points.reshape(-1, 2))
+        labels = seeded[nearest]
+    else:
+        distances, nearest = tree.query(points.reshape(-1, 2), k=2)
+        labels = seeded[nearest]
+        labels = np.where(distances[:, 0] == distances[:, 1], labels.min(axis=1), labels[:, 0])
+    Trace.count("tiles rasterized", len(labels))
+    return labels.reshape(points.shape[:2])
+
+
+def rasterize_plates_reference(plates, width=WIDTH, height=HEIGHT, pixel_width=PIXEL_WIDTH, rows=None):
+    # The original per-tile point_in_polygon scan, kept to check and benchmark rasterize_plates against.
+    # rows limits the scan to a subset of tile rows, tiles outside of it are left at -1
+    max_x = width // pixel_width
+    max_y = height // pixel_width
+    labels = np.full((max_y, max_x), -1, dtype=np.int32)
+    # The pieces of PlateTable plates are cut every time they are asked for
+    plate_pieces = [plate.pieces for plate in plates]
+
+    for y in (range(max_y) if rows is None else rows):
+        Trace.count("tiles rasterized", max_x)
         for x in range(max_x):
-            #  Loop through rects and determine what polygon it lies in
-            poly_idx = next(
-                (i for i, plate in enumerate(plates)
-                 if plate.polygon is not None and point_in_polygon((x * PIXEL_WIDTH, y * PIXEL_WIDTH), plate.polygon)), 0) - 1
-            rect_x = x * PIXEL_WIDTH - PIXEL_WIDTH // 2
-            rect_y = y * PIXEL_WIDTH - PIXEL_WIDTH // 2
-
-            if plates[poly_idx].density > WATER_DENSITY_THRESHOLD:
-                terrain = "WATER"
-            else:
-                terrain = "GRASS"
-
-            tile = TerrainTile(
-                rect_x,
-                rect_y,
-                PIXEL_WIDTH,
-                PIXEL_WIDTH,
-                terrain,
-                plates[poly_idx].color,
-                poly_idx
-            )
-            rectangles[y][x] = tile
+            labels[y, x] = next(
+                (i for i, pieces in enumerate(plate_pieces)
+                 if any(point_in_polygon((x * pixel_width, y * pixel_width), piece) for piece in pieces)),
+                -1)
+
+    return labels
+
+
+# Highlights tiles near the edge of their plate in red, the more the plate across the edge is moving toward them the
+# redder they get
+@Trace.traced()
+def highlight_edges(plates, rectangles, adjacency=None, reach=EDGE_SEARCH_REACH, origin=(0, 0), map_size=None,
+                    executor=None):
+    # With a PlateAdjacency only the tiles within reach of a border segment are probed
+    candidates = None if adjacency is None else adjacency.boundary_mask(rectangles.shape, reach, origin[1], origin[0])
+    directions = plate_directions(plates)
+    if executor is None:
+        approaches = edge_approaches(rectangles, directions, candidates=candidates, origin=origin, map_size=map_size)
+    else:
+        rows, cols = rectangles.shape
+        map_size = (cols * rectangles.pixel_width, rows * rectangles.pixel_width) if map_size is None else map_size
+
+        def approaches_between(start, stop):
+            return edge_approaches(rectangles.band(start, stop), directions,
+                                   candidates=None if candidates is None else candidates[start:stop],
+                                   origin=(origin[0], origin[1] + start), map_size=map_size)
+
+        approaches = executor.run(approaches_between, rows, PLATE_MELTED_DISTANCE + PLATE_MELTED_THICKNESS, axis=1)
+    red = rectangles.color[..., 0].astype(np.int64)
+    # One probe after the other, each one adds to the red the previous ones left
+    for approach in approaches:
+        toward = approach > 0
+        red[toward] = np.minimum(255, (np.minimum(1, approach[toward]) * 175 + 80 + red[toward]).astype(np.int64))
+    rectangles.color[..., 0] = red
 
     return rectangles
 
 
-# Write a function called highlight edges that takes a list of plates and a list of rectangles, and returns a list of
-# rectangles where if a rectangle is next to another rectangle whose corresponding plate is pointing in a different
-# direction, it is highlighted
-def highlight_edges(plates, rectangles):
+def boundary_stress(rectangles, plates):
+    """Returns a float field of how hard the neighbouring plates are pushing into every tile near a plate edge.
+
+    It sums the positive approach scores of the edge_approaches probes, tiles away from any edge are 0.
+    """
+    return np.clip(edge_approaches(rectangles, plate_directions(plates)), 0, None).sum(axis=0)
+
+
+def plate_directions(plates):
+    if isinstance(plates, PlateTable):
+        return plates.direction
+    return np.array([plate.direction for plate in plates], dtype=float).reshape(-1, 2)
+
+
+def edge_approaches(rectangles, directions, melted_distance=PLATE_MELTED_DISTANCE,
+                    melted_thickness=PLATE_MELTED_THICKNESS, candidates=None, origin=(0, 0), map_size=None):
+    """Scores how fast the plate across a nearby edge approaches each tile, for eight probes around it.
+
+    A tile is probed when no tile within melted_distance belongs to another plate. The probes look
+    melted_distance + melted_thickness tiles away in the eight compass directions. A probe landing on another plate
+    scores the dot product of the two plates' relative direction and the offset between the tiles, in map widths,
+    so positive means the plates close in. Returns a (8, rows, cols) array with 0 wherever nothing was scored.
+    An optional boolean candidates grid limits the probing to its True tiles. For a window of a larger map, origin
+    is the (x, y) tile the window starts at and map_size the (width, height) of the map in pixels.
+    """
+    labels = rectangles.plate_index.astype(np.int64)
+    rows, cols = labels.shape
+    pixel_width = rectangles.pixel_width
+    width, height = (cols * pixel_width, rows * pixel_width) if map_size is None else map_size
+
+    # Tiles whose whole melted_distance neighbourhood is their own plate, tiles off the grid don't count
+    size = 2 * melted_distance + 1
+    footprint = np.ones((size, size), dtype=bool)
+    footprint[melted_distance, melted_distance] = False
+    highest = ndimage.maximum_filter(labels, footprint=footprint, mode="constant", cval=labels.min() - 1)
+    lowest = ndimage.minimum_filter(labels, footprint=footprint, mode="constant", cval=labels.max() + 1)
+    inside = (labels != -1) & (highest <= labels) & (lowest >= labels)
+    if candidates is not None:
+        inside &= candidates
+    if Trace.enabled:
+        Trace.count("edge probes", 8 * int(np.count_nonzero(inside)))
+
+    distance = melted_distance + melted_thickness
+    tile_x = (np.arange(cols) + origin[0]) * pixel_width - pixel_width // 2
+    tile_y = (np.arange(rows) + origin[1]) * pixel_width - pixel_width // 2
+    approaches = np.zeros((8, rows, cols))
+    probes = [(dy, dx) for dy in (-distance, 0, distance) for dx in (-distance, 0, distance) if dx != 0 or dy != 0]
+    for i, (dy, dx) in enumerate(probes):
+        # The part of the grid whose probe lands on the grid, and where those probes land
+        here = (slice(max(0, -dy), rows - max(0, dy)), slice(max(0, -dx), cols - max(0, dx)))
+        there = (slice(max(0, dy), rows - max(0, -dy)), slice(max(0, dx), cols - max(0, -dx)))
+        own = labels[here]
+        other = labels[there]
+        probed = inside[here] & (other != -1) & (other != own)
+
+        relative = directions[other[probed]] - directions[own[probed]]
+        offset_x = (tile_x[there[1]] / float(width) - tile_x[here[1]] / float(width))[None, :]
+        offset_y = (tile_y[there[0]] / float(height) - tile_y[here[0]] / float(height))[:, None]
+        offset_x = np.broadcast_to(offset_x, own.shape)[probed]
+        offset_y = np.broadcast_to(offset_y, own.shape)[probed]
+        approaches[i][here][probed] = relative[:, 0] * offset_x + relative[:, 1] * offset_y
+
+    return approaches
+
+
+# The original per-tile version of highlight_edges, kept to check it against
+def highlight_edges_reference(plates, rectangles):
     for y, row in enumerate(rectangles):
         for x, rect in enumerate(row):
             if rect.plate_index == -1:
                 continue
-            rectangles[y][x] = hightlight_single_tile_edge(plates, rectangles, x, y)
+            hightlight_single_tile_edge(plates, rectangles, x, y)
 
     return rectangles
 
@@ -120,6 +276,83 @@ def tiles_moving_toward_each_other(plates, tile1, tile2):
 
 
 def highlight_tiles(tiles, p1, p2):
+    # Highlights the band of tiles on one side of the line from tile p1 to tile p2
+    tiles.highlight |= segment_band_mask(np.array([[p1[0], p1[1], p2[0], p2[1]]]), tiles.shape)
+    return tiles
+
+
+def segment_band_mask(segments, shape, band_start=HIGHLIGHT_BAND_START, band_width=HIGHLIGHT_BAND_WIDTH):
+    """Returns a boolean grid of the bands highlight_tiles_reference draws along every segment, all in one pass.
+
+    segments is an (N, 4) integer array of x1, y1, x2, y2 tiles. A segment is stepped along its longer axis in
+    steps + 2 evenly spaced samples, and at every sample the band_width + 1 tiles from band_start tiles away across
+    the other axis are set, on the side that depends on which way the segment runs. Segments of one tile are skipped.
+    """
+    mask = np.zeros(shape, dtype=bool)
+    segments = np.asarray(segments, dtype=np.int64).reshape(-1, 4)
+    x1, y1, x2, y2 = segments.T
+    dx = x2 - x1
+    dy = y2 - y1
+    along_x = np.abs(dx) > np.abs(dy)
+    steps = np.maximum(np.abs(dx), np.abs(dy))
+    drawn = steps > 0
+    x1, y1, dx, dy, along_x, steps = x1[drawn], y1[drawn], dx[drawn], dy[drawn], along_x[drawn], steps[drawn]
+    upper = (~along_x & (dy <= 0)) | (along_x & (dx > 0))
+
+    # Every sample of every segment, i counting from 0 to steps + 1 within its segment
+    counts = steps + 2
+    Trace.count("line steps", int(counts.sum()))
+    segment = np.repeat(np.arange(len(steps)), counts)
+    i = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    x = x1[segment] + i * dx[segment] // steps[segment]
+    y = y1[segment] + i * dy[segment] // steps[segment]
+
+    offsets = np.arange(band_width + 1)
+    first = np.where(upper, band_start, -band_width - band_start)[segment]
+    d = first[:, None] + offsets
+    across_y = along_x[segment][:, None]
+    rows = np.where(across_y, y[:, None] + d, y[:, None])
+    cols = np.where(across_y, x[:, None], x[:, None] + d)
+    inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+    mask[rows[inside], cols[inside]] = True
+    return mask
+
+
+def segment_tile_indices(segments, shape):
+    """Returns the (x, y) tiles on every one of the (N, 4) x1, y1, x2, y2 tile segments, as one (k, 2) array each.
+
+    The tiles are the ones line_tile_indices_reference steps through, from the first end to the second, without
+    the ones off a shape sized grid.
+    """
+    segments = np.asarray(segments, dtype=np.int64).reshape(-1, 4)
+    x1, y1, x2, y2 = segments.T
+    dx = x2 - x1
+    dy = y2 - y1
+    major = np.maximum(np.abs(dx), np.abs(dy))
+    minor = np.minimum(np.abs(dx), np.abs(dy))
+    x_major = np.abs(dx) >= np.abs(dy)
+
+    # k steps along the longer axis move the other one by k * minor / major tiles, rounded half up
+    counts = major + 1
+    Trace.count("line steps", int(counts.sum()))
+    segment = np.repeat(np.arange(len(segments)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    m = (2 * k * minor[segment] + major[segment]) // (2 * np.maximum(major[segment], 1))
+    x = x1[segment] + sign(dx)[segment] * np.where(x_major[segment], k, m)
+    y = y1[segment] + sign(dy)[segment] * np.where(x_major[segment], m, k)
+
+    inside = (y >= 0) & (y < shape[0]) & (x >= 0) & (x < shape[1])
+    split = np.cumsum(np.bincount(segment[inside], minlength=len(segments)))[:-1]
+    return np.split(np.stack((x[inside], y[inside]), axis=-1), split)
+
+
+def tile_segments(segments, pixel_width=PIXEL_WIDTH):
+    # The x1, y1, x2, y2 tiles under the end points of (N, 4) pixel segments, like get_tile_at_point
+    return np.floor_divide(segments, pixel_width).astype(np.int64)
+
+
+# The original per-step version of highlight_tiles, kept to check segment_band_mask against
+def highlight_tiles_reference(tiles, p1, p2):
     hightlight_width = 4
     # Get the number of rows and columns in the tiles array
     # The line has a slope, so we need to iterate over each point on the line
@@ -171,74 +404,36 @@ def highlight_tiles(tiles, p1, p2):
     return tiles
 
 
-# TODO: Optimize so uses borders calculated before
-def disturb_tiles(tiles, plates, scale=10.0, octaves=2):
+# origin is the (x, y) tile tiles starts at when it is a window of the map adjacency was built for
+@Trace.traced()
+def disturb_tiles(tiles, plates, scale=10.0, octaves=2, adjacency=None, origin=(0, 0)):
     new_tiles = tiles.copy()
-    # Get the number of rows and columns in the tiles array
+    if adjacency is None:
+        adjacency = get_plate_adjacency(plates, tiles)
 
-    # Iterate over the plates
-    for plate in plates:
-        if plate.polygon is None:
-            continue
-        # Get the polygon defining the borders of the plate
-        polygon = plate.polygon
-        num_points = len(polygon)
-
-        # Iterate over the points in the polygon
-        for i in range(num_points):
-            # Get the current point and the next point in the polygon
-            p1 = polygon[i]
-            p2 = polygon[(i + 1) % num_points]
-
-            t1 = get_tile_at_point(p1)
-            t2 = get_tile_at_point(p2)
-
-            # Find the tiles that are along the border between the two points
-            tiles_on_border = get_tiles_on_line(new_tiles, t1, t2)
-            highlight_tiles(new_tiles, t1, t2)
-            continue
-
-            # Iterate over the tiles on the border
-            for tile in tiles_on_border:
-                # Get the tile index and position
-                x, y = (tile.x, tile.y)
-                tiles_plate = plates[tile.plate_index]
-
-                # Use Perlin noise to determine if the tile should be disturbed
-                # noise = p.two_octave(x / scale, y / scale, octaves=octaves)
-                # print("noise", noise)
-                # if noise > 0.5:
-                print("highlighted tile at", x, y)
-                # Modify the tile to be disturbed
-                tile.highlight = True
-                # Modify the corresponding plate to be disturbed
-                match tiles_plate.type:
-                    case "CONTINENTAL":
-                        new_color = (0, 0, 255, 255)
-                    case "OCEANIC":
-                        new_color = (0, 255, 0, 255)
-                    case _:
-                        logger.error("Unknown plate type: %s", tiles_plate.type)
-                        new_color = tiles_plate.color
-                tile.color = new_color
+    # Band both sides of every border between plates, each shared edge once and in one direction per side
+    ends = tile_segments(adjacency.segments, tiles.pixel_width) - [origin[0], origin[1], origin[0], origin[1]]
+    new_tiles.highlight |= segment_band_mask(np.vstack((ends, ends[:, [2, 3, 0, 1]])), tiles.shape)
     return new_tiles
 
 
-def get_tile_at_point(point):
+def get_tile_at_point(point, pixel_width=PIXEL_WIDTH):
     x, y = point
-    # Find what tile lies over the point, given that a tile has a width and height of 5
-    tile_x = int(x // PIXEL_WIDTH)
-    tile_y = int(y // PIXEL_WIDTH)
+    # Find what tile lies over the point, given that a tile has a width and height of pixel_width
+    tile_x = int(x // pixel_width)
+    tile_y = int(y // pixel_width)
     return tile_x, tile_y
 
 
 def get_tiles_on_line(tiles, t1, t2):
-    # Initialize an empty list to store the tiles on the line
-    tiles_on_line = []
+    indices = segment_tile_indices([[t1[0], t1[1], t2[0], t2[1]]], (len(tiles), len(tiles[0])))[0]
+    return [tiles[y][x] for x, y in indices.tolist()]
 
-    # Get the number of rows and columns in the tiles array
-    num_rows = len(tiles)
-    num_cols = len(tiles[0])
+
+# The original per-step Bresenham of get_tiles_on_line, kept to check segment_tile_indices against
+def line_tile_indices_reference(t1, t2, num_rows, num_cols):
+    # Initialize an empty list to store the (x, y) indices of the tiles on the line
+    tiles_on_line = []
 
     # Get the x and y coordinates of the first and second tiles
     x1, y1 = t1
@@ -262,7 +457,7 @@ def get_tiles_on_line(tiles, t1, t2):
     # Iterate over the tiles on the line
     while True:
         if 0 <= y1 < num_rows and 0 <= x1 < num_cols:
-            tiles_on_line.append(tiles[y1][x1])
+            tiles_on_line.append((x1, y1))
 
         # Check if the current tile is the second tile
         if x1 == x2 and y1 == y2:
@@ -284,78 +479,164 @@ def get_tiles_on_line(tiles, t1, t2):
     return tiles_on_line
 
 
-def disturb_rectangles_with_perlin_noise(rectangles, strength):
-    """Modifies a list of TerrainTile objects by changing their type based on the value of Perlin noise at their location.
+def disturb_rectangles_with_perlin_noise(rectangles, strength, perlin=None, executor=None):
+    """Modifies the tiles of a TerrainGrid by changing their type based on the value of Perlin noise at their location.
 
     Args:
-    - rectangles: a list of TerrainTile objects
-    - scale: the scale of the Perlin noise
+    - rectangles: a TerrainGrid
     - strength: the strength of the disturbance, between 0 and 1
+    - perlin: the GradientNoise to sample, defaults to the module level noise
+    - executor: an optional Tiling.TiledExecutor to sample the noise with
     """
-    for row in rectangles:
-        for rect in row:
-            # Calculate the noise value at the location of the rectangle
-            x = rect.x
-            y = rect.y
-            noise_value = noise.noise([x / WIDTH, y / HEIGHT])
-
-            # Change the type of the rectangle based on the noise value and the strength
-            if noise_value > 1 - strength:
-                match rect.surface:
-                    case "WATER":
-                        rect.change_surface("GRASS")
-                        rect.highlight = True
-                    case "GRASS":
-                        rect.change_surface("WATER")
-                        rect.highlight = True
+    perlin = noise if perlin is None else perlin
+    rows, cols = rectangles.shape
+    pixel_width = rectangles.pixel_width
+    # Calculate the noise value at the location of every rectangle in one go
+    xs = np.arange(cols) * pixel_width - pixel_width // 2
+    ys = np.arange(rows) * pixel_width - pixel_width // 2
+    noise_values = perlin.grid(xs / (cols * pixel_width), ys / (rows * pixel_width), executor)
+
+    # Change the type of the rectangle based on the noise value and the strength
+    disturbed = noise_values > 1 - strength
+    water = SURFACES.index("WATER")
+    grass = SURFACES.index("GRASS")
+    flipped = np.where(rectangles.surface[disturbed] == water, grass, water).astype(np.uint8)
+    rectangles.surface[disturbed] = flipped
+    rectangles.color[disturbed] = [random_surface_color(SURFACES[surface]) for surface in flipped]
+    rectangles.highlight[disturbed] = True
     return rectangles
 
 
 # A function that takes a list of tiles and applies gaussian blur to it
-def gaussian_blur(tiles: List[List[TerrainTile]], iterations: int) -> List[List[TerrainTile]]:
+@Trace.traced()
+def gaussian_blur(tiles: TerrainGrid, iterations: int, smoothing_radius: int = 3, executor=None) -> TerrainGrid:
+    if iterations == 0:
+        return tiles
+    new_grid = tiles.copy()
+    # Filter the plate indices and colors together, they are the same kind of label
+    labels = np.stack((tiles.plate_index, pack_colors(tiles.color))).astype(np.int64)
+    if executor is None:
+        plate_index, color_ids = majority_filter(labels, smoothing_radius, iterations)
+    else:
+        # A tile only sees labels within smoothing_radius per iteration
+        plate_index, color_ids = executor.run(
+            lambda start, stop: majority_filter(labels[:, start:stop], smoothing_radius, iterations),
+            len(tiles), smoothing_radius * iterations, axis=1)
+    new_grid.plate_index = plate_index.astype(np.int16)
+    new_grid.color = unpack_colors(color_ids)
+    return new_grid
+
+
+def majority_filter(labels, radius=3, iterations=1):
+    """Replaces every label with the most common label among its neighbours, `iterations` times.
+
+    The neighbourhood is the (2 * radius + 1) square around a tile, without the tile itself and cut off at the
+    edges of the grid. labels is an integer array whose last two axes are the rows and columns, any leading axes are
+    filtered independently. Ties go to the label seen first scanning the neighbourhood row by row, like the dict
+    counting in gaussian_blur_reference.
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    for _ in range(iterations):
+        Trace.count("tiles blurred", labels.shape[-2] * labels.shape[-1])
+        labels = majority_filter_pass(labels, radius)
+    return labels
+
+
+MAJORITY_FILTER_BAND_SIZE = 1 << 22
+
+
+def majority_filter_pass(labels, radius):
+    rows, cols = labels.shape[-2:]
+    size = 2 * radius + 1
+    footprint = np.ones([1] * (labels.ndim - 2) + [size, size], dtype=bool)
+    footprint[..., radius, radius] = False
+
+    # Work on label ranks so the sort keys below fit in an int64 and tiles off the grid can use rank -1
+    values, ranks = np.unique(labels, return_inverse=True)
+    ranks = ranks.reshape(labels.shape)
+    highest = ndimage.maximum_filter(ranks, footprint=footprint, mode="constant", cval=-1)
+    lowest = ndimage.minimum_filter(ranks, footprint=footprint, mode="constant", cval=len(values))
+    result = highest.copy()
+
+    # Only tiles that see more than one label need counting, everything inside a plate keeps its single neighbour
+    mixed = np.flatnonzero(highest != lowest)
+    offsets = [(dy, dx) for dy in range(-radius, radius + 1) for dx in range(-radius, radius + 1)
+               if dx != 0 or dy != 0]
+    num_offsets = len(offsets)
+    padding = [(0, 0)] * (labels.ndim - 2) + [(radius, radius), (radius, radius)]
+    padded = np.pad(ranks, padding, constant_values=-1).reshape(-1, rows + 2 * radius, cols + 2 * radius)
+    offset_y = np.array([dy for dy, _ in offsets]) + radius
+    offset_x = np.array([dx for _, dx in offsets]) + radius
+
+    # Go through the mixed tiles in batches so the (tiles, neighbours) arrays stay a bounded size on big maps
+    batch_size = max(1, MAJORITY_FILTER_BAND_SIZE // num_offsets)
+    for start in range(0, len(mixed), batch_size):
+        batch = mixed[start:start + batch_size]
+        channel, tile = np.divmod(batch, rows * cols)
+        y, x = np.divmod(tile, cols)
+        neighbours = padded[channel[:, None], y[:, None] + offset_y, x[:, None] + offset_x]
+
+        # Sorting rank * num_offsets + position groups equal labels into runs whose first element holds the
+        # label's first position in scan order
+        keys = np.sort(neighbours.astype(np.int64) * num_offsets + np.arange(num_offsets), axis=1)
+        ordered, first_seen = np.divmod(keys, num_offsets)
+        positions = np.broadcast_to(np.arange(num_offsets), ordered.shape)
+        is_start = np.ones(ordered.shape, dtype=bool)
+        is_start[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+        is_end = np.ones(ordered.shape, dtype=bool)
+        is_end[:, :-1] = is_start[:, 1:]
+        run_start = np.maximum.accumulate(np.where(is_start, positions, 0), axis=1)
+        run_end = np.minimum.accumulate(np.where(is_end, positions, num_offsets)[:, ::-1], axis=1)[:, ::-1]
+
+        # Most neighbours first, then earliest in scan order
+        first_seen = np.take_along_axis(first_seen, run_start, axis=1)
+        score = (run_end - run_start + 1) * (num_offsets + 1) + (num_offsets - first_seen)
+        score[ordered < 0] = -1
+        best = np.argmax(score, axis=1)
+        result.reshape(-1)[batch] = ordered[np.arange(len(batch)), best]
+
+    return values[result]
+
+
+# The original dictionary counting blur, kept to check majority_filter against
+def gaussian_blur_reference(tiles: TerrainGrid, iterations: int) -> TerrainGrid:
     if iterations == 0:
         return tiles
     # Create a copy of the input tile grid
-    # new_grid = [row[:] for row in tiles]
-    new_grid = []
+    new_grid = tiles.copy()
+    # Walk plain lists, looking each neighbour up through a tile view is several times slower
+    colors = [[tuple(color) for color in row] for row in tiles.color.tolist()]
+    plate_indices = tiles.plate_index.tolist()
 
     # Iterate through each tile in the grid
-    for y, row in enumerate(tiles):
-        new_row = []
-        for x, tile in enumerate(row):
+    for y, row in enumerate(plate_indices):
+        for x in range(len(row)):
             # Get the surrounding tiles
             color_count = defaultdict(int)
             plate_count = defaultdict(int)
-            new_tile = tile.__copy__()
             smoothing_radius = 3
             for dy in range(-smoothing_radius, smoothing_radius + 1):
                 for dx in range(-smoothing_radius, smoothing_radius + 1):
                     if dx == 0 and dy == 0:
                         continue
-                    if 0 <= y + dy < len(tiles) and 0 <= x + dx < len(row):
-                        t = tiles[y + dy][x + dx]
-                        color_count[t.color] += 1
-                        plate_count[t.plate_index] += 1
+                    if 0 <= y + dy < len(plate_indices) and 0 <= x + dx < len(row):
+                        color_count[colors[y + dy][x + dx]] += 1
+                        plate_count[plate_indices[y + dy][x + dx]] += 1
 
             # Calculate the average surface of the surrounding tiles
             avg_color = max(color_count, key=color_count.get)
             avg_plate = max(plate_count, key=plate_count.get)
 
-            # if avg_color != tile.color:
-            #     new_tile.highlight = True
-
             # Set the surface of the current tile to the average surface
-            new_tile.color = avg_color
-            new_tile.plate_index = avg_plate
-            new_row.append(new_tile)
-
-        new_grid.append(new_row)
+            new_grid.color[y, x] = avg_color
+            new_grid.plate_index[y, x] = avg_plate
 
     # Return the new grid
-    return gaussian_blur(new_grid, iterations - 1)
+    return gaussian_blur_reference(new_grid, iterations - 1)
 
 
 def point_in_polygon(point, polygon):
+    Trace.count("polygon tests")
     x, y = point
     winding_number = 0
     for i in range(len(polygon)):
@@ -371,81 +652,465 @@ def point_in_polygon(point, polygon):
     return winding_number != 0
 
 
-def get_points(num, width, height):
-    points = [[random.randrange(width), random.randrange(height)]
-              for _ in range(num)]
-    # Copy the points to, and move them the screen width's to the left
-    points2 = [[x - width, y] for x, y in points]
-    # Copy the points to, and move them the screen width's to the right
-    points3 = [[x + width, y] for x, y in points]
-    # Append to the points list
-    points.extend(points2)
-    points.extend(points3)
+def get_points(num, width, height, rng=random):
+    return np.array([[rng.randrange(width), rng.randrange(height)] for _ in range(num)])
 
-    points.append([-width * 3, -height * 3])
-    points.append([-width * 3, height * 4])
-    points.append([width * 4, -height * 3])
-    points.append([width * 4, height * 4])
-    return np.array(points)
 
+def corner_points(width, height):
+    # Far away seeds that keep every real seed's Voronoi region bounded
+    return [[-width * 3, -height * 3], [-width * 3, height * 4], [width * 4, -height * 3], [width * 4, height * 4]]
 
-def get_voronoi(points):
-    voronoi = Voronoi(points)
 
-    voronoi_vertices = voronoi.vertices
+def get_voronoi(points, width=WIDTH, height=HEIGHT):
+    """Returns the Voronoi polygon of every point and the ridges between them, wrapping around horizontally.
 
-    polygons = []
-    for region in voronoi.regions:
+    The map is a cylinder width pixels around, so the diagram is built over the points and copies of them across the
+    seams, see wrapped_voronoi. The polygon of a point is its region around the point itself as a (k, 2) array of
+    vertices, None if it is unbounded, and may reach over the seams, wrap_polygon cuts it into the pieces on the map.
+    The ridges are an (R, 2) array of the two points each ridge separates and an (R, 4) array of its end points as
+    x1, y1, x2, y2, clipped to the map: every border on the map is listed once, one crossing a seam as two pieces.
+    """
+    voronoi, source, seeded = wrapped_voronoi(points, width, height)
+    polygon_points, offsets = voronoi_polygons(voronoi, seeded, len(points))
+    polygons = [polygon_points[start:stop] if stop > start else None for start, stop in zip(offsets, offsets[1:])]
+    return polygons, voronoi_ridges(voronoi, source, width)
+
+
+def wrapped_voronoi(points, width=WIDTH, height=HEIGHT, seam_margin=SEAM_MARGIN):
+    """Returns the Voronoi diagram of the points on a map wrapping around in x.
+
+    A point at the same spot as an earlier one gets no seed, Qhull would give the region to either of them. Only the
+    seeds within seam_margin average plate widths of a seam or of the top or bottom edge are copied one width over to
+    the other side, with far away corner seeds keeping every region bounded. Tiling all of them would triple the
+    seeds Qhull has to go through. The diagram is then checked against the copies left out: the regions of the points
+    and of every seed with a ridge on the map are only right if no left out copy lies closer to one of their vertices
+    than the seeds that vertex is between. Where one does the margin is doubled, up to copying every point. Also
+    returns the index of the point every seed stands for, -1 for the corner seeds, and the indices of the points
+    that got a seed, in the order of the first seeds.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    _, first = np.unique(points, axis=0, return_index=True)
+    seeded = np.sort(first)
+    points = points[seeded]
+    num_seeds = len(points)
+    margin = seam_margin * math.sqrt(width * height / max(1, num_seeds))
+    while True:
+        # The regions along the top and bottom reach far off the map, where they depend on the seeds along the whole
+        # edge, so those are copied too. Every point goes one width to the left and right once the margin spans the
+        # map
+        edge = (points[:, 1] < margin) | (points[:, 1] >= height - margin) | (margin >= width)
+        left = edge | (points[:, 0] >= width - margin)
+        right = edge | (points[:, 0] < margin)
+        copies = np.concatenate((np.arange(num_seeds), np.flatnonzero(left), np.flatnonzero(right)))
+        source = np.concatenate((seeded[copies], [-1] * 4))
+        voronoi = Voronoi(np.vstack((points, points[left] - [width, 0], points[right] + [width, 0],
+                                     corner_points(width, height))))
+        omitted = np.vstack((points[~left] - [width, 0], points[~right] + [width, 0]))
+        if len(omitted) == 0 or wrapped_voronoi_exact(voronoi, source, num_seeds, omitted, width):
+            return voronoi, source, seeded
+        margin *= 2
+
+
+def wrapped_voronoi_exact(voronoi, source, num_seeds, omitted, width):
+    # Whether the parts of a wrapped_voronoi diagram it returns are what they would be with the omitted seeds in it
+    ridge_points, segments = finite_ridges(voronoi)
+    on_map = ~np.isnan(clip_segments(segments, 0, width)[:, 0])
+    seeds = np.union1d(np.arange(num_seeds), ridge_points[on_map].ravel())
+    seeds = seeds[source[seeds] >= 0]
+    regions = [voronoi.regions[region] for region in voronoi.point_region[seeds]]
+    if any(-1 in region or len(region) == 0 for region in regions):
+        return False
+    # Every vertex is as far from all the seeds it is between, one of them is enough
+    vertices = np.fromiter(chain.from_iterable(regions), dtype=np.int64)
+    vertex_seeds = np.repeat(seeds, [len(region) for region in regions])
+    vertices, first = np.unique(vertices, return_index=True)
+    radii = np.linalg.norm(voronoi.vertices[vertices] - voronoi.points[vertex_seeds[first]], axis=1)
+    # A copy on the circle would make the vertex a different one as well
+    radii = radii * (1 + 1e-9) + 1e-9
+    vertices = voronoi.vertices[vertices]
+    # Only circles reaching past the nearest left out copy in x can hold one
+    reach = ((vertices[:, 0] - radii < omitted[:, 0].max(initial=-np.inf, where=omitted[:, 0] < 0)) |
+             (vertices[:, 0] + radii > omitted[:, 0].min(initial=np.inf, where=omitted[:, 0] > width)))
+    if not reach.any():
+        return True
+    distances, _ = cKDTree(omitted).query(vertices[reach])
+    return bool(np.all(distances > radii[reach]))
+
+
+def voronoi_polygons(voronoi, seeded, num_points):
+    """The regions of num_points points as one (V, 2) array of vertices and num_points + 1 offsets into it, region i
+    running from offsets[i] to offsets[i + 1], from a wrapped_voronoi whose first seeds are the points seeded.
+    Points without a seed or with an unbounded region are left empty.
+
+    voronoi.regions is not in the same order as the seeds, point_region maps each seed to its region.
+    """
+    regions = [[] for _ in range(num_points)]
+    for point, region in zip(seeded.tolist(), voronoi.point_region[:len(seeded)].tolist()):
+        region = voronoi.regions[region]
         if -1 not in region:
-            polygons.append([voronoi_vertices[p] for p in region])
+            regions[point] = region
+    offsets = np.zeros(num_points + 1, dtype=np.int64)
+    np.cumsum([len(region) for region in regions], out=offsets[1:])
+    vertices = np.fromiter(chain.from_iterable(regions), dtype=np.int64, count=offsets[-1])
+    return voronoi.vertices[vertices], offsets
+
+
+def voronoi_ridges(voronoi, source, width=WIDTH):
+    # The (R, 2) point pairs and (R, 4) segments of the ridges of a wrapped_voronoi on the map, every copy standing
+    # for its point
+    ridge_points, segments = finite_ridges(voronoi)
+    keep = np.all(source[ridge_points] >= 0, axis=1)
+    ridge_points = source[ridge_points[keep]]
+    segments = clip_segments(segments[keep], 0, width)
+
+    # Only the pieces on the map, and not the seams between a point and its own copy
+    keep = ~np.isnan(segments[:, 0]) & (ridge_points[:, 0] != ridge_points[:, 1])
+    return ridge_points[keep], segments[keep]
+
+
+def finite_ridges(voronoi):
+    # The (R, 2) point pairs and (R, 4) x1, y1, x2, y2 segments of the ridges of a Voronoi that have two ends
+    ridge_vertices = np.array(voronoi.ridge_vertices)
+    finite = np.all(ridge_vertices != -1, axis=1)
+    return voronoi.ridge_points[finite], voronoi.vertices[ridge_vertices[finite]].reshape(-1, 4)
 
-    return polygons
 
+def clip_segments(segments, x_min, x_max):
+    # Cuts the (R, 4) segments down to the part between x_min and x_max, segments with no length left become NaN
+    x1, y1, x2, y2 = segments.T
+    dx = x2 - x1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_min = (x_min - x1) / dx
+        t_max = (x_max - x1) / dx
+    vertical = dx == 0
+    inside = (x1 >= x_min) & (x1 <= x_max)
+    start = np.where(vertical, np.where(inside, 0.0, 1.0), np.maximum(0.0, np.minimum(t_min, t_max)))
+    stop = np.where(vertical, np.where(inside, 1.0, 0.0), np.minimum(1.0, np.maximum(t_min, t_max)))
+
+    delta = segments[:, 2:] - segments[:, :2]
+    clipped = np.hstack((segments[:, :2] + start[:, None] * delta, segments[:, :2] + stop[:, None] * delta))
+    # Rounding can leave a cut end a hair past the line, which would put it in the tile the other side
+    clipped[:, [0, 2]] = np.clip(clipped[:, [0, 2]], x_min, x_max)
+    clipped[stop <= start] = np.nan
+    return clipped
+
+
+def wrap_polygon(polygon, width=WIDTH):
+    # The pieces of a polygon that may reach over the seams, moved back onto the map and cut at its edges
+    if polygon is None:
+        return []
+    pieces = []
+    for shift in (-width, 0, width):
+        piece = clip_polygon([(x + shift, y) for x, y in polygon], 0, width)
+        if len(piece) >= 3:
+            pieces.append(piece)
+    return pieces
+
+
+def clip_polygon(polygon, x_min, x_max):
+    # Sutherland-Hodgman against the two vertical lines x_min and x_max
+    for edge_x, keep_side in ((x_min, lambda x: x >= x_min), (x_max, lambda x: x <= x_max)):
+        clipped = []
+        for i in range(len(polygon)):
+            (xi, yi), (xj, yj) = polygon[i - 1], polygon[i]
+            if keep_side(xj):
+                if not keep_side(xi):
+                    clipped.append((edge_x, yi + (yj - yi) * (edge_x - xi) / (xj - xi)))
+                clipped.append((xj, yj))
+            elif keep_side(xi):
+                clipped.append((edge_x, yi + (yj - yi) * (edge_x - xi) / (xj - xi)))
+        polygon = clipped
+    return polygon
+
+
+class PlateAdjacency:
+    """Every border between two plates once, from the Voronoi ridges of the plate seeds.
+
+    plate_pairs holds the two plates either side of each border segment, segments its end points in pixels,
+    relative_velocity the direction of the second plate minus that of the first and segment_tiles the (x, y)
+    indices of the tiles the segment crosses.
+    """
 
-def get_plates():
-    plate_centers = get_points(NUM_PLATES, WIDTH, HEIGHT)
-    voronoi_polys = get_voronoi(plate_centers)
-    # Create a list of plates
+    def __init__(self, plate_pairs, segments, relative_velocity, segment_tiles):
+        self.plate_pairs = plate_pairs
+        self.segments = segments
+        self.relative_velocity = relative_velocity
+        self.segment_tiles = segment_tiles
+
+    def __len__(self):
+        return len(self.plate_pairs)
+
+    def neighbours(self, plate_index):
+        pairs = self.plate_pairs[np.any(self.plate_pairs == plate_index, axis=1)]
+        return set(pairs.ravel().tolist()) - {plate_index}
+
+    def boundary_mask(self, shape, reach=0, top=0, left=0):
+        # Tiles within reach tiles (in x and y) of a border segment, for the window of the map starting at row top
+        # and column left
+        rows, cols = shape
+        mask = np.zeros((rows + 2 * reach, cols + 2 * reach), dtype=bool)
+        for tiles in self.segment_tiles:
+            y = tiles[:, 1] - (top - reach)
+            x = tiles[:, 0] - (left - reach)
+            inside = (y >= 0) & (y < mask.shape[0]) & (x >= 0) & (x < mask.shape[1])
+            mask[y[inside], x[inside]] = True
+        if reach > 0:
+            mask = ndimage.maximum_filter(mask, size=2 * reach + 1, mode="constant", cval=False)
+        return mask[reach:reach + rows, reach:reach + cols]
+
+
+def get_plate_adjacency(plates, tiles, width=None, height=None):
+    """Builds the PlateAdjacency of plates on a width by height map, with segment tiles for a grid shaped like tiles.
+
+    The map size defaults to the size of the grid in pixels.
+    """
+    return build_plate_adjacency(plates, tiles.shape, tiles.pixel_width, width, height)
+
+
+def build_plate_adjacency(plates, shape, pixel_width, width=None, height=None):
+    # get_plate_adjacency for a rows by cols grid that doesn't have to exist
+    rows, cols = shape
+    width = cols * pixel_width if width is None else width
+    height = rows * pixel_width if height is None else height
+    voronoi, source, _ = wrapped_voronoi(plate_centers(plates), width, height)
+    plate_pairs, segments = voronoi_ridges(voronoi, source, width)
+    directions = plate_directions(plates)
+    relative_velocity = directions[plate_pairs[:, 1]] - directions[plate_pairs[:, 0]]
+
+    segment_tiles = segment_tile_indices(tile_segments(segments, pixel_width), shape)
+
+    return PlateAdjacency(plate_pairs, segments, relative_velocity, segment_tiles)
+
+
+# rng and perlin default to the random module and the module level noise, pass a random.Random and a seeded
+# GradientNoise to make the plates reproducible
+def get_plates(num_plates=NUM_PLATES, width=WIDTH, height=HEIGHT, pixel_width=PIXEL_WIDTH, rng=random, perlin=None):
+    plate_centers = get_points(num_plates, width, height, rng)
+    voronoi, _, seeded = wrapped_voronoi(plate_centers, width, height)
+    polygon_points, polygon_offsets = voronoi_polygons(voronoi, seeded, num_plates)
+    perlin = noise if perlin is None else perlin
+    # Plate densities sample the noise at the plate centers in tile coordinates, all in one call
+    scale = [width / pixel_width, height / pixel_width]
+    densities = perlin.sample(plate_centers[:, 0] / scale[0], plate_centers[:, 1] / scale[1])
+    # One angle and one color per plate, drawn in the order the Plate objects used to draw them
+    oceanic = densities > 0
+    angles = []
+    colors = []
+    for plate_oceanic in oceanic.tolist():
+        angles.append(rng.random() * 360)
+        colors.append(plate_color(plate_oceanic, rng))
+    directions = np.column_stack((np.cos(angles), np.sin(angles)))
+    # Normalized with the dot product np.linalg.norm takes of a single vector, which rounds differently from a sum
+    directions /= np.sqrt(directions[:, None, :] @ directions[:, :, None])[:, 0]
+    types = np.where(oceanic, PLATE_TYPES.index("OCEANIC"), PLATE_TYPES.index("CONTINENTAL")).astype(np.uint8)
+    return PlateTable(plate_centers.astype(np.float64), directions, densities.astype(np.float64), types,
+                      np.array(colors, dtype=np.uint8).reshape(-1, 4), polygon_points, polygon_offsets, width)
+
+
+def get_plates_reference(num_plates=NUM_PLATES, width=WIDTH, height=HEIGHT, pixel_width=PIXEL_WIDTH, rng=random,
+                         perlin=None):
+    # The original list of Plate objects made one by one, kept to check get_plates against
+    plate_centers = get_points(num_plates, width, height, rng)
+    voronoi_polys, _ = get_voronoi(plate_centers, width, height)
+    perlin = noise if perlin is None else perlin
+    scale = [width / pixel_width, height / pixel_width]
+    densities = perlin.sample(plate_centers[:, 0] / scale[0], plate_centers[:, 1] / scale[1])
     plates = []
-    # Define the x and y coordinates of the center of the plate
-    for i in range(NUM_PLATES):
-        # Generate the perlin noise value at the center of the plate
-        plate_middle = make_plate(i, plate_centers[i], voronoi_polys[i])
-        plate_left = make_plate(i, plate_centers[i], voronoi_polys[i + NUM_PLATES])
-        plate_right = make_plate(i, plate_centers[i], voronoi_polys[i + NUM_PLATES * 2])
-        plates.append(plate_middle)
-        plates.append(plate_left)
-        plates.append(plate_right)
+    for i in range(num_plates):
+        density = float(densities[i])
+        plates.append(make_plate(i, plate_centers[i], voronoi_polys[i], rng=rng, density=density,
+                                 pieces=wrap_polygon(voronoi_polys[i], width)))
 
     return plates
 
-def make_plate(index, center, polygon):
-    plate_center_noise = noise.noise(np.divide(center, [WIDTH / PIXEL_WIDTH, HEIGHT / PIXEL_WIDTH]))
-    # Set the value of plate_is_water based on the perlin noise value at the center of the plate
 
-    return Plate(index, center=center, density=plate_center_noise, polygon=polygon)
+def plate_color(oceanic, rng=random):
+    if oceanic:
+        return rng.randint(0, 20), rng.randint(0, 20), rng.randint(200, 255), 255
+    return rng.randint(0, 20), rng.randint(200, 255), rng.randint(0, 20), 255
+
+
+def plate_centers(plates):
+    # The (N, 2) centers of a PlateTable or a list of Plates, and likewise for the functions below
+    if isinstance(plates, PlateTable):
+        return plates.center
+    return np.array([plate.center for plate in plates], dtype=float).reshape(-1, 2)
+
+
+def plate_densities(plates):
+    if isinstance(plates, PlateTable):
+        return plates.density
+    return np.array([plate.density for plate in plates], dtype=float)
+
+
+def plate_colors(plates):
+    if isinstance(plates, PlateTable):
+        return plates.color
+    return np.array([plate.color for plate in plates], dtype=np.uint8).reshape(-1, 4)
+
+
+def plate_types(plates):
+    # Indices into PLATE_TYPES
+    if isinstance(plates, PlateTable):
+        return plates.type
+    return np.array([PLATE_TYPES.index(plate.type) for plate in plates], dtype=np.uint8)
+
+
+def plate_has_polygon(plates):
+    if isinstance(plates, PlateTable):
+        return np.diff(plates.polygon_offsets) > 0
+    return np.array([plate.polygon is not None for plate in plates], dtype=bool)
+
+
+class PlateTable:
+    """The plates of a map stored as one array per attribute instead of a list of Plate objects.
+
+    center and direction are (N, 2), density is (N,), type indexes PLATE_TYPES and color is (N, 4) RGBA. The Voronoi
+    polygons are all in one (V, 2) array, plate i's running from polygon_offsets[i] to polygon_offsets[i + 1], an
+    empty one for a plate without a polygon. Their pieces on the map are cut when asked for. Indexing a table gives a
+    PlateView, which behaves like a Plate but reads and writes the arrays, so the code working on single plates works
+    on both while whole-map stages index the arrays with a grid of plate indices.
+    """
+
+    def __init__(self, center, direction, density, types, color, polygon_points, polygon_offsets, width=WIDTH,
+                 ids=None):
+        self.center = center
+        self.direction = direction
+        self.density = density
+        self.type = types
+        self.color = color
+        self.polygon_points = polygon_points
+        self.polygon_offsets = polygon_offsets
+        # The map width the polygons wrap around
+        self.width = width
+        # Plate ids default to the plate indices
+        self.ids = ids
+
+    @staticmethod
+    def from_plates(plates, width=WIDTH):
+        polygons = [np.empty((0, 2)) if plate.polygon is None else np.asarray(plate.polygon, dtype=np.float64)
+                    for plate in plates]
+        offsets = np.zeros(len(plates) + 1, dtype=np.int64)
+        np.cumsum([len(polygon) for polygon in polygons], out=offsets[1:])
+        ids = [plate.id for plate in plates]
+        return PlateTable(plate_centers(plates).copy(), plate_directions(plates).copy(), plate_densities(plates).copy(),
+                          plate_types(plates), plate_colors(plates).copy(), np.concatenate(polygons + [np.empty((0, 2))]), offsets,
+                          width, None if ids == list(range(len(plates))) else ids)
+
+    def polygon(self, index):
+        start, stop = self.polygon_offsets[index], self.polygon_offsets[index + 1]
+        return self.polygon_points[start:stop] if stop > start else None
+
+    def set_polygons(self, polygon_points, polygon_offsets):
+        self.polygon_points = polygon_points
+        self.polygon_offsets = polygon_offsets
+
+    def __len__(self):
+        return len(self.center)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(f"Plate {index} out of range")
+        return PlateView(self, int(index))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield PlateView(self, index)
+
+
+class PlateView:
+    """A Plate-like accessor for a single plate of a PlateTable."""
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def id(self):
+        return self.index if self.table.ids is None else self.table.ids[self.index]
+
+    @property
+    def center(self):
+        return self.table.center[self.index]
+
+    @center.setter
+    def center(self, center):
+        self.table.center[self.index] = center
+
+    @property
+    def direction(self):
+        return self.table.direction[self.index]
+
+    @direction.setter
+    def direction(self, direction):
+        self.table.direction[self.index] = direction
+
+    @property
+    def density(self):
+        return float(self.table.density[self.index])
+
+    @density.setter
+    def density(self, density):
+        self.table.density[self.index] = density
+
+    @property
+    def type(self):
+        return PLATE_TYPES[self.table.type[self.index]]
+
+    @type.setter
+    def type(self, plate_type):
+        self.table.type[self.index] = PLATE_TYPES.index(plate_type)
+
+    @property
+    def color(self):
+        return tuple(int(c) for c in self.table.color[self.index])
+
+    @color.setter
+    def color(self, color):
+        self.table.color[self.index] = color
+
+    @property
+    def polygon(self):
+        return self.table.polygon(self.index)
+
+    @property
+    def pieces(self):
+        return wrap_polygon(self.polygon, self.table.width)
+
+    def set_type_and_color(self, rng=random):
+        self.type = "OCEANIC" if self.density > 0 else "CONTINENTAL"
+        self.color = plate_color(self.density > 0, rng)
+
+    def __str__(self):
+        return f"Plate {self.id} at {self.center} with direction {self.direction}"
+
+
+def make_plate(index, center, polygon, rng=random, density=None, pieces=None):
+    if density is None:
+        # Set the value of plate_is_water based on the perlin noise value at the center of the plate
+        density = noise.noise(np.divide(center, [WIDTH / PIXEL_WIDTH, HEIGHT / PIXEL_WIDTH]))
+
+    return Plate(index, center=center, density=density, polygon=polygon, pieces=pieces, rng=rng)
 
 class Plate:
-    def __init__(self, plate_id, center, density, polygon):
+    def __init__(self, plate_id, center, density, polygon, pieces=None, rng=random):
         self.type = None
         self.color = None
         self.id = plate_id
         self.center = center
         self.density = density
-        angle = random.random() * 360
+        angle = rng.random() * 360
         self.direction = np.array([np.cos(angle), np.sin(angle)])
         norm = np.linalg.norm(self.direction)
         self.direction = self.direction / norm
-        self.set_type_and_color()
+        self.set_type_and_color(rng)
+        # The Voronoi region around the center, which can reach over the seams, and its pieces on the map
         self.polygon = polygon
+        self.pieces = ([] if polygon is None else [polygon]) if pieces is None else pieces
 
-    def set_type_and_color(self):
-        if self.density > 0:
-            self.type = "OCEANIC"
-            self.color = (random.randint(0, 20), random.randint(0, 20), random.randint(200, 255), 255)
-        else:
-            self.type = "CONTINENTAL"
-            self.color = (random.randint(0, 20), random.randint(200, 255), random.randint(0, 20), 255)
+    def set_type_and_color(self, rng=random):
+        self.type = "OCEANIC" if self.density > 0 else "CONTINENTAL"
+        self.color = plate_color(self.density > 0, rng)
 
     def __str__(self):
         return f"Plate {self.id} at {self.center} with direction {self.direction}"
@@ -0,0 +1,139 @@
+import numpy as np
+from scipy import ndimage
+
+from Shapes import TerrainGrid
+
+
+class WorldIndex:
+    """Point, rectangle, radius and nearest boundary queries over a generated world.
+
+    The tile grid itself is the index: tile (col, row) covers map pixels col * pixel_width to (col + 1) * pixel_width
+    across and the same down, like get_tile_at_point, so the tiles under a point or a rectangle follow from a division
+    and the plate under them is a lookup in plate_index. Nothing is built up front and no query changes the grid, so
+    it works just as well over the memory mapped tiles of a WorldFile. The map wraps around in x like the plates do,
+    so x is taken modulo the map width and rectangles and circles reaching over the left or right edge continue on
+    the other side. Points above or below the map are outside of it.
+
+    Every point query also comes in a batch form taking an (N, 2) array of points, which is how thousands of queries
+    are answered in a millisecond.
+    """
+
+    def __init__(self, tiles: TerrainGrid, plates):
+        self.tiles = tiles
+        self.plates = plates
+        self.pixel_width = tiles.pixel_width
+        self.rows, self.cols = tiles.shape
+        self.distances = None
+        self.nearest = None
+
+    def tile_indices(self, points):
+        # The rows and columns of the tiles under an (N, 2) array of map pixels, -1 rows for points off the map
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        cols = np.floor_divide(points[:, 0], self.pixel_width).astype(np.int64) % self.cols
+        rows = np.floor_divide(points[:, 1], self.pixel_width).astype(np.int64)
+        rows[(rows < 0) | (rows >= self.rows)] = -1
+        return rows, cols
+
+    def plates_at(self, points):
+        # The plate index under each point, -1 off the map
+        rows, cols = self.tile_indices(points)
+        inside = rows >= 0
+        labels = np.full(len(rows), -1, dtype=np.int64)
+        labels[inside] = self.tiles.plate_index[rows[inside], cols[inside]]
+        return labels
+
+    def plate_at(self, x, y):
+        # The Plate under a map pixel, None off the map
+        label = self.plates_at((x, y))[0]
+        return self.plates[label] if label >= 0 else None
+
+    def tile_at(self, x, y):
+        # The TerrainTileView under a map pixel, None off the map
+        rows, cols = self.tile_indices((x, y))
+        return self.tiles.tile(cols[0], rows[0]) if rows[0] >= 0 else None
+
+    def tiles_in_rect(self, x, y, width, height):
+        """The rows and columns of the tiles overlapping a rectangle of map pixels, row by row.
+
+        A tile overlaps if any part of it lies inside the rectangle, edges excluded, so a rectangle ending exactly on
+        a tile border does not take in the tile after it.
+        """
+        rows, cols = self.rect_window(x, y, width, height)
+        grid_rows, grid_cols = np.meshgrid(rows, cols % self.cols, indexing="ij")
+        return grid_rows.ravel(), grid_cols.ravel()
+
+    def tiles_in_radius(self, x, y, radius):
+        # The rows and columns of the tiles any part of which lies within radius map pixels of (x, y)
+        rows, cols = self.rect_window(x - radius, y - radius, 2 * radius, 2 * radius)
+        # How far the point is from the nearest pixel of each tile row and column, 0 if it lies within it
+        pixel_width = self.pixel_width
+        dx = np.maximum(np.maximum(cols * pixel_width - x, x - (cols + 1) * pixel_width), 0)
+        dy = np.maximum(np.maximum(rows * pixel_width - y, y - (rows + 1) * pixel_width), 0)
+        inside = dy[:, None] ** 2 + dx[None, :] ** 2 <= radius ** 2
+        row_indices, col_indices = np.nonzero(inside)
+        return rows[row_indices], cols[col_indices] % self.cols
+
+    def rect_window(self, x, y, width, height):
+        # The tile rows, clipped to the map, and the unwrapped tile columns a rectangle overlaps
+        pixel_width = self.pixel_width
+        first_col = int(np.floor(x / pixel_width))
+        last_col = max(first_col, int(np.ceil((x + width) / pixel_width)) - 1)
+        # A rectangle wider than the map holds every column once
+        last_col = min(last_col, first_col + self.cols - 1)
+        first_row = int(np.floor(y / pixel_width))
+        last_row = min(self.rows - 1, max(first_row, int(np.ceil((y + height) / pixel_width)) - 1))
+        first_row = max(0, first_row)
+        return np.arange(first_row, last_row + 1), np.arange(first_col, last_col + 1)
+
+    def plates_in_rect(self, x, y, width, height):
+        # The indices of the plates a rectangle of map pixels touches
+        rows, cols = self.tiles_in_rect(x, y, width, height)
+        labels = np.unique(self.tiles.plate_index[rows, cols])
+        return labels[labels >= 0]
+
+    def boundary_mask(self):
+        # Tiles with a 4-neighbour on another plate, the left and right edges are neighbours of each other
+        labels = self.tiles.plate_index
+        boundary = labels != np.roll(labels, 1, axis=1)
+        boundary |= labels != np.roll(labels, -1, axis=1)
+        boundary[1:] |= labels[1:] != labels[:-1]
+        boundary[:-1] |= labels[:-1] != labels[1:]
+        return boundary
+
+    def build_boundary_distances(self):
+        """Works out the nearest boundary tile of every tile with one Euclidean distance transform.
+
+        The transform runs over three copies of the boundary mask side by side and keeps the middle one, the nearest
+        boundary around the wrap is never more than half a map away, so the answers are the same as on a map that
+        wraps around.
+        """
+        boundary = self.boundary_mask()
+        if not boundary.any():
+            self.distances = np.full(self.tiles.shape, np.inf, dtype=np.float32)
+            self.nearest = np.full((2,) + self.tiles.shape, -1, dtype=np.int32)
+            return
+        distances, nearest = ndimage.distance_transform_edt(~np.tile(boundary, 3), return_indices=True)
+        middle = slice(self.cols, 2 * self.cols)
+        self.distances = (distances[:, middle] * self.pixel_width).astype(np.float32)
+        nearest = nearest[:, :, middle].astype(np.int32)
+        nearest[1] %= self.cols
+        self.nearest = nearest
+
+    def nearest_boundaries(self, points):
+        """The row and column of the nearest plate boundary tile to the tile under each point and how far apart their
+        centers are in map pixels, -1 and inf for points off the map or on a map with a single plate."""
+        if self.distances is None:
+            self.build_boundary_distances()
+        rows, cols = self.tile_indices(points)
+        inside = rows >= 0
+        boundary_rows = np.full(len(rows), -1, dtype=np.int64)
+        boundary_cols = np.full(len(rows), -1, dtype=np.int64)
+        distances = np.full(len(rows), np.inf)
+        boundary_rows[inside] = self.nearest[0, rows[inside], cols[inside]]
+        boundary_cols[inside] = self.nearest[1, rows[inside], cols[inside]]
+        distances[inside] = self.distances[rows[inside], cols[inside]]
+        return boundary_rows, boundary_cols, distances
+
+    def nearest_boundary(self, x, y):
+        rows, cols, distances = self.nearest_boundaries((x, y))
+        return int(rows[0]), int(cols[0]), float(distances[0])
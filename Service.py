@@ -0,0 +1,293 @@
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from Query import WorldIndex
+from World import WorldGenerator, WorldConfig, MemoryStore, STAGE_CACHE_SIZE
+from WorldFile import save_world, open_world
+
+HOST = "127.0.0.1"
+PORT = 8765
+WORLD_DIR = ".worlds"
+# Opened worlds with their query index the service keeps
+INDEX_CACHE_SIZE = 16
+# Requests the latency percentiles are taken over, per operation
+LATENCY_WINDOW = 1000
+# World files kept in the world directory, the least recently asked for go first
+WORLD_FILE_LIMIT = 256
+
+# The stage cache of the worker process, set up by warm_worker
+worker_store = None
+
+
+def warm_worker(cache_size):
+    # Runs once in every worker process, generating a small world pulls in everything the pipeline touches so the
+    # first request doesn't pay for it
+    global worker_store
+    worker_store = MemoryStore(cache_size)
+    WorldGenerator(0, WorldConfig(num_plates=4, width=100, height=100)).generate()
+
+
+def generate_world_file(seed, config, path):
+    # Runs in a worker process, stages of earlier requests come out of the worker's memory store
+    generator = WorldGenerator(seed, config, worker_store)
+    tiles, plates = generator.generate()
+    temp_path = path + ".partial"
+    save_world(temp_path, tiles, plates, seed, config.width, config.height, config)
+    os.replace(temp_path, path)
+    return {"timings": generator.timings, "cached_stages": sorted(generator.cached_stages)}
+
+
+class WorldService:
+    """Generates worlds on a pool of warm worker processes and answers queries about them.
+
+    Every worker is its own single process pool and a seed always goes to the same one, so the stage outputs it keeps
+    in its MemoryStore get reused by later requests for the same seed, a request that only changes the blur reuses the
+    plates and tiles. Finished worlds are .world files under world_dir named after the key of their last stage, which
+    clients memory map, so the grids are shared through the page cache instead of being copied. A world asked for
+    again is answered from its file and requests for a world that is being generated wait for the same job. Past
+    world_limit files the ones asked for least recently are deleted, a client that has one mapped keeps its pages.
+    """
+
+    def __init__(self, workers=None, world_dir=WORLD_DIR, cache_size=STAGE_CACHE_SIZE, world_limit=WORLD_FILE_LIMIT):
+        self.world_dir = world_dir
+        self.world_limit = world_limit
+        os.makedirs(world_dir, exist_ok=True)
+        self.pools = [ProcessPoolExecutor(1, initializer=warm_worker, initargs=(cache_size,))
+                      for _ in range(workers or os.cpu_count())]
+        # Start the workers now rather than on the first request
+        for pool in self.pools:
+            pool.submit(int).result()
+        self.lock = threading.Lock()
+        self.jobs = {}
+        # World files in use by index, evict leaves them alone
+        self.pins = defaultdict(int)
+        self.queued = [0] * len(self.pools)
+        self.indexes = OrderedDict()
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self.counts = defaultdict(int)
+        self.started = time.time()
+
+    def path(self, key):
+        return os.path.join(self.world_dir, key + ".world")
+
+    def generate(self, seed, config, pin=False):
+        # Returns the path of the world file and whether it was already there, with pin the file is kept until unpin
+        key = WorldGenerator(seed, config).stage_keys()["edges"]
+        path = self.path(key)
+        with self.lock:
+            if pin:
+                self.pins[path] += 1
+            job = self.jobs.get(key)
+            if job is None:
+                if os.path.exists(path):
+                    self.counts["file_hits"] += 1
+                    # The modification time orders the files for evict
+                    os.utime(path)
+                    return path, {"cached": True}
+                shard = seed % len(self.pools)
+                job = self.pools[shard].submit(generate_world_file, seed, config, path)
+                self.jobs[key] = job
+                self.queued[shard] += 1
+                new_job = True
+            else:
+                new_job = False
+        if new_job:
+            # Outside the lock, the callback runs right away if the job is already done
+            job.add_done_callback(lambda _: self.finish(key, shard))
+        try:
+            return path, {"cached": False, **job.result()}
+        except BaseException:
+            if pin:
+                self.unpin(path)
+            raise
+
+    def unpin(self, path):
+        with self.lock:
+            self.pins[path] -= 1
+            if not self.pins[path]:
+                del self.pins[path]
+
+    def finish(self, key, shard):
+        with self.lock:
+            del self.jobs[key]
+            self.queued[shard] -= 1
+        self.evict()
+
+    def evict(self):
+        # Scanned and deleted under the lock, so a file generate just touched or index has pinned is never deleted
+        with self.lock:
+            files = sorted((entry.stat().st_mtime_ns, entry.path) for entry in os.scandir(self.world_dir)
+                           if entry.name.endswith(".world"))
+            excess = len(files) - self.world_limit
+            unpinned = [path for _, path in files if path not in self.pins]
+            for path in unpinned[:max(0, excess)]:
+                self.indexes.pop(path, None)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def index(self, seed, config):
+        path, _ = self.generate(seed, config, pin=True)
+        try:
+            return self.open_index(path)
+        finally:
+            self.unpin(path)
+
+    def open_index(self, path):
+        with self.lock:
+            index = self.indexes.get(path)
+            if index is not None:
+                self.indexes.move_to_end(path)
+                return index
+        world = open_world(path)
+        index = WorldIndex(world.tiles, world.plates)
+        with self.lock:
+            self.indexes[path] = index
+            while len(self.indexes) > INDEX_CACHE_SIZE:
+                self.indexes.popitem(last=False)
+        return index
+
+    def query(self, seed, config, kind, args):
+        index = self.index(seed, config)
+        if kind == "plate":
+            return {"plates": index.plates_at(args["points"]).tolist()}
+        if kind == "boundary":
+            rows, cols, distances = index.nearest_boundaries(args["points"])
+            return {"rows": rows.tolist(), "cols": cols.tolist(), "distances": distances.tolist()}
+        if kind == "rect":
+            rows, cols = index.tiles_in_rect(args["x"], args["y"], args["width"], args["height"])
+            return {"rows": rows.tolist(), "cols": cols.tolist()}
+        if kind == "radius":
+            rows, cols = index.tiles_in_radius(args["x"], args["y"], args["radius"])
+            return {"rows": rows.tolist(), "cols": cols.tolist()}
+        raise ValueError(f"Unknown query {kind}")
+
+    def record(self, operation, seconds):
+        with self.lock:
+            self.counts[operation] += 1
+            self.latencies[operation].append(seconds)
+
+    def metrics(self):
+        with self.lock:
+            latencies = {operation: {
+                "count": len(window),
+                "p50_ms": 1000 * float(np.percentile(window, 50)),
+                "p95_ms": 1000 * float(np.percentile(window, 95)),
+                "max_ms": 1000 * max(window),
+            } for operation, window in self.latencies.items() if window}
+            return {
+                "uptime": time.time() - self.started,
+                "workers": len(self.pools),
+                "queue_depth": sum(self.queued),
+                "queue_depth_per_worker": list(self.queued),
+                "requests": dict(self.counts),
+                "latency": latencies,
+                "open_indexes": len(self.indexes),
+            }
+
+    def shutdown(self):
+        for pool in self.pools:
+            pool.shutdown()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """JSON over HTTP: POST /generate and /query with a seed and config, GET /metrics and /health."""
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.reply(200, self.server.service.metrics())
+        elif self.path == "/health":
+            self.reply(200, {"ok": True})
+        else:
+            self.reply(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        operation = self.path.strip("/")
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            seed = int(request["seed"])
+            config = WorldConfig(**request.get("config", {}))
+            if operation == "generate":
+                path, info = self.server.service.generate(seed, config)
+                response = {"path": os.path.abspath(path), **info}
+            elif operation == "query":
+                response = self.server.service.query(seed, config, request["kind"], request)
+            else:
+                self.reply(404, {"error": f"Unknown path {self.path}"})
+                return
+        except (KeyError, TypeError, ValueError) as error:
+            self.reply(400, {"error": f"{type(error).__name__}: {error}"})
+            return
+        except Exception as error:
+            # The job failed on the worker side, a broken pool, a full disk or an output that doesn't pickle
+            self.reply(500, {"error": f"{type(error).__name__}: {error}"})
+            return
+        seconds = time.perf_counter() - start
+        self.server.service.record(operation, seconds)
+        self.reply(200, {**response, "latency_ms": 1000 * seconds})
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Every request ends up in the metrics, don't print a line for each
+        pass
+
+
+def make_server(service, host=HOST, port=PORT):
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.service = service
+    return server
+
+
+class ServiceError(Exception):
+    """Raised by ServiceClient when the service answers with an error."""
+
+
+class ServiceClient:
+    """Talks to a running WorldService, worlds come back as WorldFiles mapping the service's files."""
+
+    def __init__(self, url=f"http://{HOST}:{PORT}", timeout=None):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def call(self, path, body=None):
+        data = None if body is None else json.dumps(body).encode()
+        request = urllib.request.Request(self.url + path, data, {"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            raise ServiceError(json.loads(error.read()).get("error", str(error))) from None
+
+    def generate_path(self, seed, config=None):
+        return self.call("/generate", {"seed": seed, "config": config_dict(config)})
+
+    def generate(self, seed, config=None):
+        return open_world(self.generate_path(seed, config)["path"])
+
+    def query(self, seed, kind, config=None, **args):
+        return self.call("/query", {"seed": seed, "config": config_dict(config), "kind": kind, **args})
+
+    def metrics(self):
+        return self.call("/metrics")
+
+
+def config_dict(config):
+    return {} if config is None else config.as_dict()
@@ -1,5 +1,30 @@
 from random import randint
 
+import numpy as np
+
+# Surface types in the order they are stored in TerrainGrid.surface
+SURFACES = ("WATER", "GRASS")
+HIGHLIGHT_COLOR = (255, 0, 0, 255)
+
+
+def random_surface_color(surface):
+    match surface:
+        case "WATER":
+            return 0, 0, randint(200, 255), 255
+        case "GRASS":
+            return 0, randint(200, 255), 0, 255
+        case _:
+            raise ValueError(f"Invalid surface {surface}")
+
+
+def pack_colors(color):
+    # Turns an (..., 4) uint8 RGBA array into one uint32 color ID per tile
+    return np.ascontiguousarray(color, dtype=np.uint8).view(np.uint32)[..., 0]
+
+
+def unpack_colors(color_ids):
+    return np.ascontiguousarray(color_ids, dtype=np.uint32)[..., None].view(np.uint8)
+
 
 class TerrainTile:
     def __init__(self, x: int, y: int, width: int, height: int, surface: str, color, plate_index: int = None):
@@ -28,13 +53,158 @@ class TerrainTile:
         if color is not None:
             self.color = color
 
-        match surface:
-            case "WATER":
-                self.color = (0, 0, randint(200, 255), 255)
-            case "GRASS":
-                self.color = (0, randint(200, 255), 0, 255)
-            case _:
-                raise ValueError(f"Invalid surface {surface}")
+        self.color = random_surface_color(surface)
+
+
+class TerrainGrid:
+    """A map of terrain tiles stored as one typed array per attribute instead of an array of TerrainTile objects.
+
+    Tile positions and sizes are not stored, they follow from the row/column and pixel_width. Indexing a grid as
+    grid[y][x] gives a TerrainTileView, which behaves like a TerrainTile but reads and writes the arrays.
+    """
+
+    def __init__(self, rows, cols, pixel_width, plate_index=None, surface=None, color=None, highlight=None):
+        self.pixel_width = pixel_width
+        self.plate_index = np.full((rows, cols), -1, dtype=np.int16) if plate_index is None else plate_index
+        # Index into SURFACES
+        self.surface = np.zeros((rows, cols), dtype=np.uint8) if surface is None else surface
+        # RGBA
+        self.color = np.zeros((rows, cols, 4), dtype=np.uint8) if color is None else color
+        self.highlight = np.zeros((rows, cols), dtype=bool) if highlight is None else highlight
+
+    @property
+    def shape(self):
+        return self.plate_index.shape
+
+    @property
+    def nbytes(self):
+        return self.plate_index.nbytes + self.surface.nbytes + self.color.nbytes + self.highlight.nbytes
+
+    def copy(self):
+        return TerrainGrid(*self.shape, self.pixel_width, self.plate_index.copy(), self.surface.copy(),
+                           self.color.copy(), self.highlight.copy())
+
+    def tile(self, x, y):
+        return TerrainTileView(self, x, y)
+
+    def band(self, start, stop):
+        # A grid of rows start to stop that shares this grid's arrays
+        return TerrainGrid(stop - start, self.shape[1], self.pixel_width, self.plate_index[start:stop],
+                           self.surface[start:stop], self.color[start:stop], self.highlight[start:stop])
+
+    def crop(self, top, left, rows, cols):
+        # A copy of the rows by cols tiles starting at row top and column left
+        window = (slice(top, top + rows), slice(left, left + cols))
+        return TerrainGrid(rows, cols, self.pixel_width, self.plate_index[window].copy(), self.surface[window].copy(),
+                           self.color[window].copy(), self.highlight[window].copy())
+
+    def image(self, show_highlight=True):
+        # One RGBA pixel per tile, highlighted tiles drawn in HIGHLIGHT_COLOR
+        if not show_highlight:
+            return self.color
+        return np.where(self.highlight[..., None], np.array(HIGHLIGHT_COLOR, dtype=np.uint8), self.color)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, y):
+        if not 0 <= y < self.shape[0]:
+            raise IndexError(f"Row {y} out of range")
+        return TerrainGridRow(self, y)
+
+    def __iter__(self):
+        for y in range(self.shape[0]):
+            yield TerrainGridRow(self, y)
+
+
+class TerrainGridRow:
+    def __init__(self, grid, y):
+        self.grid = grid
+        self.y = y
+
+    def __len__(self):
+        return self.grid.shape[1]
+
+    def __getitem__(self, x):
+        if not 0 <= x < self.grid.shape[1]:
+            raise IndexError(f"Column {x} out of range")
+        return TerrainTileView(self.grid, x, self.y)
+
+    def __iter__(self):
+        for x in range(self.grid.shape[1]):
+            yield TerrainTileView(self.grid, x, self.y)
+
+
+class TerrainTileView:
+    """A TerrainTile-like accessor for a single tile of a TerrainGrid."""
+
+    def __init__(self, grid, col, row):
+        self.grid = grid
+        self.col = col
+        self.row = row
+
+    @property
+    def x(self):
+        return self.col * self.grid.pixel_width - self.grid.pixel_width // 2
+
+    @property
+    def y(self):
+        return self.row * self.grid.pixel_width - self.grid.pixel_width // 2
+
+    @property
+    def width(self):
+        return self.grid.pixel_width
+
+    @property
+    def height(self):
+        return self.grid.pixel_width
+
+    @property
+    def plate_index(self):
+        return int(self.grid.plate_index[self.row, self.col])
+
+    @plate_index.setter
+    def plate_index(self, plate_index):
+        self.grid.plate_index[self.row, self.col] = plate_index
+
+    @property
+    def surface(self):
+        return SURFACES[self.grid.surface[self.row, self.col]]
+
+    @surface.setter
+    def surface(self, surface):
+        self.grid.surface[self.row, self.col] = SURFACES.index(surface)
+
+    @property
+    def color(self):
+        return tuple(int(c) for c in self.grid.color[self.row, self.col])
+
+    @color.setter
+    def color(self, color):
+        self.grid.color[self.row, self.col] = color
+
+    @property
+    def highlight(self):
+        return bool(self.grid.highlight[self.row, self.col])
+
+    @highlight.setter
+    def highlight(self, highlight):
+        self.grid.highlight[self.row, self.col] = highlight
+
+    def __copy__(self):
+        tile = TerrainTile(self.x, self.y, self.width, self.height, self.surface, self.color, self.plate_index)
+        tile.highlight = self.highlight
+        return tile
+
+    def __str__(self):
+        return f"{self.highlight} for HL, TerrainTile at ({self.x}, {self.y}) terrain of type {self.surface}"
+
+    def __eq__(self, other):
+        return self.x == other.x and self.y == other.y
+
+    def change_surface(self, surface, color=None):
+        self.surface = surface
+        self.color = random_surface_color(surface)
 
 
 class Rectangle:
@@ -52,7 +222,7 @@ class QuadTree:
         self.rectangles = []
 
     def get_rectangles(self):
-        plate_indices = self.rectangles
+        plate_indices = list(self.rectangles)
 
         if self.nodes:
             for node in self.nodes:
@@ -82,13 +252,14 @@ class QuadTree:
         if self.nodes is None:
             x = self.bounds.x
             y = self.bounds.y
-            width = self.bounds.WIDTH
-            height = self.bounds.HEIGHT
+            width = self.bounds.width
+            height = self.bounds.height
 
             half_width = width // 2
             half_height = height // 2
 
-            self.nodes = list({
+            # In the order get_index numbers the quadrants
+            self.nodes = [
                 QuadTree(
                     Rectangle(x, y, half_width, half_height),
                 ),
@@ -101,7 +272,7 @@ class QuadTree:
                 QuadTree(
                     Rectangle(x + half_width, y + half_height, half_width, half_height)
                 )
-            })
+            ]
 
         i = 0
         while i < len(self.rectangles):
@@ -114,43 +285,49 @@ class QuadTree:
             i += 1
 
     def move_rectangles(self, plates):
-        # Move the rectangles stored in this node
-        for rect, plate_index in self.rectangles:
+        # Collect everything first, moved rectangles are reinserted from the root and may land in nodes not
+        # visited yet
+        for rect, plate_index in self.get_rectangles():
             direction = plates[plate_index].direction
             new_x = rect.x + direction[0]
             new_y = rect.y + direction[1]
             self.move_rectangle((rect, plate_index), new_x, new_y)
 
-        # Move the rectangles stored in the child nodes
-        if self.nodes:
-            for node in self.nodes:
-                node.move_rectangles(plates)
-
     def move_rectangle(self, rectangle, new_x, new_y):
-        rect, plate_index = rectangle
         # Remove the rectangle from its current position in the quadtree
-        self.rectangles = [r for r in self.rectangles if r[0] != rectangle[0]]
-        if self.nodes:
-            for node in self.nodes:
-                node.rectangles = [r for r in node.rectangles if r[0] != rectangle[0]]
+        self.remove(rectangle)
 
         # Update the rectangle's position
+        rect, plate_index = rectangle
         rect.x = new_x
         rect.y = new_y
 
         # Insert the rectangle into the quadtree at its new position
         self.insert(rectangle)
 
+    def remove(self, rectangle):
+        # Follows the same path insert took, so only the nodes along one branch are touched
+        rect = rectangle[0]
+        if self.nodes is not None:
+            index = self.get_index(rect)
+            if index != -1 and self.nodes[index].remove(rectangle):
+                return True
+        for i, (r, _) in enumerate(self.rectangles):
+            if r is rect:
+                self.rectangles.pop(i)
+                return True
+        return False
+
     def get_index(self, rectangle):
         is_inside_bounds = rectangle.x > self.bounds.x and rectangle.y > self.bounds.y and \
-                           rectangle.x + rectangle.WIDTH < self.bounds.x + self.bounds.WIDTH and \
-                           rectangle.y + rectangle.HEIGHT < self.bounds.y + self.bounds.HEIGHT
+                           rectangle.x + rectangle.width < self.bounds.x + self.bounds.width and \
+                           rectangle.y + rectangle.height < self.bounds.y + self.bounds.height
         if not is_inside_bounds:
             return -1
-        is_top_quadrant = (rectangle.y + rectangle.HEIGHT) < self.bounds.y + self.bounds.HEIGHT / 2
-        is_bottom_quadrant = rectangle.y > self.bounds.y + self.bounds.HEIGHT / 2
-        is_left_quadrant = (rectangle.x + rectangle.WIDTH) < self.bounds.x + self.bounds.WIDTH / 2
-        is_right_quadrant = rectangle.x > self.bounds.x + self.bounds.WIDTH / 2
+        is_top_quadrant = (rectangle.y + rectangle.height) < self.bounds.y + self.bounds.height / 2
+        is_bottom_quadrant = rectangle.y > self.bounds.y + self.bounds.height / 2
+        is_left_quadrant = (rectangle.x + rectangle.width) < self.bounds.x + self.bounds.width / 2
+        is_right_quadrant = rectangle.x > self.bounds.x + self.bounds.width / 2
 
         if is_left_quadrant and is_top_quadrant:
             # top left
@@ -179,17 +356,17 @@ class QuadTree:
             if self.rectangles_overlap(r, rect):
                 return True
         # check if the rectangle is colliding with any of the rectangles in the child quads
-        for node in self.nodes:
-            if node is not None and node.is_colliding(rectangle):
+        for node in self.nodes or []:
+            if node.is_colliding(rectangle):
                 return True
         return False
 
     @staticmethod
     def rectangles_overlap(rect1, rect2):
         # Check if the x-coordinates of the rectangles overlap
-        x_overlap = rect1.x <= rect2.x + rect2.WIDTH and rect2.x <= rect1.x + rect1.WIDTH
+        x_overlap = rect1.x <= rect2.x + rect2.width and rect2.x <= rect1.x + rect1.width
         # Check if the y-coordinates of the rectangles overlap
-        y_overlap = rect1.y <= rect2.y + rect2.HEIGHT and rect2.y <= rect1.y + rect1.HEIGHT
+        y_overlap = rect1.y <= rect2.y + rect2.height and rect2.y <= rect1.y + rect1.height
         # Return true if both x and y overlap, false otherwise
         return x_overlap and y_overlap
 
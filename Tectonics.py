@@ -0,0 +1,107 @@
+import numpy as np
+
+from Plates import plate_directions, plate_densities
+from Shapes import SURFACES
+
+# Tiles a plate moves per step at full speed
+PLATE_SPEED = 0.5
+# Color of the fresh crust left behind where plates pull apart
+NEW_CRUST_COLOR = (0, 0, 160, 255)
+
+
+class TectonicSimulation:
+    """Drifts plates along Plate.direction on a TerrainGrid, one step at a time.
+
+    The grid itself is the spatial hash: plate_index holds the owner of every tile, so finding what a moved tile
+    lands on, taking it off its old tile and putting it on its new one are all array lookups. Each step only moves
+    the plates whose accumulated motion crossed a whole tile and only writes the tiles that changed.
+
+    Where tiles of different plates land on the same spot the boundary is convergent: the lighter plate stays on top,
+    the other one is subducted and stress builds up. Tiles a plate moves away from without anything moving in are
+    divergent and become new crust of that plate. The map wraps around horizontally like the plate seeds do.
+    """
+
+    def __init__(self, tiles, plates, speed=PLATE_SPEED):
+        self.tiles = tiles
+        self.plates = plates
+        self.velocity = plate_directions(plates) * speed
+        self.density = plate_densities(plates).astype(float)
+        self.offset = np.zeros_like(self.velocity)
+        # Convergent steps add to a tile's stress, divergent ones take away from it
+        self.stress = np.zeros(tiles.shape)
+        self.convergent = np.zeros(tiles.shape, dtype=bool)
+        self.divergent = np.zeros(tiles.shape, dtype=bool)
+        # Flat indices of the tiles the last step wrote
+        self.changed = np.empty(0, dtype=np.int64)
+        self.steps = 0
+
+    def run(self, steps):
+        for _ in range(steps):
+            self.step()
+        return self.tiles
+
+    def step(self):
+        self.steps += 1
+        self.convergent[:] = False
+        self.divergent[:] = False
+        self.changed = np.empty(0, dtype=np.int64)
+
+        self.offset += self.velocity
+        shift = np.trunc(self.offset).astype(np.int64)
+        self.offset -= shift
+
+        owner = self.tiles.plate_index
+        rows, cols = owner.shape
+        tile_shift = np.where((owner >= 0)[..., None], shift[owner], 0)
+        moving = np.any(tile_shift != 0, axis=-1)
+        if not moving.any():
+            return
+
+        source_y, source_x = np.nonzero(moving)
+        dx, dy = tile_shift[source_y, source_x].T
+        target_y = source_y + dy
+        target_x = (source_x + dx) % cols
+        # Tiles pushed over the top or bottom edge are gone
+        on_map = (target_y >= 0) & (target_y < rows)
+        sources = (source_y * cols + source_x)[on_map]
+        targets = (target_y * cols + target_x)[on_map]
+
+        # Every target is fought over by the tiles moving onto it and the tile already there if that one stays put
+        held = np.unique(targets[~moving.reshape(-1)[targets]])
+        candidate_sources = np.concatenate((sources, held))
+        candidate_targets = np.concatenate((targets, held))
+        flat_owner = owner.reshape(-1)
+        candidate_plates = flat_owner[candidate_sources]
+
+        # The lightest plate wins, the lowest plate index breaks ties
+        order = np.lexsort((candidate_plates, self.density[candidate_plates], candidate_targets))
+        ordered_targets = candidate_targets[order]
+        ordered_plates = candidate_plates[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = ordered_targets[1:] != ordered_targets[:-1]
+        starts = np.flatnonzero(first)
+        winners = candidate_sources[order][starts]
+        written = ordered_targets[starts]
+        plates_there = np.minimum.reduceat(ordered_plates, starts) != np.maximum.reduceat(ordered_plates, starts)
+        collided = written[plates_there]
+
+        # Tiles that were moved away from and nothing moved onto
+        vacated = np.setdiff1d(np.flatnonzero(moving), written, assume_unique=True)
+
+        self.write(written, winners)
+        self.tiles.surface.reshape(-1)[vacated] = SURFACES.index("WATER")
+        self.tiles.color.reshape(-1, 4)[vacated] = NEW_CRUST_COLOR
+
+        self.convergent.reshape(-1)[collided] = True
+        self.divergent.reshape(-1)[vacated] = True
+        self.stress.reshape(-1)[collided] += 1
+        self.stress.reshape(-1)[vacated] -= 1
+        self.changed = np.concatenate((written, vacated))
+
+    def write(self, targets, sources):
+        # Gather every attribute before writing, targets and sources overlap
+        for array in (self.tiles.plate_index, self.tiles.surface, self.tiles.highlight):
+            flat = array.reshape(-1)
+            flat[targets] = flat[sources]
+        colors = self.tiles.color.reshape(-1, 4)
+        colors[targets] = colors[sources]
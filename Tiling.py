@@ -0,0 +1,48 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Rows of the grid every task works out, not counting the halo
+TILE_ROWS = 128
+
+
+class TiledExecutor:
+    """Runs a grid kernel over bands of rows in a thread pool and stitches the bands back together.
+
+    A kernel is called as kernel(start, stop) and returns its result for grid rows start to stop along `axis`. Each
+    task asks for its band plus `halo` rows on either side, as far as the grid goes, and keeps only its band, so
+    a kernel whose output at a tile only depends on the input within halo rows gives the same result as one call over
+    the whole grid. The bands span the full width of the grid, which keeps the left and right edges where the kernel
+    expects them. The kernels spend their time in NumPy and SciPy calls that release the GIL, so threads are enough
+    to use several cores and the arrays never have to be copied to other processes.
+    """
+
+    def __init__(self, workers=None, tile_rows=TILE_ROWS):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        if self.workers < 1:
+            raise ValueError("workers expected to be at least 1")
+        self.tile_rows = tile_rows
+        self.pool = ThreadPoolExecutor(self.workers) if self.workers > 1 else None
+
+    def run(self, kernel, num_rows, halo=0, axis=0):
+        bands = [(top, min(num_rows, top + self.tile_rows)) for top in range(0, num_rows, self.tile_rows)]
+
+        def task(band):
+            top, bottom = band
+            start = max(0, top - halo)
+            stop = min(num_rows, bottom + halo)
+            result = kernel(start, stop)
+            window = [slice(None)] * result.ndim
+            window[axis] = slice(top - start, bottom - start)
+            return result[tuple(window)]
+
+        if self.pool is None or len(bands) == 1:
+            results = [task(band) for band in bands]
+        else:
+            results = list(self.pool.map(task, bands))
+        return np.concatenate(results, axis=axis)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
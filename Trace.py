@@ -0,0 +1,174 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+# Tracing is off until enable() is called. While it is off span() hands back one shared do-nothing context manager
+# and count() returns after a single check, so instrumented code costs next to nothing. The recorded spans and
+# counters can be summed up per name or saved as Chrome trace-event JSON, which chrome://tracing and Perfetto open
+enabled = False
+# Whether spans record their tracemalloc peak, tracemalloc slows allocations down a lot so it has its own switch
+trace_memory = False
+# Finished spans as (name, thread id, start ns, wall ns, cpu ns, peak bytes or None, args) and counter samples as
+# (name, time ns, total)
+spans = []
+counter_samples = []
+counters = defaultdict(int)
+lock = threading.Lock()
+local = threading.local()
+start_ns = time.perf_counter_ns()
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    """A timed region, wall time from perf_counter and CPU time of the thread it runs on.
+
+    With trace_memory the tracemalloc peak is reset when a span starts and folded into the enclosing span when it
+    ends, so every span reports the highest traced memory reached while it was open. tracemalloc counts the memory of
+    all threads together, so the peaks of spans on different threads running at once include each other.
+    """
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.peak = 0
+
+    def __enter__(self):
+        stack = local.__dict__.setdefault("stack", [])
+        if trace_memory and tracemalloc.is_tracing():
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.cpu = time.thread_time_ns()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter_ns() - self.start
+        cpu = time.thread_time_ns() - self.cpu
+        stack = local.stack
+        stack.pop()
+        peak = None
+        if trace_memory and tracemalloc.is_tracing():
+            peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+        with lock:
+            spans.append((self.name, threading.get_ident(), self.start, wall, cpu, peak, self.args))
+        return False
+
+
+def enable(memory=False):
+    global enabled, trace_memory
+    trace_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+    if trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    with lock:
+        spans.clear()
+        counter_samples.clear()
+        counters.clear()
+
+
+def span(name, **args):
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, args)
+
+
+def traced(name=None):
+    # Decorator running every call of a function in a span, named after the function unless given a name
+    def decorate(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with Span(span_name, {}):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def count(name, value=1):
+    # Adds to a counter, inner loops are vectorized so callers add up the work of a whole call at once
+    if not enabled:
+        return
+    with lock:
+        counters[name] += value
+        counter_samples.append((name, time.perf_counter_ns(), counters[name]))
+
+
+def summary():
+    # Calls, wall and CPU seconds and the highest peak per span name, in order of total wall time
+    totals = defaultdict(lambda: {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak": None})
+    with lock:
+        finished = list(spans)
+    for name, _, _, wall, cpu, peak, _ in finished:
+        total = totals[name]
+        total["calls"] += 1
+        total["wall"] += wall / 1e9
+        total["cpu"] += cpu / 1e9
+        if peak is not None:
+            total["peak"] = max(total["peak"] or 0, peak)
+    return dict(sorted(totals.items(), key=lambda item: -item[1]["wall"]))
+
+
+def summary_lines(limit=None):
+    lines = []
+    for name, total in list(summary().items())[:limit]:
+        line = f"{name}: {total['calls']}x {1000 * total['wall']:.1f}ms wall {1000 * total['cpu']:.1f}ms cpu"
+        if total["peak"] is not None:
+            line += f" {total['peak'] / 2 ** 20:.1f}MiB peak"
+        lines.append(line)
+    with lock:
+        lines.extend(f"{name}: {value}" for name, value in counters.items())
+    return lines
+
+
+def chrome_trace():
+    pid = os.getpid()
+    events = []
+    with lock:
+        for name, thread, start, wall, cpu, peak, args in spans:
+            event_args = {"cpu_ms": cpu / 1e6, **args}
+            if peak is not None:
+                event_args["peak_bytes"] = peak
+            events.append({"name": name, "ph": "X", "pid": pid, "tid": thread, "ts": (start - start_ns) / 1000,
+                           "dur": wall / 1000, "args": event_args})
+        for name, sample_time, total in counter_samples:
+            events.append({"name": name, "ph": "C", "pid": pid, "ts": (sample_time - start_ns) / 1000,
+                           "args": {name: total}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def save_chrome_trace(path):
+    with open(path, "w") as file:
+        json.dump(chrome_trace(), file)
@@ -0,0 +1,561 @@
+import hashlib
+import json
+import math
+import os
+import pickle
+import random
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from scipy.spatial import Voronoi, cKDTree
+
+import Trace
+from Elevation import EROSION_ITERATIONS, SEA_LEVEL, ELEVATION_NOISE_FREQUENCY, elevation_field, elevation_to_rects, \
+    HydraulicErosion
+from Noise import GradientNoise
+from Plates import NUM_PLATES, WIDTH, HEIGHT, PIXEL_WIDTH, WATER_DENSITY_THRESHOLD, PLATE_MELTED_DISTANCE, \
+    PLATE_MELTED_THICKNESS, get_plates, get_plate_adjacency, build_plate_adjacency, polygons_to_rects, \
+    labels_to_rects, rasterize_plates, gaussian_blur, disturb_tiles, highlight_edges, segment_band_mask, finite_ridges, \
+    tile_segments, make_plate, wrapped_voronoi, voronoi_polygons, PlateTable
+from WorldFile import WorldFile
+
+CACHE_DIR = ".worldcache"
+# Tiles per side of a ChunkedWorld chunk and how many generated chunks it keeps
+CHUNK_SIZE = 64
+CHUNK_CACHE_SIZE = 256
+# Seed cells around a chunk whose plates are taken into account. A Voronoi vertex is never more than 1.5 cells from
+# its seeds with one seed per cell, so the borders near a chunk only depend on seeds within 5 cells of it
+SEED_CELL_MARGIN = 5
+# How far past its end points segment_band_mask bands a segment, in tiles
+BAND_REACH = 12
+# Tile rows stream_world generates at a time
+STREAM_BAND_ROWS = 256
+# Stage outputs a MemoryStore keeps
+STAGE_CACHE_SIZE = 64
+# Goes into every stage key, bump it whenever the code of a stage changes what it outputs so the outputs and world
+# files stored under the old keys are never used again
+PIPELINE_VERSION = 1
+
+
+class WorldConfig:
+    def __init__(self, num_plates=NUM_PLATES, width=WIDTH, height=HEIGHT, pixel_width=PIXEL_WIDTH, noise_frequency=6,
+                 noise_octaves=1, water_density_threshold=WATER_DENSITY_THRESHOLD, blur_iterations=3,
+                 smoothing_radius=3, elevation_octaves=0, erosion_iterations=EROSION_ITERATIONS, sea_level=SEA_LEVEL):
+        self.num_plates = num_plates
+        self.width = width
+        self.height = height
+        self.pixel_width = pixel_width
+        self.noise_frequency = noise_frequency
+        self.noise_octaves = noise_octaves
+        self.water_density_threshold = water_density_threshold
+        self.blur_iterations = blur_iterations
+        self.smoothing_radius = smoothing_radius
+        # Octaves of the elevation noise, 0 leaves the world without elevation and the surfaces from the densities
+        self.elevation_octaves = elevation_octaves
+        self.erosion_iterations = erosion_iterations
+        self.sea_level = sea_level
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def replace(self, **changes):
+        return WorldConfig(**{**self.as_dict(), **changes})
+
+
+class ArtifactStore:
+    """Stage outputs on local disk, stored under the hash of everything that went into computing them."""
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key + ".pickle")
+
+    def load(self, key):
+        try:
+            with open(self.path(key), "rb") as file:
+                return pickle.load(file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def save(self, key, value):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so a crash never leaves a truncated artifact behind
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(handle, "wb") as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+
+class MemoryStore:
+    """Stage outputs in memory with the same interface as ArtifactStore, keeping the size most recently used ones.
+
+    Outputs are kept pickled like on disk, so a later stage changing an object it was handed never changes the stored
+    one.
+    """
+
+    def __init__(self, size=STAGE_CACHE_SIZE):
+        self.size = size
+        self.outputs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load(self, key):
+        with self.lock:
+            data = self.outputs.get(key)
+            if data is None:
+                return None
+            self.outputs.move_to_end(key)
+        return pickle.loads(data)
+
+    def save(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.outputs[key] = data
+            self.outputs.move_to_end(key)
+            while len(self.outputs) > self.size:
+                self.outputs.popitem(last=False)
+
+
+class GenerationCancelled(Exception):
+    """Raised by WorldGenerator.generate when its cancel event is set between two stages."""
+
+
+class WorldGenerator:
+    """Generates a world from an explicit seed and WorldConfig as a chain of named stages.
+
+    Each stage's key hashes its name, PIPELINE_VERSION, the config values it reads and the key of the stage before
+    it, so with a store a changed parameter only recomputes the stages from the first one that reads it.
+    """
+
+    # Stage name and the config values it depends on, in pipeline order
+    STAGES = [
+        ("plates", ("num_plates", "width", "height", "pixel_width", "noise_frequency", "noise_octaves")),
+        ("tiles", ("water_density_threshold",)),
+        ("adjacency", ()),
+        ("blurred", ("blur_iterations", "smoothing_radius")),
+        ("disturbed", ()),
+        ("terrain", ("elevation_octaves", "erosion_iterations", "sea_level")),
+        ("edges", ()),
+    ]
+
+    def __init__(self, seed, config=None, store=None, executor=None):
+        self.seed = seed
+        self.config = WorldConfig() if config is None else config
+        self.store = store
+        # An optional Tiling.TiledExecutor for the grid stages, it doesn't change their output
+        self.executor = executor
+        # Output of every stage, seconds spent per stage and the stages that came out of the store, for the last
+        # generate
+        self.outputs = {}
+        self.timings = {}
+        self.cached_stages = set()
+
+    def stage_keys(self):
+        keys = {}
+        upstream = None
+        for name, params in self.STAGES:
+            description = {
+                "stage": name,
+                "version": PIPELINE_VERSION,
+                "seed": self.seed,
+                "params": {param: getattr(self.config, param) for param in params},
+                "upstream": upstream,
+            }
+            upstream = hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+            keys[name] = upstream
+        return keys
+
+    def generate(self, progress=None, cancel=None):
+        # progress is called with the stage name, its position and the number of stages before every stage. Setting
+        # the threading.Event cancel stops the generation before the next stage with GenerationCancelled
+        self.timings = {}
+        self.cached_stages = set()
+        keys = self.stage_keys()
+        outputs = self.outputs = {}
+        for index, (name, _) in enumerate(self.STAGES):
+            if cancel is not None and cancel.is_set():
+                raise GenerationCancelled(name)
+            if progress is not None:
+                progress(name, index, len(self.STAGES))
+            start = time.perf_counter()
+            with Trace.span("stage " + name, seed=self.seed):
+                output = self.store.load(keys[name]) if self.store is not None else None
+                if output is None:
+                    output = getattr(self, "run_" + name)(outputs)
+                    if self.store is not None:
+                        self.store.save(keys[name], output)
+                else:
+                    self.cached_stages.add(name)
+            outputs[name] = output
+            self.timings[name] = time.perf_counter() - start
+
+        return outputs["edges"], outputs["plates"]
+
+    def run_plates(self, outputs):
+        config = self.config
+        rng = random.Random(self.seed)
+        perlin = GradientNoise(config.noise_frequency, rng.randint(1, 10 ** 5), config.noise_octaves)
+        return get_plates(config.num_plates, config.width, config.height, config.pixel_width, rng=rng, perlin=perlin)
+
+    def run_tiles(self, outputs):
+        config = self.config
+        return polygons_to_rects(outputs["plates"], config.width, config.height, config.pixel_width,
+                                 config.water_density_threshold, self.executor)
+
+    def run_adjacency(self, outputs):
+        config = self.config
+        return get_plate_adjacency(outputs["plates"], outputs["tiles"], config.width, config.height)
+
+    def run_blurred(self, outputs):
+        return gaussian_blur(outputs["tiles"], self.config.blur_iterations, self.config.smoothing_radius, self.executor)
+
+    def run_disturbed(self, outputs):
+        return disturb_tiles(outputs["blurred"], outputs["plates"], adjacency=outputs["adjacency"])
+
+    def run_terrain(self, outputs):
+        # The disturbed tiles colored by their eroded elevation and the HydraulicErosion that carved it, None when
+        # the config has no elevation
+        config = self.config
+        if config.elevation_octaves <= 0:
+            return None
+        perlin = GradientNoise(ELEVATION_NOISE_FREQUENCY, random.Random(f"elevation {self.seed}").randint(1, 10 ** 5),
+                               config.elevation_octaves)
+        erosion = HydraulicErosion(elevation_field(outputs["disturbed"], outputs["plates"], perlin, self.executor),
+                                   config.sea_level)
+        with Trace.span("erosion", iterations=config.erosion_iterations):
+            erosion.run(config.erosion_iterations)
+        return elevation_to_rects(outputs["disturbed"], erosion.elevation, config.sea_level), erosion
+
+    def run_edges(self, outputs):
+        tiles = outputs["disturbed"] if outputs["terrain"] is None else outputs["terrain"][0]
+        return highlight_edges(outputs["plates"], tiles.copy(), outputs["adjacency"], edge_search_reach(self.config),
+                               executor=self.executor)
+
+
+def edge_search_reach(config):
+    # The blur moves the plate edges away from the Voronoi borders by up to this many tiles
+    return config.smoothing_radius * config.blur_iterations + PLATE_MELTED_DISTANCE + PLATE_MELTED_THICKNESS + 1
+
+
+def stream_world(seed, path, config=None, band_rows=STREAM_BAND_ROWS):
+    """Generates the same world as WorldGenerator(seed, config) band_rows tile rows at a time, into world file path.
+
+    Every band is generated from the plates alone on a window reaching band_halo rows past it, which is as far as
+    the blur and the edge probes look, and then cut down and written out, so memory only grows with the band size
+    and never with the map. Returns the WorldFile.
+    """
+    config = WorldConfig() if config is None else config
+    check_windowed(config)
+    generator = WorldGenerator(seed, config)
+    plates = generator.run_plates({})
+    pixel_width = config.pixel_width
+    shape = (config.height // pixel_width, config.width // pixel_width)
+    adjacency = build_plate_adjacency(plates, shape, pixel_width, config.width, config.height)
+
+    world = WorldFile.create(path, shape, pixel_width, plates, seed, config.width, config.height, config)
+    for top in range(0, shape[0], band_rows):
+        bottom = min(shape[0], top + band_rows)
+        band = generate_band(plates, adjacency, config, shape, top, bottom)
+        for name in ("plate_index", "surface", "color", "highlight"):
+            getattr(world.tiles, name)[top:bottom] = getattr(band, name)
+        # Write the band out now so finished rows don't pile up in memory
+        world.flush()
+    return world
+
+
+def check_windowed(config):
+    # Erosion moves water and sediment across the whole map, so a world with elevation can't be made window by window
+    if config.elevation_octaves > 0:
+        raise ValueError("Worlds with elevation can only be generated whole, by WorldGenerator")
+
+
+def band_halo(config):
+    return config.smoothing_radius * config.blur_iterations + PLATE_MELTED_DISTANCE + PLATE_MELTED_THICKNESS
+
+
+def generate_band(plates, adjacency, config, shape, top, bottom):
+    # Rows top to bottom of the finished world
+    return generate_window(plates, adjacency, config, shape, (top, bottom), (0, shape[1]))
+
+
+def generate_window(plates, adjacency, config, shape, rows, cols):
+    # The (start, stop) rows and cols of the finished world, worked out on a window reaching band_halo more tiles past
+    # them on every side, as far as the map goes. The blur and the edge probes stop at the edges of the map, the map
+    # only wraps around through the plates
+    halo = band_halo(config)
+    top, left = max(0, rows[0] - halo), max(0, cols[0] - halo)
+    bottom, right = min(shape[0], rows[1] + halo), min(shape[1], cols[1] + halo)
+    tiles = disturb_window(plates, adjacency, config, (top, bottom), (left, right))
+    tiles = highlight_edges(plates, tiles, adjacency, edge_search_reach(config), origin=(left, top),
+                            map_size=(shape[1] * config.pixel_width, shape[0] * config.pixel_width))
+    return tiles.crop(rows[0] - top, cols[0] - left, rows[1] - rows[0], cols[1] - cols[0])
+
+
+def disturb_window(plates, adjacency, config, rows, cols):
+    # The stages up to and including disturbed for a window of the map
+    return disturb_tiles(blur_window(plates, config, rows, cols), plates, adjacency=adjacency, origin=(cols[0], rows[0]))
+
+
+def blur_window(plates, config, rows, cols):
+    # The stages up to and including blurred for a window of the map, the blur treats the window's edges as the map's,
+    # so only tiles smoothing_radius * blur_iterations in from an edge that isn't one come out right
+    pixel_width = config.pixel_width
+    labels = rasterize_plates(plates, config.width, config.height, pixel_width, rows, cols)
+    tiles = labels_to_rects(plates, labels, pixel_width, config.water_density_threshold)
+    return gaussian_blur(tiles, config.blur_iterations, config.smoothing_radius)
+
+
+class WorldEditor:
+    """Edits the plates of a generated world and regenerates only the tiles the edit can change.
+
+    The tiles a plate can end up on are the ones under the pieces of its Voronoi polygon. The editor keeps the
+    blurred and disturbed grids next to the finished one and carries an edit through them stage by stage. New labels
+    or colors under a plate reach smoothing_radius * blur_iterations further in the blurred grid, which is worked out
+    again there. The disturbed grid adds the bands along the borders, so it changes there and around every border
+    segment that moved. The edges are scored again wherever the disturbed grid, a plate direction or the edge
+    candidates changed, plus as far as the edge probes look. Every stage works on merged rectangles with just the
+    context it needs around them, so the grids come out the same as a full generation from the edited plates. The
+    edits return the (top, bottom, left, right) tile rectangles of the finished grid they changed, for patching what
+    was drawn from it.
+    """
+
+    def __init__(self, tiles, plates, config=None, adjacency=None, blurred=None, rng=None):
+        self.config = config = WorldConfig() if config is None else config
+        check_windowed(config)
+        rows, cols = tiles.shape
+        # A memory mapped grid may be read only
+        self.tiles = tiles if tiles.plate_index.flags.writeable else tiles.copy()
+        # Edits go through the arrays of a PlateTable, a list of Plates is turned into one
+        if not isinstance(plates, PlateTable):
+            plates = PlateTable.from_plates(plates, config.width)
+        self.plates = plates
+        self.adjacency = build_plate_adjacency(plates, tiles.shape, config.pixel_width, config.width,
+                                               config.height) if adjacency is None else adjacency
+        # The outputs of the blurred and disturbed stages, the blur is worked out again if not given
+        self.blurred = blur_window(plates, config, (0, rows), (0, cols)) if blurred is None else blurred.copy()
+        self.disturbed = disturb_tiles(self.blurred, plates, adjacency=self.adjacency)
+        # Draws the colors of plates whose type changes
+        self.rng = random.Random(0) if rng is None else rng
+
+    def set_direction(self, index, direction):
+        direction = np.asarray(direction, dtype=np.float64)
+        self.plates.direction[index] = direction / np.linalg.norm(direction)
+        directions = self.plates.direction
+        pairs = self.adjacency.plate_pairs
+        self.adjacency.relative_velocity = directions[pairs[:, 1]] - directions[pairs[:, 0]]
+        # Only the edges of the tiles the plate covers after the blur are scored differently
+        blur = self.config.smoothing_radius * self.config.blur_iterations
+        return self.regenerate(directions=[grow(rect, blur) for rect in self.plate_rects(index)])
+
+    def set_density(self, index, density):
+        # A plate that turns from oceanic to continental or back gets a new color to match
+        plate = self.plates[index]
+        oceanic = plate.type == "OCEANIC"
+        plate.density = density
+        if (density > 0) != oceanic:
+            plate.set_type_and_color(self.rng)
+        return self.regenerate(cells=self.plate_rects(index))
+
+    def move_plate(self, index, center):
+        # Moves the seed of a plate, which reshapes its Voronoi region and those around it. The density stays as it is
+        config = self.config
+        cells = self.plate_rects(index)
+        self.plates.center[index] = center
+        voronoi, _, seeded = wrapped_voronoi(self.plates.center, config.width, config.height)
+        self.plates.set_polygons(*voronoi_polygons(voronoi, seeded, len(self.plates)))
+        cells += self.plate_rects(index)
+
+        old = self.adjacency
+        self.adjacency = build_plate_adjacency(self.plates, self.tiles.shape, config.pixel_width, config.width,
+                                               config.height)
+        # The bands and edge candidates only depend on the tiles at the ends of a segment and the ones it crosses,
+        # the segments between other plates come out of the new diagram a little different or the other way around
+        # but mostly on the same tiles
+        moved = segment_keys(old, config.pixel_width) ^ segment_keys(self.adjacency, config.pixel_width)
+        segments = [(min(start[1], end[1]), max(start[1], end[1]) + 1, start[0], end[0] + 1)
+                    for start, end, _ in moved]
+        return self.regenerate(cells, segments)
+
+    def plate_rects(self, index):
+        # The tile rectangles under the pieces of a plate's Voronoi region
+        pixel_width = self.config.pixel_width
+        rects = []
+        for piece in self.plates[index].pieces:
+            xs, ys = np.array(piece, dtype=np.float64).T
+            rects.append((math.floor(ys.min() / pixel_width), math.floor(ys.max() / pixel_width) + 1,
+                          math.floor(xs.min() / pixel_width), math.floor(xs.max() / pixel_width) + 1))
+        return rects
+
+    @Trace.traced("WorldEditor.regenerate")
+    def regenerate(self, cells=(), segments=(), directions=()):
+        # cells are where the labels or colors changed, segments the tiles under border segments that moved and
+        # directions the tiles of plates that move differently now
+        config = self.config
+        rows, cols = self.tiles.shape
+        blur = config.smoothing_radius * config.blur_iterations
+        probe = PLATE_MELTED_DISTANCE + PLATE_MELTED_THICKNESS
+
+        def windows(rects, margin=0):
+            clipped = [clip_rect(grow(rect, margin), rows, cols) for rect in rects]
+            return merge_rects([rect for rect in clipped if rect[0] < rect[1] and rect[2] < rect[3]])
+
+        blurred = windows(cells, blur)
+        for top, bottom, left, right in blurred:
+            context = clip_rect(grow((top, bottom, left, right), blur), rows, cols)
+            window = blur_window(self.plates, config, context[:2], context[2:])
+            paste(self.blurred, window.crop(top - context[0], left - context[2], bottom - top, right - left), top, left)
+
+        disturbed = windows(blurred + [grow(rect, BAND_REACH) for rect in segments])
+        for top, bottom, left, right in disturbed:
+            window = self.blurred.crop(top, left, bottom - top, right - left)
+            paste(self.disturbed, disturb_tiles(window, self.plates, adjacency=self.adjacency, origin=(left, top)),
+                  top, left)
+
+        edges = windows([grow(rect, probe) for rect in blurred + list(directions)] + disturbed +
+                        [grow(rect, edge_search_reach(config)) for rect in segments])
+        for top, bottom, left, right in edges:
+            context = clip_rect(grow((top, bottom, left, right), probe), rows, cols)
+            window = self.disturbed.crop(context[0], context[2], context[1] - context[0], context[3] - context[2])
+            window = highlight_edges(self.plates, window, self.adjacency, edge_search_reach(config),
+                                     origin=(context[2], context[0]),
+                                     map_size=(cols * config.pixel_width, rows * config.pixel_width))
+            paste(self.tiles, window.crop(top - context[0], left - context[2], bottom - top, right - left), top, left)
+        return edges
+
+
+def segment_keys(adjacency, pixel_width):
+    # The end tiles of every segment, in x order, and the tiles it crosses
+    keys = set()
+    for ends, tiles in zip(tile_segments(adjacency.segments, pixel_width).tolist(), adjacency.segment_tiles):
+        start, end = sorted((tuple(ends[:2]), tuple(ends[2:])))
+        keys.add((start, end, tuple(sorted(map(tuple, tiles.tolist())))))
+    return keys
+
+
+def grow(rect, margin):
+    top, bottom, left, right = rect
+    return top - margin, bottom + margin, left - margin, right + margin
+
+
+def clip_rect(rect, rows, cols):
+    top, bottom, left, right = rect
+    return max(0, top), min(rows, bottom), max(0, left), min(cols, right)
+
+
+def paste(tiles, window, top, left):
+    # Copies a smaller grid into tiles at row top and column left
+    window_rows, window_cols = window.shape
+    for name in ("plate_index", "surface", "color", "highlight"):
+        getattr(tiles, name)[top:top + window_rows, left:left + window_cols] = getattr(window, name)
+
+
+def merge_rects(rects):
+    # Replaces overlapping (top, bottom, left, right) rectangles by their bounding box until none overlap
+    rects = list(rects)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                if a[0] < b[1] and b[0] < a[1] and a[2] < b[3] and b[2] < a[3]:
+                    rects[i] = (min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3]))
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+
+class ChunkedWorld:
+    """An endless world generated one chunk_size by chunk_size chunk of tiles at a time from a seed and WorldConfig.
+
+    The plane is cut into square seed cells, each as big as a plate of a config sized map, that hold one plate seed
+    placed by a Random seeded with the world seed and the cell. A chunk is generated on a window reaching halo tiles
+    past it on every side and then cut down: the blur and the edge probes look no further than halo tiles, so a chunk
+    comes out the same whichever chunks are generated around it and the seams don't show. Chunk (0, 0) starts at
+    tile (0, 0), the tile and pixel coordinates of every chunk are global. The last cache_size chunks are kept.
+    """
+
+    def __init__(self, seed, config=None, chunk_size=CHUNK_SIZE, cache_size=CHUNK_CACHE_SIZE):
+        self.seed = seed
+        self.config = config = WorldConfig() if config is None else config
+        check_windowed(config)
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        self.cell_size = math.sqrt(config.width * config.height / config.num_plates)
+        self.halo = band_halo(config)
+        rng = random.Random(seed)
+        self.perlin = GradientNoise(config.noise_frequency, rng.randint(1, 10 ** 5), config.noise_octaves)
+        # (cx, cy) to (tiles, plates), least recently used first
+        self.chunks = OrderedDict()
+
+    def get_chunk(self, cx, cy):
+        """Returns the TerrainGrid of chunk (cx, cy) and the plates its plate_index points into."""
+        key = (cx, cy)
+        if key in self.chunks:
+            self.chunks.move_to_end(key)
+            return self.chunks[key]
+        chunk = self.generate_chunk(cx, cy)
+        self.chunks[key] = chunk
+        if len(self.chunks) > self.cache_size:
+            self.chunks.popitem(last=False)
+        return chunk
+
+    def generate_chunk(self, cx, cy):
+        config = self.config
+        pixel_width = config.pixel_width
+        halo = self.halo
+        size = self.chunk_size + 2 * halo
+        left = cx * self.chunk_size - halo
+        top = cy * self.chunk_size - halo
+        plates = self.region_plates(left, top, size, size)
+        centers = np.array([plate.center for plate in plates])
+
+        # Nearest plate center to every tile's sample point, like rasterize_plates
+        xs = (np.arange(size) + left) * pixel_width
+        ys = (np.arange(size) + top) * pixel_width
+        points = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+        _, labels = cKDTree(centers).query(points)
+        tiles = labels_to_rects(plates, labels.reshape(size, size).astype(np.int32), pixel_width,
+                                config.water_density_threshold)
+
+        tiles = gaussian_blur(tiles, config.blur_iterations, config.smoothing_radius)
+
+        # Band both sides of every border near the window, like disturb_tiles, with the end points in global tiles
+        _, segments = finite_ridges(Voronoi(centers))
+        ends = tile_segments(segments, pixel_width)
+        near = ((np.minimum(ends[:, 0], ends[:, 2]) < left + size + BAND_REACH) &
+                (np.maximum(ends[:, 0], ends[:, 2]) >= left - BAND_REACH) &
+                (np.minimum(ends[:, 1], ends[:, 3]) < top + size + BAND_REACH) &
+                (np.maximum(ends[:, 1], ends[:, 3]) >= top - BAND_REACH))
+        ends = ends[near] - [left, top, left, top]
+        tiles.highlight |= segment_band_mask(np.vstack((ends, ends[:, [2, 3, 0, 1]])), tiles.shape)
+
+        tiles = highlight_edges(plates, tiles, origin=(left, top), map_size=(config.width, config.height))
+        return tiles.crop(halo, halo, self.chunk_size, self.chunk_size), plates
+
+    def region_plates(self, left, top, cols, rows):
+        # The plates of every seed cell within SEED_CELL_MARGIN cells of the tile window
+        pixel_width = self.config.pixel_width
+        cell_size = self.cell_size
+        first_x = math.floor(left * pixel_width / cell_size) - SEED_CELL_MARGIN
+        last_x = math.floor((left + cols) * pixel_width / cell_size) + SEED_CELL_MARGIN
+        first_y = math.floor(top * pixel_width / cell_size) - SEED_CELL_MARGIN
+        last_y = math.floor((top + rows) * pixel_width / cell_size) + SEED_CELL_MARGIN
+        cells = [(i, j) for j in range(first_y, last_y + 1) for i in range(first_x, last_x + 1)]
+
+        rngs = [random.Random(f"{self.seed}/{i}/{j}") for i, j in cells]
+        centers = np.array([[(i + rng.random()) * cell_size, (j + rng.random()) * cell_size]
+                            for (i, j), rng in zip(cells, rngs)])
+        # Plate densities sample the noise at the plate centers in tile coordinates, like get_plates
+        config = self.config
+        densities = self.perlin.sample(centers[:, 0] / (config.width / pixel_width),
+                                       centers[:, 1] / (config.height / pixel_width))
+        return [make_plate(cell, center, None, rng=rng, density=float(density))
+                for cell, center, rng, density in zip(cells, centers, rngs, densities)]
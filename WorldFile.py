@@ -0,0 +1,151 @@
+import json
+import struct
+
+import numpy as np
+
+from Plates import PlateTable, PLATE_TYPES, get_tile_at_point
+from Shapes import TerrainGrid
+
+MAGIC = b"WRLD"
+FORMAT_VERSION = 1
+# Arrays start on page boundaries so mapping one only ever touches its own pages
+ALIGNMENT = 4096
+# TerrainGrid arrays in file order, with their dtype and the extra axes after rows and columns
+ARRAYS = [
+    ("plate_index", np.int16, ()),
+    ("surface", np.uint8, ()),
+    ("color", np.uint8, (4,)),
+    ("highlight", np.bool_, ()),
+]
+# Magic, format version and header length
+PREAMBLE = struct.Struct("<4sII")
+
+
+class WorldFile:
+    """A generated world on disk, with its grid arrays opened as np.memmap.
+
+    The file starts with MAGIC, the format version and the length of a JSON header holding the seed, the map and
+    grid sizes, pixel_width, the WorldConfig values the world was generated with, the plate table and where each
+    array starts. The arrays follow at fixed, page aligned
+    offsets in C order. tiles is a TerrainGrid on the mapped arrays, so it can be drawn or read like an in-memory grid
+    while only the pages that get read are loaded. Open with mode "r+" to write to the tiles.
+    """
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        with open(path, "rb") as file:
+            magic, version, header_length = PREAMBLE.unpack(file.read(PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a world file")
+            if version != FORMAT_VERSION:
+                raise ValueError(f"{path} has world file format version {version}, expected {FORMAT_VERSION}")
+            header = json.loads(file.read(header_length))
+
+        self.header = header
+        self.seed = header["seed"]
+        self.width = header["width"]
+        self.height = header["height"]
+        self.pixel_width = header["pixel_width"]
+        # The WorldConfig values as a dict, None for files written without them
+        self.config = header.get("config")
+        self.plates = plates_from_records(header["plates"], self.width)
+        rows, cols = header["rows"], header["cols"]
+        arrays = {name: np.memmap(path, dtype=dtype, mode=mode, offset=header["offsets"][name],
+                                  shape=(rows, cols) + extra)
+                  for name, dtype, extra in ARRAYS}
+        self.tiles = TerrainGrid(rows, cols, self.pixel_width, **arrays)
+
+    @staticmethod
+    def create(path, shape, pixel_width, plates, seed=None, width=None, height=None, config=None):
+        """Writes the header of a world with a rows by cols grid and returns it opened for writing the tiles.
+
+        config is the WorldConfig the world was generated with, if known.
+        """
+        rows, cols = shape
+        header = {
+            "seed": seed,
+            "rows": rows,
+            "cols": cols,
+            "pixel_width": pixel_width,
+            "width": cols * pixel_width if width is None else width,
+            "height": rows * pixel_width if height is None else height,
+            "config": None if config is None else config.as_dict(),
+        }
+        header["plates"] = plate_records(plates, header["width"])
+        # The offsets depend on the header length, which depends on the offsets, so leave room for the digits
+        header["offsets"] = {name: 0 for name, _, _ in ARRAYS}
+        start = align(PREAMBLE.size + len(json.dumps(header).encode()) + 32 * len(ARRAYS))
+        for name, dtype, extra in ARRAYS:
+            header["offsets"][name] = start
+            start = align(start + rows * cols * int(np.prod(extra, dtype=np.int64)) * np.dtype(dtype).itemsize)
+        encoded = json.dumps(header).encode()
+
+        with open(path, "wb") as file:
+            file.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(encoded)))
+            file.write(encoded)
+            file.truncate(start)
+        return WorldFile(path, mode="r+")
+
+    def tile_at_point(self, point):
+        # The TerrainTileView of the tile under a map pixel, only that tile's pages are read
+        x, y = get_tile_at_point(point, self.pixel_width)
+        return self.tiles.tile(x, y)
+
+    def region(self, top, left, rows, cols):
+        # An in-memory TerrainGrid copy of part of the map
+        return self.tiles.crop(top, left, rows, cols)
+
+    def flush(self):
+        for name, _, _ in ARRAYS:
+            getattr(self.tiles, name).flush()
+
+
+def save_world(path, tiles, plates, seed=None, width=None, height=None, config=None):
+    world = WorldFile.create(path, tiles.shape, tiles.pixel_width, plates, seed, width, height, config)
+    for name, _, _ in ARRAYS:
+        getattr(world.tiles, name)[:] = getattr(tiles, name)
+    world.flush()
+    return world
+
+
+def open_world(path, mode="r"):
+    return WorldFile(path, mode)
+
+
+def align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def plate_records(plates, width):
+    # The plates as JSON records, the pieces of the polygons on the map follow from the polygons and width
+    table = plates if isinstance(plates, PlateTable) else PlateTable.from_plates(plates, width)
+    ids = range(len(table)) if table.ids is None else table.ids
+    offsets = table.polygon_offsets.tolist()
+    polygon_points = table.polygon_points.tolist()
+    return [{
+        "id": plate_id if isinstance(plate_id, int) else list(plate_id),
+        "center": center,
+        "direction": direction,
+        "density": density,
+        "type": PLATE_TYPES[plate_type],
+        "color": color,
+        "polygon": polygon_points[start:stop] if stop > start else None,
+    } for plate_id, center, direction, density, plate_type, color, start, stop in zip(
+        ids, table.center.tolist(), table.direction.tolist(), table.density.tolist(), table.type.tolist(),
+        table.color.tolist(), offsets, offsets[1:])]
+
+
+def plates_from_records(records, width):
+    # Files from before PlateTable also hold the pieces of every polygon, which are left out
+    ids = [record["id"] if isinstance(record["id"], int) else tuple(record["id"]) for record in records]
+    polygons = [record["polygon"] or [] for record in records]
+    offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    np.cumsum([len(polygon) for polygon in polygons], out=offsets[1:])
+    return PlateTable(
+        np.array([record["center"] for record in records], dtype=np.float64).reshape(-1, 2),
+        np.array([record["direction"] for record in records], dtype=np.float64).reshape(-1, 2),
+        np.array([record["density"] for record in records], dtype=np.float64),
+        np.array([PLATE_TYPES.index(record["type"]) for record in records], dtype=np.uint8),
+        np.array([record["color"] for record in records], dtype=np.uint8).reshape(-1, 4),
+        np.array([point for polygon in polygons for point in polygon], dtype=np.float64).reshape(-1, 2),
+        offsets, width, None if ids == list(range(len(records))) else ids)
@@ -0,0 +1,164 @@
+import argparse
+import os
+import shutil
+import struct
+import sys
+import time
+import zipfile
+import zlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from World import WorldGenerator, WorldConfig, ArtifactStore, stream_world
+from WorldFile import save_world, open_world
+from Service import ServiceClient
+from Tiling import TiledExecutor
+
+# Fixed zip entry timestamp, np.savez stamps the current time and would make every run's files differ
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def save_world_arrays(path, tiles):
+    # Writes the grid arrays as an .npz that np.load reads, byte for byte the same for the same tiles
+    arrays = {
+        "plate_index": tiles.plate_index,
+        "surface": tiles.surface,
+        "color": tiles.color,
+        "highlight": tiles.highlight,
+        "pixel_width": np.array(tiles.pixel_width),
+    }
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, array in arrays.items():
+            info = zipfile.ZipInfo(name + ".npy", date_time=ZIP_DATE_TIME)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, "w") as file:
+                np.lib.format.write_array(file, np.ascontiguousarray(array), allow_pickle=False)
+
+
+def write_png(path, image):
+    # Minimal RGB PNG writer, so workers don't need pygame for the previews
+    height, width = image.shape[:2]
+    rows = np.concatenate((np.zeros((height, 1), dtype=np.uint8),
+                           np.ascontiguousarray(image[..., :3], dtype=np.uint8).reshape(height, -1)), axis=1)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    with open(path, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        file.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), 9)))
+        file.write(chunk(b"IEND", b""))
+
+
+def generate_world(seed, config, out_dir, preview_scale, cache_dir, stream_rows=0, file_format="npz", threads=1):
+    if stream_rows > 0:
+        # Bands go straight to a world file, the whole grid is never in memory so there is no preview
+        start = time.perf_counter()
+        stream_world(seed, os.path.join(out_dir, f"world_{seed:08d}.world"), config, stream_rows)
+        return seed, {"stream": time.perf_counter() - start}
+
+    store = ArtifactStore(cache_dir) if cache_dir else None
+    executor = TiledExecutor(threads) if threads > 1 else None
+    generator = WorldGenerator(seed, config, store, executor)
+    tiles, plates = generator.generate()
+    if executor is not None:
+        executor.shutdown()
+    timings = dict(generator.timings)
+
+    start = time.perf_counter()
+    if file_format == "world":
+        save_world(os.path.join(out_dir, f"world_{seed:08d}.world"), tiles, plates, seed, config.width, config.height,
+                   config)
+    else:
+        save_world_arrays(os.path.join(out_dir, f"world_{seed:08d}.npz"), tiles)
+    timings["save"] = time.perf_counter() - start
+
+    if preview_scale > 0:
+        start = time.perf_counter()
+        image = tiles.image()
+        image = np.repeat(np.repeat(image, preview_scale, axis=0), preview_scale, axis=1)
+        write_png(os.path.join(out_dir, f"world_{seed:08d}.png"), image)
+        timings["preview"] = time.perf_counter() - start
+
+    return seed, timings
+
+
+def fetch_world(client, seed, config, out_dir, preview_scale):
+    # Has the service generate the world, or find it among the ones it made before, and copies its file over
+    start = time.perf_counter()
+    response = client.generate_path(seed, config)
+    path = os.path.join(out_dir, f"world_{seed:08d}.world")
+    shutil.copyfile(response["path"], path)
+    timings = {"service": time.perf_counter() - start}
+    if preview_scale > 0:
+        start = time.perf_counter()
+        image = open_world(path).tiles.image()
+        image = np.repeat(np.repeat(image, preview_scale, axis=0), preview_scale, axis=1)
+        write_png(os.path.join(out_dir, f"world_{seed:08d}.png"), image)
+        timings["preview"] = time.perf_counter() - start
+    return seed, timings
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Generate seeded worlds without a window")
+    parser.add_argument("count", type=int, help="number of worlds to generate")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first world, the rest count up from it")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--out", default="worlds", help="output directory")
+    parser.add_argument("--preview-scale", type=int, default=1,
+                        help="pixels per tile in the PNG previews, 0 skips them")
+    parser.add_argument("--cache", default=None, help="artifact store directory to reuse stage outputs from")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="threads each worker runs the grid stages of a world on, in bands of rows")
+    parser.add_argument("--format", choices=["npz", "world"], default="npz",
+                        help="npz holds the grid arrays, world also the seed and plates and can be memory mapped")
+    parser.add_argument("--server", default=None,
+                        help="URL of a running daemon.py to generate the worlds on, they are copied into the output "
+                             "directory as .world files")
+    parser.add_argument("--stream-rows", type=int, default=0,
+                        help="generate this many tile rows at a time into a .world file per world, "
+                             "for maps too big to hold in memory")
+    defaults = WorldConfig()
+    for name, value in defaults.as_dict().items():
+        parser.add_argument("--" + name.replace("_", "-"), type=type(value), default=value)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    config = WorldConfig(**{name: getattr(args, name) for name in WorldConfig().as_dict()})
+    os.makedirs(args.out, exist_ok=True)
+    seeds = range(args.seed, args.seed + args.count)
+    jobs = [(seed, config, args.out, args.preview_scale, args.cache, args.stream_rows, args.format, args.threads)
+            for seed in seeds]
+
+    start = time.perf_counter()
+    # Every world only depends on its own seed, so the files are the same whatever the worker count
+    if args.server is not None:
+        # The service does the work, the threads only keep its queue full
+        client = ServiceClient(args.server)
+        with ThreadPoolExecutor(max(1, args.workers)) as pool:
+            results = list(pool.map(lambda seed: fetch_world(client, seed, config, args.out, args.preview_scale),
+                                    seeds))
+    elif args.workers <= 1:
+        results = [generate_world(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(args.workers) as pool:
+            results = list(pool.map(generate_world, *zip(*jobs), chunksize=max(1, len(jobs) // (args.workers * 4))))
+    elapsed = time.perf_counter() - start
+
+    totals = defaultdict(float)
+    for _, timings in results:
+        for stage, seconds in timings.items():
+            totals[stage] += seconds
+    print(f"Generated {len(results)} worlds in {elapsed:.2f}s with {max(1, args.workers)} workers, "
+          f"{len(results) / elapsed:.2f} worlds/sec")
+    for stage, seconds in totals.items():
+        print(f"  {stage:<10} {seconds:8.3f}s total, {seconds / len(results) * 1000:8.1f}ms per world")
+
+
+if __name__ == "__main__":
+    main()
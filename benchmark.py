@@ -0,0 +1,697 @@
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from perlin_noise import PerlinNoise
+
+from Elevation import flow_receivers, flow_accumulation
+from Noise import GradientNoise
+from Plates import get_plates, rasterize_plates, rasterize_plates_reference, PIXEL_WIDTH, WIDTH, HEIGHT, \
+    polygons_to_rects, gaussian_blur, gaussian_blur_reference, highlight_edges, highlight_edges_reference, \
+    get_voronoi, disturb_tiles, segment_band_mask, highlight_tiles_reference, tile_segments, build_plate_adjacency, \
+    get_plates_reference, plate_centers, wrapped_voronoi, voronoi_polygons, voronoi_ridges, PlateTable
+from Tectonics import TectonicSimulation
+from World import WorldGenerator, WorldConfig, ChunkedWorld, WorldEditor, stream_world, generate_band
+from WorldFile import open_world
+from Tiling import TiledExecutor
+from Query import WorldIndex
+from Shapes import SURFACES
+import Trace
+
+MAP_SIZES = [720, 2048, 8192]
+# The reference scan is far too slow to run over a whole 8192px map, so it is timed on this many tile rows and
+# extrapolated to the full map
+REFERENCE_SAMPLE_ROWS = 8
+BLUR_ITERATIONS = 3
+BLUR_SEEDS = range(5)
+NOISE_SIZES = [720, 2048]
+NOISE_FREQUENCY = 6
+SIMULATION_STEPS = 300
+SIMULATION_TARGET_STEPS_PER_SECOND = 60
+# Chunks per side of the square of chunks that is compared against one chunk covering all of them
+SEAM_CHUNKS = 2
+# Map size and band rows stream_world is compared against the in-memory pipeline at
+STREAM_SIZE = 2048
+STREAM_BAND_ROWS = 64
+# Map size the tiled executor is timed at, with 1, 2, 4... workers up to the core count
+SCALING_SIZE = 2048
+# Map sizes the viewer is drawn at, the zoom levels it is drawn at and the frames timed at each
+VIEWER_SIZES = [720, 4096]
+VIEWER_SCALES = [4, 1, 0.25, 1 / 16]
+VIEWER_FRAMES = 30
+# Map sizes the query index is timed at, points per batch, and the rectangle and radius queries checked against a scan
+QUERY_SIZES = [720, 4096]
+QUERY_BATCH = 100000
+QUERY_CHECKS = 200
+QUERY_TARGET_PER_MS = 1000
+# The map plate edits are timed on
+EDIT_SIZE = 2048
+EDIT_PLATES = 60
+# Edits of every kind timed on one map
+EDIT_COUNT = 10
+# How far a plate is moved, in map pixels
+EDIT_MOVE_DISTANCE = 60
+# Plate generation of a map with many plates, which has to stay under a second up to the rasterized tiles
+PLATES_SIZE = 2048
+PLATES_COUNT = 10000
+PLATES_TARGET_SECONDS = 1.0
+# Elevation and erosion of whole worlds, with the erosion's iteration budget
+EROSION_SIZES = [2048, 8192]
+EROSION_PLATES = 40
+EROSION_OCTAVES = 4
+EROSION_BENCHMARK_ITERATIONS = 20
+# Disabled span and counter calls timed to work out what the instrumentation costs a world while tracing is off, and
+# the largest share of the generation time that may be
+TRACE_CALLS = 200000
+TRACE_MAX_DISABLED_OVERHEAD = 0.001
+# The grid of map sizes, pixel widths and plate counts the suite times every stage at
+SUITE_SIZES = [720, 2048]
+SUITE_PIXEL_WIDTHS = [5, 10]
+SUITE_PLATE_COUNTS = [15, 60]
+SUITE_REPEATS = 3
+# Maps up to this size are also checked against the reference implementations, which get slow beyond it
+EQUIVALENCE_MAX_SIZE = 720
+HISTORY_PATH = "benchmark_history.json"
+BASELINE_PATH = "benchmark_baseline.json"
+# A stage regressed if it got this much slower or hungrier than the baseline, and by more than the noise floor
+REGRESSION_TOLERANCE = 0.25
+REGRESSION_MIN_SECONDS = 0.005
+
+
+def time_call(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_rasterization(size, pixel_width=PIXEL_WIDTH, seed=0):
+    random.seed(seed)
+    plates = get_plates(width=size, height=size)
+    labels, fast_time = time_call(rasterize_plates, plates, size, size, pixel_width)
+
+    num_rows = labels.shape[0]
+    rows = np.linspace(0, num_rows - 1, min(REFERENCE_SAMPLE_ROWS, num_rows)).astype(int)
+    reference, sample_time = time_call(rasterize_plates_reference, plates, size, size, pixel_width, rows=rows)
+    reference_time = sample_time * num_rows / len(rows)
+
+    # Tiles sitting exactly on a polygon edge may go to either plate, so count disagreements instead of asserting
+    mismatches = int(np.count_nonzero(reference[rows] != labels[rows]))
+    print(f"{size}x{size} ({labels.size} tiles, {len(plates)} plates): "
+          f"reference {reference_time:.3f}s{' (extrapolated)' if len(rows) < num_rows else ''}, "
+          f"rasterize_plates {fast_time:.4f}s, speedup {reference_time / fast_time:.0f}x, "
+          f"{mismatches} mismatching tiles in {len(rows)} sampled rows")
+
+
+def benchmark_blur(seed):
+    # majority_filter has to reproduce the dictionary counting blur exactly, tie-breaking included
+    random.seed(seed)
+    plates = get_plates()
+    tiles = polygons_to_rects(plates)
+    blurred, fast_time = time_call(gaussian_blur, tiles, BLUR_ITERATIONS)
+    reference, reference_time = time_call(gaussian_blur_reference, tiles, BLUR_ITERATIONS)
+
+    matches = (np.array_equal(blurred.plate_index, reference.plate_index) and
+               np.array_equal(blurred.color, reference.color))
+    print(f"seed {seed} {WIDTH}x{HEIGHT}: reference {reference_time:.3f}s, gaussian_blur {fast_time:.3f}s, "
+          f"speedup {reference_time / fast_time:.1f}x, {'matches' if matches else 'DOES NOT MATCH'} reference")
+    return matches
+
+
+def benchmark_noise(size, pixel_width=PIXEL_WIDTH, seed=1):
+    # One noise value per tile, the way disturb_rectangles_with_perlin_noise samples the map
+    coordinates = np.arange(size // pixel_width) * pixel_width / size
+    perlin = PerlinNoise(octaves=NOISE_FREQUENCY, seed=seed)
+    reference, reference_time = time_call(
+        lambda: np.array([[perlin.noise([x, y]) for x in coordinates] for y in coordinates]))
+    values, fast_time = time_call(GradientNoise(NOISE_FREQUENCY, seed).grid, coordinates, coordinates)
+
+    # np.power and math.pow can round the last bit differently
+    matches = np.allclose(values, reference, rtol=0, atol=1e-12)
+    print(f"{size}x{size} ({values.size} tiles): PerlinNoise.noise per tile {reference_time:.3f}s, "
+          f"GradientNoise.grid {fast_time:.4f}s, speedup {reference_time / fast_time:.0f}x, "
+          f"{'matches' if matches else 'DOES NOT MATCH'} reference")
+    return matches
+
+
+def benchmark_edges(seed):
+    generator = WorldGenerator(seed)
+    generator.generate()
+    tiles, plates = generator.outputs["disturbed"], generator.outputs["plates"]
+    highlighted, fast_time = time_call(highlight_edges, plates, tiles.copy())
+    reference, reference_time = time_call(highlight_edges_reference, plates, tiles.copy())
+
+    matches = np.array_equal(highlighted.color, reference.color)
+    print(f"seed {seed} {WIDTH}x{HEIGHT}: reference {reference_time:.3f}s, highlight_edges {fast_time:.4f}s, "
+          f"speedup {reference_time / fast_time:.0f}x, {'matches' if matches else 'DOES NOT MATCH'} reference")
+    return matches
+
+
+def benchmark_segments(seed):
+    # The bands disturb_tiles draws along both sides of every border, in one pass against one segment at a time
+    generator = WorldGenerator(seed)
+    generator.generate()
+    tiles, adjacency = generator.outputs["blurred"], generator.outputs["adjacency"]
+    ends = tile_segments(adjacency.segments, tiles.pixel_width)
+    ends = np.vstack((ends, ends[:, [2, 3, 0, 1]]))
+    mask, fast_time = time_call(segment_band_mask, ends, tiles.shape)
+
+    def reference_bands():
+        reference = tiles.copy()
+        reference.highlight[:] = False
+        for x1, y1, x2, y2 in ends.tolist():
+            highlight_tiles_reference(reference, (x1, y1), (x2, y2))
+        return reference.highlight
+
+    reference, reference_time = time_call(reference_bands)
+    matches = np.array_equal(mask, reference)
+    print(f"seed {seed} {len(ends)} segments: highlight_tiles per segment {reference_time:.3f}s, "
+          f"segment_band_mask {fast_time:.4f}s, speedup {reference_time / fast_time:.0f}x, "
+          f"{'matches' if matches else 'DOES NOT MATCH'} reference")
+    return matches
+
+
+def benchmark_simulation(seed):
+    tiles, plates = WorldGenerator(seed).generate()
+    simulation = TectonicSimulation(tiles, plates)
+    _, elapsed = time_call(simulation.run, SIMULATION_STEPS)
+    steps_per_second = SIMULATION_STEPS / elapsed
+    print(f"seed {seed} {tiles.shape[1]}x{tiles.shape[0]} tiles: {SIMULATION_STEPS} steps in {elapsed:.3f}s, "
+          f"{steps_per_second:.0f} steps/sec (target {SIMULATION_TARGET_STEPS_PER_SECOND})")
+    return steps_per_second >= SIMULATION_TARGET_STEPS_PER_SECOND
+
+
+def benchmark_chunks(seed):
+    # The chunks in a WIDTH x HEIGHT view, and chunks that must line up with one chunk generated over all of them
+    world = ChunkedWorld(seed)
+    chunk_pixels = world.chunk_size * world.config.pixel_width
+    view = [(cx, cy) for cy in range(-(-HEIGHT // chunk_pixels)) for cx in range(-(-WIDTH // chunk_pixels))]
+    _, view_time = time_call(lambda: [world.get_chunk(cx, cy) for cx, cy in view])
+    _, full_time = time_call(WorldGenerator(seed).generate)
+
+    size = world.chunk_size
+    whole, _ = ChunkedWorld(seed, chunk_size=size * SEAM_CHUNKS).get_chunk(0, 0)
+    seamless = True
+    for cy in range(SEAM_CHUNKS):
+        for cx in range(SEAM_CHUNKS):
+            tiles, _ = world.get_chunk(cx, cy)
+            window = (slice(cy * size, (cy + 1) * size), slice(cx * size, (cx + 1) * size))
+            seamless &= (np.array_equal(tiles.color, whole.color[window]) and
+                         np.array_equal(tiles.highlight, whole.highlight[window]))
+    print(f"seed {seed}: {len(view)} chunks in view in {view_time:.3f}s, whole {WIDTH}x{HEIGHT} world "
+          f"{full_time:.3f}s, chunks {'line up' if seamless else 'DO NOT LINE UP'}")
+    return seamless
+
+
+def benchmark_stream(seed):
+    config = WorldConfig(width=STREAM_SIZE, height=STREAM_SIZE)
+    (tiles, _), memory_time, memory_peak = measure_once(WorldGenerator(seed, config).generate)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "world.world")
+        _, stream_time, stream_peak = measure_once(stream_world, seed, path, config, STREAM_BAND_ROWS)
+        streamed = open_world(path).tiles
+        matches = all(np.array_equal(getattr(streamed, name), getattr(tiles, name))
+                      for name in ("plate_index", "surface", "color", "highlight"))
+    print(f"seed {seed} {STREAM_SIZE}x{STREAM_SIZE}: in memory {memory_time:.3f}s {memory_peak / 2 ** 20:.1f}MiB peak, "
+          f"{STREAM_BAND_ROWS} row bands {stream_time:.3f}s {stream_peak / 2 ** 20:.1f}MiB peak, "
+          f"{'matches' if matches else 'DOES NOT MATCH'} in memory")
+    return matches
+
+
+def benchmark_scaling(seed):
+    random.seed(seed)
+    plates = get_plates(width=SCALING_SIZE, height=SCALING_SIZE)
+    tiles = polygons_to_rects(plates, SCALING_SIZE, SCALING_SIZE)
+    coordinates = np.arange(SCALING_SIZE // PIXEL_WIDTH) / (SCALING_SIZE // PIXEL_WIDTH)
+    perlin = GradientNoise(NOISE_FREQUENCY, seed + 1)
+    kernels = {
+        "polygons_to_rects": (lambda executor: polygons_to_rects(plates, SCALING_SIZE, SCALING_SIZE,
+                                                                 executor=executor).plate_index),
+        "gaussian_blur": lambda executor: gaussian_blur(tiles, BLUR_ITERATIONS, executor=executor).color,
+        "highlight_edges": lambda executor: highlight_edges(plates, tiles.copy(), executor=executor).color,
+        "noise": lambda executor: perlin.grid(coordinates, coordinates, executor),
+    }
+
+    counts = [1]
+    while counts[-1] * 2 <= os.cpu_count():
+        counts.append(counts[-1] * 2)
+    if counts[-1] != os.cpu_count():
+        counts.append(os.cpu_count())
+
+    matches = True
+    for name, kernel in kernels.items():
+        serial, serial_time = time_call(kernel, None)
+        timings = []
+        for workers in counts:
+            executor = TiledExecutor(workers)
+            result, elapsed = time_call(kernel, executor)
+            executor.shutdown()
+            matches &= np.array_equal(result, serial)
+            timings.append(f"{workers} workers {elapsed:.3f}s ({serial_time / elapsed:.1f}x)")
+        print(f"{name} {SCALING_SIZE}x{SCALING_SIZE}: untiled {serial_time:.3f}s, " + ", ".join(timings))
+    print(f"tiled results {'match' if matches else 'DO NOT MATCH'} the untiled ones")
+    return matches
+
+
+def benchmark_viewer(size, seed=0):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    import main
+    pygame.init()
+
+    tiles, plates = WorldGenerator(seed, WorldConfig(width=size, height=size)).generate()
+    view = main.MapView((WIDTH, HEIGHT))
+    view.show(tiles, plates)
+    window = pygame.Surface((WIDTH, HEIGHT))
+    # The default view has to look like the whole map drawn by MapRenderer
+    expected = pygame.Surface((size, size))
+    main.MapRenderer().draw(expected, tiles, True, plates)
+    view.draw(window)
+    matches = np.array_equal(pygame.surfarray.array3d(window),
+                             pygame.surfarray.array3d(expected.subsurface((0, 0, WIDTH, HEIGHT))))
+
+    timings = []
+    for scale in VIEWER_SCALES:
+        view.reset()
+        view.zoom(scale, (0, 0))
+        stats = main.FrameStats(VIEWER_FRAMES)
+        for frame in range(VIEWER_FRAMES):
+            view.pan(1, 1)
+            _, elapsed = time_call(view.draw, window)
+            stats.add(elapsed, elapsed)
+        timings.append(f"zoom {scale:g} {1000 * stats.percentile(50):.1f}ms p50 {1000 * stats.percentile(95):.1f}ms p95")
+    print(f"seed {seed} {size}x{size} map in a {WIDTH}x{HEIGHT} view: " + ", ".join(timings) +
+          f", default view {'matches' if matches else 'DOES NOT MATCH'} MapRenderer")
+    return matches
+
+
+def benchmark_queries(size, seed=0):
+    tiles, plates = WorldGenerator(seed, WorldConfig(width=size, height=size)).generate()
+    index = WorldIndex(tiles, plates)
+    pixel_width = tiles.pixel_width
+    rows, cols = tiles.shape
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0, size, (QUERY_BATCH, 2))
+
+    # Warm up, the first boundary query builds the distance transform
+    _, build_time = time_call(index.nearest_boundaries, points[:1])
+    _, plate_time = time_call(index.plates_at, points)
+    _, boundary_time = time_call(index.nearest_boundaries, points)
+    rect_queries = np.column_stack((rng.uniform(-size / 4, size, (QUERY_CHECKS, 2)),
+                                    rng.uniform(0, size / 4, (QUERY_CHECKS, 2))))
+    _, rect_time = time_call(lambda: [index.tiles_in_rect(*query) for query in rect_queries])
+    radius_queries = np.column_stack((rng.uniform(-size / 4, size, (QUERY_CHECKS, 2)),
+                                      rng.uniform(0, size / 10, QUERY_CHECKS)))
+    _, radius_time = time_call(lambda: [index.tiles_in_radius(*query) for query in radius_queries])
+
+    # Check everything against scans over the whole grid
+    matches = all(index.plates_at((x, y))[0] == (tiles.plate_index[int(y // pixel_width), int(x // pixel_width)])
+                  for x, y in points[:QUERY_CHECKS])
+    tile_x = (np.arange(cols) * pixel_width)[None, :]
+    tile_y = (np.arange(rows) * pixel_width)[:, None]
+    for x, y, width, height in rect_queries:
+        # Overlap with the rectangle or one of its copies a map width to the left or right
+        expected = np.zeros(tiles.shape, dtype=bool)
+        for shift in (-cols * pixel_width, 0, cols * pixel_width):
+            expected |= ((tile_x + pixel_width > x + shift) & (tile_x < x + shift + max(width, 1e-9)) &
+                         (tile_y + pixel_width > y) & (tile_y < y + max(height, 1e-9)))
+        found = np.zeros(tiles.shape, dtype=bool)
+        found[index.tiles_in_rect(x, y, width, height)] = True
+        matches &= np.array_equal(found, expected)
+    for x, y, radius in radius_queries:
+        expected = np.zeros(tiles.shape, dtype=bool)
+        for shift in (-cols * pixel_width, 0, cols * pixel_width):
+            dx = np.maximum(np.maximum(tile_x - x - shift, x + shift - tile_x - pixel_width), 0)
+            dy = np.maximum(np.maximum(tile_y - y, y - tile_y - pixel_width), 0)
+            expected |= dx ** 2 + dy ** 2 <= radius ** 2
+        found = np.zeros(tiles.shape, dtype=bool)
+        found[index.tiles_in_radius(x, y, radius)] = True
+        matches &= np.array_equal(found, expected)
+    boundary_rows, boundary_cols = np.nonzero(index.boundary_mask())
+    found_rows, found_cols, distances = index.nearest_boundaries(points[:QUERY_CHECKS])
+    for (x, y), distance in zip(points[:QUERY_CHECKS], distances):
+        row, col = int(y // pixel_width), int(x // pixel_width)
+        dx = np.abs(boundary_cols - col)
+        dx = np.minimum(dx, cols - dx)
+        matches &= np.isclose(np.sqrt(np.min(dx ** 2 + (boundary_rows - row) ** 2)) * pixel_width, distance)
+
+    plates_per_ms = QUERY_BATCH / plate_time / 1000
+    boundaries_per_ms = QUERY_BATCH / boundary_time / 1000
+    print(f"seed {seed} {size}x{size}: plate at point {plates_per_ms:.0f}/ms, nearest boundary {boundaries_per_ms:.0f}/ms "
+          f"(distance transform {build_time:.3f}s), rectangle {QUERY_CHECKS / rect_time / 1000:.1f}/ms, radius "
+          f"{QUERY_CHECKS / radius_time / 1000:.1f}/ms, {'match' if matches else 'DO NOT MATCH'} a scan")
+    return matches and min(plates_per_ms, boundaries_per_ms) >= QUERY_TARGET_PER_MS
+
+
+def benchmark_edits(seed):
+    config = WorldConfig(width=EDIT_SIZE, height=EDIT_SIZE, num_plates=EDIT_PLATES)
+    generator = WorldGenerator(seed, config)
+    (tiles, plates), full_time = time_call(generator.generate)
+    editor = WorldEditor(tiles, plates, config, blurred=generator.outputs["blurred"])
+    rng = random.Random(seed)
+    edits = {
+        "direction": lambda plate: editor.set_direction(plate, (rng.uniform(-1, 1), rng.uniform(-1, 1))),
+        "density": lambda plate: editor.set_density(plate, rng.uniform(-1, 1)),
+        "move": lambda plate: editor.move_plate(plate, (
+            (plates[plate].center[0] + rng.uniform(-EDIT_MOVE_DISTANCE, EDIT_MOVE_DISTANCE)) % EDIT_SIZE,
+            min(EDIT_SIZE - 1, max(0, plates[plate].center[1] + rng.uniform(-EDIT_MOVE_DISTANCE,
+                                                                            EDIT_MOVE_DISTANCE))))),
+    }
+    timings = []
+    for name, edit in edits.items():
+        times = [time_call(edit, rng.randrange(len(plates)))[1] for _ in range(EDIT_COUNT)]
+        timings.append(f"{name} {1000 * np.median(times):.0f}ms median {1000 * max(times):.0f}ms max")
+
+    # After all the edits the tiles have to be what generating the edited plates from scratch gives
+    adjacency = build_plate_adjacency(plates, tiles.shape, config.pixel_width, config.width, config.height)
+    expected = generate_band(plates, adjacency, config, tiles.shape, 0, tiles.shape[0])
+    matches = all(np.array_equal(getattr(editor.tiles, name), getattr(expected, name))
+                  for name in ("plate_index", "surface", "color", "highlight"))
+    print(f"seed {seed} {EDIT_SIZE}x{EDIT_SIZE} {EDIT_PLATES} plates: " + ", ".join(timings) +
+          f", full generation {full_time:.3f}s, {'matches' if matches else 'DOES NOT MATCH'} a full regeneration")
+    return matches
+
+
+def benchmark_plates(seed):
+    def generate(plates_function):
+        return plates_function(PLATES_COUNT, PLATES_SIZE, PLATES_SIZE, rng=random.Random(seed),
+                               perlin=GradientNoise(NOISE_FREQUENCY, seed + 1))
+
+    plates, plates_time = time_call(generate, get_plates)
+    tiles, rects_time = time_call(polygons_to_rects, plates, PLATES_SIZE, PLATES_SIZE)
+    reference, reference_time = time_call(generate, get_plates_reference)
+
+    # The table holds what the list of Plate objects held and rasterizes to the same tiles
+    reference_table = PlateTable.from_plates(reference, PLATES_SIZE)
+    same_plates = all(np.array_equal(getattr(plates, name), getattr(reference_table, name))
+                      for name in ("center", "direction", "density", "type", "color"))
+    same_tiles = all(np.array_equal(getattr(tiles, name), getattr(polygons_to_rects(reference, PLATES_SIZE,
+                                                                                    PLATES_SIZE), name))
+                     for name in ("plate_index", "surface", "color"))
+
+    # Tiling only the seeds near the seams gives the polygons and ridges tiling every seed gives. Qhull starts the
+    # polygons at other vertices, lists the ridges in another order and rounds the vertices a little differently
+    centers = plate_centers(plates)
+    partial, partial_time = time_call(wrapped_voronoi, centers, PLATES_SIZE, PLATES_SIZE)
+    full, full_time = time_call(wrapped_voronoi, centers, PLATES_SIZE, PLATES_SIZE, seam_margin=np.inf)
+    same_voronoi = (same_rows(*sorted_polygons(*voronoi_polygons(partial[0], partial[2], PLATES_COUNT)),
+                              *sorted_polygons(*voronoi_polygons(full[0], full[2], PLATES_COUNT))) and
+                    same_rows(*sorted_ridges(*voronoi_ridges(*partial[:2], PLATES_SIZE)),
+                              *sorted_ridges(*voronoi_ridges(*full[:2], PLATES_SIZE))))
+
+    total = plates_time + rects_time
+    matches = same_plates and same_tiles and same_voronoi
+    print(f"seed {seed} {PLATES_SIZE}x{PLATES_SIZE} {PLATES_COUNT} plates: get_plates {plates_time:.3f}s "
+          f"(reference {reference_time:.3f}s), polygons_to_rects {rects_time:.3f}s, total {total:.3f}s "
+          f"{'within' if total <= PLATES_TARGET_SECONDS else 'OVER'} the {PLATES_TARGET_SECONDS:.0f}s target, "
+          f"voronoi seam tiling {partial_time:.3f}s partial {full_time:.3f}s full, "
+          f"{'matches' if matches else 'DOES NOT MATCH'} the Plate objects and full tiling")
+    return matches and total <= PLATES_TARGET_SECONDS
+
+
+def sorted_polygons(points, offsets):
+    # The plate of every polygon vertex and the vertices, sorted by plate and then by position
+    plate = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    rounded = np.round(points, 6)
+    order = np.lexsort((rounded[:, 1], rounded[:, 0], plate))
+    return plate[order], points[order]
+
+
+def sorted_ridges(ridge_points, segments):
+    # The point pairs and segments of ridges with the lower point and the left end first, sorted by pair and position
+    flip = (segments[:, 0] > segments[:, 2]) | ((segments[:, 0] == segments[:, 2]) & (segments[:, 1] > segments[:, 3]))
+    segments = np.where(flip[:, None], segments[:, [2, 3, 0, 1]], segments)
+    ridge_points = np.sort(ridge_points, axis=1)
+    rounded = np.round(segments, 6)
+    order = np.lexsort((rounded[:, 1], rounded[:, 0], ridge_points[:, 1], ridge_points[:, 0]))
+    return ridge_points[order], segments[order]
+
+
+def same_rows(keys, values, other_keys, other_values):
+    return np.array_equal(keys, other_keys) and np.allclose(values, other_values, rtol=0, atol=1e-6)
+
+
+def benchmark_erosion(size, seed=0):
+    config = WorldConfig(width=size, height=size, num_plates=EROSION_PLATES, elevation_octaves=EROSION_OCTAVES,
+                         erosion_iterations=EROSION_BENCHMARK_ITERATIONS)
+    generator = WorldGenerator(seed, config)
+    tiles, _ = generator.generate()
+    erosion = generator.outputs["terrain"][1]
+    elevation_time = generator.timings["terrain"] - erosion.seconds
+
+    # The pointer jumping sums against walking the tiles from the highest down, every tile drains to a lower one
+    receivers, _, _ = flow_receivers(erosion.elevation, config.sea_level)
+    area, accumulation_time = time_call(flow_accumulation, receivers, np.ones(receivers.size))
+    walked = np.ones(receivers.size + 1)
+    for tile in np.argsort(-erosion.elevation.reshape(-1), kind="stable").tolist():
+        walked[receivers[tile]] += walked[tile]
+    matches = np.array_equal(area, walked[:-1]) and bool(np.isfinite(erosion.elevation).all())
+
+    land = np.count_nonzero(tiles.surface == SURFACES.index("GRASS")) / tiles.surface.size
+    print(f"seed {seed} {size}x{size} ({tiles.surface.size} tiles): elevation field {elevation_time:.3f}s, "
+          f"{erosion.iterations} erosion iterations in {erosion.seconds:.3f}s, "
+          f"{erosion.iterations_per_second:.2f} iterations/sec, flow accumulation {accumulation_time:.3f}s, "
+          f"{land:.0%} land, {'matches' if matches else 'DOES NOT MATCH'} a tile by tile walk")
+    return matches
+
+
+def benchmark_trace(seed):
+    # Trace one world to see how many spans and counter calls it makes and where its time went
+    Trace.reset()
+    Trace.enable(memory=True)
+    try:
+        WorldGenerator(seed).generate()
+    finally:
+        Trace.disable()
+    calls = len(Trace.spans) + len(Trace.counter_samples)
+    stages = {name for name, _ in WorldGenerator.STAGES}
+    traced = {name.split(" ", 1)[1] for name in Trace.summary() if name.startswith("stage ")}
+    trace = Trace.chrome_trace()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.json")
+        Trace.save_chrome_trace(path)
+        with open(path) as file:
+            valid = json.load(file) == json.loads(json.dumps(trace))
+    for line in Trace.summary_lines():
+        print("  " + line)
+    Trace.reset()
+
+    # Time the same number of calls with tracing off, against the generation time
+    _, untraced_time = time_call(WorldGenerator(seed).generate)
+
+    def disabled_calls():
+        for _ in range(TRACE_CALLS):
+            with Trace.span("off"):
+                Trace.count("off")
+
+    _, disabled_time = time_call(disabled_calls)
+    per_call = disabled_time / TRACE_CALLS
+    overhead = calls * per_call / untraced_time
+    print(f"seed {seed}: {len(trace['traceEvents'])} trace events, {calls} instrumented calls, "
+          f"{1e9 * per_call:.0f}ns each while disabled, {100 * overhead:.4f}% of {untraced_time:.3f}s generation, "
+          f"stages {'all traced' if traced == stages else 'MISSING ' + str(stages - traced)}, "
+          f"chrome trace {'valid' if valid else 'INVALID'}")
+    return traced == stages and valid and overhead <= TRACE_MAX_DISABLED_OVERHEAD
+
+
+def measure_once(function, *args):
+    tracemalloc.start()
+    try:
+        result, seconds = time_call(function, *args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def measure(function, *args):
+    # Best wall time out of SUITE_REPEATS runs, then the peak traced memory of one more run, kept apart from the timing
+    # because tracemalloc slows allocations down
+    seconds = min(time_call(function, *args)[1] for _ in range(SUITE_REPEATS))
+    result, _, peak = measure_once(function, *args)
+    return result, seconds, peak
+
+
+def suite_stages(size, pixel_width, num_plates, seed, canvas):
+    import main
+
+    def plates_stage():
+        return get_plates(num_plates, size, size, pixel_width, rng=random.Random(seed),
+                          perlin=GradientNoise(NOISE_FREQUENCY, seed + 1))
+
+    # Every stage takes the output of the ones before it as input, stages that write to their input get a copy
+    return [
+        ("get_plates", lambda outputs: plates_stage()),
+        ("get_voronoi", lambda outputs: get_voronoi(plate_centers(outputs["get_plates"]), size, size)),
+        ("polygons_to_rects", lambda outputs: polygons_to_rects(outputs["get_plates"], size, size, pixel_width)),
+        ("gaussian_blur", lambda outputs: gaussian_blur(outputs["polygons_to_rects"], BLUR_ITERATIONS)),
+        ("disturb_tiles", lambda outputs: disturb_tiles(outputs["gaussian_blur"], outputs["get_plates"])),
+        ("highlight_edges", lambda outputs: highlight_edges(outputs["get_plates"], outputs["disturb_tiles"].copy())),
+        ("draw", lambda outputs: main.draw(canvas, outputs["highlight_edges"], True, outputs["get_plates"])),
+    ]
+
+
+def check_equivalence(outputs):
+    # Seeded outputs of the optimized kernels against the reference implementations they replaced
+    plates = outputs["get_plates"]
+    tiles = outputs["polygons_to_rects"]
+    rows, cols = tiles.shape
+    width, height = cols * tiles.pixel_width, rows * tiles.pixel_width
+    blurred = gaussian_blur_reference(tiles, BLUR_ITERATIONS)
+    reference = rasterize_plates_reference(plates, width, height, tiles.pixel_width)
+    checks = {
+        "rasterize_plates": untied_mismatches(plates, tiles.plate_index, reference, width, tiles.pixel_width) == 0,
+        "gaussian_blur": (np.array_equal(blurred.plate_index, outputs["gaussian_blur"].plate_index) and
+                          np.array_equal(blurred.color, outputs["gaussian_blur"].color)),
+        "highlight_edges": np.array_equal(highlight_edges_reference(plates, outputs["disturb_tiles"].copy()).color,
+                                          outputs["highlight_edges"].color),
+    }
+    return checks
+
+
+def untied_mismatches(plates, labels, reference, width, pixel_width):
+    # Tiles whose label differs from the reference although their sample point is nearer to one plate than the other.
+    # Points exactly between two plates can go either way, and points exactly on a polygon edge the reference can
+    # leave out of every polygon
+    ys, xs = np.nonzero((labels != reference) & (reference != -1))
+    points = np.stack((xs, ys), axis=-1) * pixel_width
+    centers = plate_centers(plates)
+
+    def distance(indices):
+        offsets = np.abs(points - centers[indices])
+        offsets[:, 0] = np.minimum(offsets[:, 0], width - offsets[:, 0])
+        return np.hypot(offsets[:, 0], offsets[:, 1])
+
+    return int(np.count_nonzero(~np.isclose(distance(labels[ys, xs]), distance(reference[ys, xs]))))
+
+
+def run_suite(seed=0):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    pygame.init()
+
+    results = []
+    equivalent = True
+    for size in SUITE_SIZES:
+        for pixel_width in SUITE_PIXEL_WIDTHS:
+            for num_plates in SUITE_PLATE_COUNTS:
+                config = f"{size}px/{pixel_width}/{num_plates}"
+                num_tiles = (size // pixel_width) ** 2
+                canvas = pygame.Surface((size, size))
+                outputs = {}
+                for stage, function in suite_stages(size, pixel_width, num_plates, seed, canvas):
+                    outputs[stage], seconds, peak = measure(function, outputs)
+                    results.append({"stage": stage, "size": size, "pixel_width": pixel_width, "plates": num_plates,
+                                    "seconds": seconds, "peak_bytes": peak, "tiles_per_second": num_tiles / seconds})
+                    print(f"{config:<14} {stage:<18} {seconds * 1000:9.2f}ms {peak / 2 ** 20:8.2f}MiB "
+                          f"{num_tiles / seconds:14,.0f} tiles/sec")
+                if size <= EQUIVALENCE_MAX_SIZE:
+                    for kernel, matches in check_equivalence(outputs).items():
+                        equivalent &= matches
+                        if not matches:
+                            print(f"{config:<14} {kernel} DOES NOT MATCH its reference")
+    return results, equivalent
+
+
+def result_key(result):
+    return f"{result['stage']}@{result['size']}px/{result['pixel_width']}/{result['plates']}"
+
+
+def find_regressions(results, baseline):
+    known = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = known.get(result_key(result))
+        if before is None:
+            continue
+        slower = result["seconds"] - before["seconds"]
+        if slower > REGRESSION_MIN_SECONDS and result["seconds"] > before["seconds"] * (1 + REGRESSION_TOLERANCE):
+            regressions.append(f"{result_key(result)} took {result['seconds'] * 1000:.2f}ms, "
+                               f"baseline {before['seconds'] * 1000:.2f}ms")
+        if result["peak_bytes"] > before["peak_bytes"] * (1 + REGRESSION_TOLERANCE):
+            regressions.append(f"{result_key(result)} peaked at {result['peak_bytes'] / 2 ** 20:.2f}MiB, "
+                               f"baseline {before['peak_bytes'] / 2 ** 20:.2f}MiB")
+    return regressions
+
+
+def load_json(path, default):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return default
+
+
+def save_json(path, value):
+    with open(path, "w") as file:
+        json.dump(value, file, indent=1)
+
+
+def benchmark_suite(args):
+    # python benchmark.py suite [save-baseline]: times every stage over the map grid, appends the run to the history
+    # and compares it with the baseline, which save-baseline replaces with this run
+    results, equivalent = run_suite()
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    history = load_json(HISTORY_PATH, [])
+    history.append({"date": datetime.datetime.now().isoformat(timespec="seconds"), "commit": commit,
+                    "results": results})
+    save_json(HISTORY_PATH, history)
+
+    if "save-baseline" in args:
+        save_json(BASELINE_PATH, results)
+        print(f"Saved the baseline to {BASELINE_PATH}")
+        return [equivalent]
+    baseline = load_json(BASELINE_PATH, None)
+    if baseline is None:
+        print(f"No baseline at {BASELINE_PATH}, run python benchmark.py suite save-baseline to store one")
+        return [equivalent]
+    regressions = find_regressions(results, baseline)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    return [equivalent, not regressions]
+
+
+BENCHMARKS = {
+    "rasterize": lambda args: [benchmark_rasterization(int(size)) for size in args or MAP_SIZES],
+    "blur": lambda args: [benchmark_blur(int(seed)) for seed in args or BLUR_SEEDS],
+    "noise": lambda args: [benchmark_noise(int(size)) for size in args or NOISE_SIZES],
+    "edges": lambda args: [benchmark_edges(int(seed)) for seed in args or BLUR_SEEDS],
+    "segments": lambda args: [benchmark_segments(int(seed)) for seed in args or BLUR_SEEDS],
+    "simulation": lambda args: [benchmark_simulation(int(seed)) for seed in args or [0]],
+    "chunks": lambda args: [benchmark_chunks(int(seed)) for seed in args or [0]],
+    "stream": lambda args: [benchmark_stream(int(seed)) for seed in args or [0]],
+    "scaling": lambda args: [benchmark_scaling(int(seed)) for seed in args or [0]],
+    "viewer": lambda args: [benchmark_viewer(int(size)) for size in args or VIEWER_SIZES],
+    "queries": lambda args: [benchmark_queries(int(size)) for size in args or QUERY_SIZES],
+    "edits": lambda args: [benchmark_edits(int(seed)) for seed in args or [0]],
+    "plates": lambda args: [benchmark_plates(int(seed)) for seed in args or [0]],
+    "erosion": lambda args: [benchmark_erosion(int(size)) for size in args or EROSION_SIZES],
+    "trace": lambda args: [benchmark_trace(int(seed)) for seed in args or [0]],
+    "suite": benchmark_suite,
+}
+
+
+def main():
+    # python benchmark.py [rasterize|blur|noise|edges|segments|simulation|chunks|stream|scaling|viewer|
+    # queries|edits|plates|erosion|trace]
+    # [sizes or seeds...],
+    # or
+    # python benchmark.py suite [save-baseline]
+    names = [sys.argv[1]] if len(sys.argv) > 1 else [name for name in BENCHMARKS if name != "suite"]
+    for name in names:
+        results = BENCHMARKS[name](sys.argv[2:])
+        if not all(result is not False for result in results):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import argparse
+import os
+import sys
+
+from Service import WorldService, make_server, HOST, PORT, WORLD_DIR, WORLD_FILE_LIMIT
+from World import STAGE_CACHE_SIZE
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Keep warm world generation workers running behind a local HTTP API")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--dir", default=WORLD_DIR, help="directory the generated .world files are kept in")
+    parser.add_argument("--cache-size", type=int, default=STAGE_CACHE_SIZE,
+                        help="stage outputs every worker keeps in memory")
+    parser.add_argument("--max-worlds", type=int, default=WORLD_FILE_LIMIT,
+                        help="world files kept in the directory, the least recently asked for are deleted first")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    service = WorldService(args.workers, args.dir, args.cache_size, args.max_worlds)
+    server = make_server(service, args.host, args.port)
+    print(f"Serving worlds on http://{args.host}:{server.server_address[1]} with {len(service.pools)} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
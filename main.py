@@ -1,58 +1,484 @@
+import argparse
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
 import numpy as np
 import pygame
-from Plates import get_voronoi, polygons_to_rects, get_points, gaussian_blur, highlight_edges, WIDTH, HEIGHT, \
-    NUM_PLATES, get_plates, disturb_rectangles_with_perlin_noise, disturb_tiles, highlight_tiles
+import Trace
+from Plates import get_voronoi, get_points, WIDTH, HEIGHT, NUM_PLATES, disturb_rectangles_with_perlin_noise, \
+    highlight_tiles
+from World import WorldGenerator, WorldConfig, WorldEditor, ArtifactStore, ChunkedWorld, GenerationCancelled
+from WorldFile import open_world
+from Service import ServiceClient
 
 # Constants
 
 DRAW_VORONOI_POLYGONS = False
+# Pixels the arrow keys move the view by
+PAN_STEP = 80
+PAN_KEYS = {pygame.K_LEFT: (-PAN_STEP, 0), pygame.K_RIGHT: (PAN_STEP, 0), pygame.K_UP: (0, -PAN_STEP),
+            pygame.K_DOWN: (0, PAN_STEP)}
+# Frames per second the viewer loops at
+FRAME_RATE = 60
+# Frames FrameStats keeps the times of
+FRAME_STATS_WINDOW = 120
+# Zoom factor per mouse wheel step or +/- key press, and the zoom range in screen pixels per map pixel
+ZOOM_STEP = 1.25
+MIN_SCALE = 1 / 64
+MAX_SCALE = 16
+# Degrees R turns a plate by
+ROTATE_STEP = 45
+# Spans listed in the stats overlay when tracing, the slowest first
+TRACE_OVERLAY_LINES = 6
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Generate and explore plate tectonics maps")
+    parser.add_argument("world", nargs="?", default=None,
+                        help="seed of the first map, reproducing an earlier run, or a .world file to show without "
+                             "loading it whole")
+    parser.add_argument("--endless", action="store_true", help="explore an endless chunked world of the seed instead")
+    parser.add_argument("--server", default=None, help="url of a running daemon.py to generate the maps")
+    parser.add_argument("--trace", default=None, metavar="PATH",
+                        help="record where the time goes, show it with the frame stats and save it as a Chrome trace "
+                             "to PATH on quit")
+    parser.add_argument("--trace-memory", action="store_true", help="record the peak memory too with --trace")
+    args = parser.parse_args(argv)
+    args.path = args.seed = None
+    if args.world is not None and args.world.endswith(".world"):
+        if args.endless:
+            parser.error("--endless explores a seed, not a .world file")
+        args.path = args.world
+    elif args.world is not None:
+        try:
+            args.seed = int(args.world)
+        except ValueError:
+            parser.error(f"expected a seed or a .world file, got {args.world}")
+    return args
 
 
-def main():
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    client = None if args.server is None else ServiceClient(args.server)
+    trace_path = args.trace
+    if trace_path is not None:
+        Trace.enable(memory=args.trace_memory)
+    world = open_world(args.path) if args.path is not None else None
+    size = (world.width, world.height) if world is not None else (WIDTH, HEIGHT)
+    # Edits of a saved world regenerate its tiles with the config it was generated with, older files only know the
+    # sizes
+    if world is None:
+        config = WorldConfig()
+    elif world.config is not None:
+        config = WorldConfig(**world.config)
+    else:
+        config = WorldConfig(width=world.width, height=world.height, pixel_width=world.pixel_width)
+
     # Set up Pygame window and canvas
-    window = pygame.display.set_mode((WIDTH, HEIGHT))
-    canvas = pygame.Surface((WIDTH, HEIGHT))
+    window = pygame.display.set_mode(size)
+    canvas = pygame.Surface(size)
     pygame.init()
 
-    toggle_highlight = True
-
     canvas.fill((255, 255, 255))
 
-    rect_map, plates = generate_map(canvas, toggle_highlight)
+    seed = args.seed
+    if args.endless:
+        return explore(window, canvas, seed)
+    # Maps are generated on a worker thread, the window keeps showing the last one until the next one is done
+    generator = BackgroundGenerator(client=client)
+    view = MapView(size)
+    if world is not None:
+        view.show(world.tiles, world.plates)
+    else:
+        generator.request(seed)
+    clock = pygame.time.Clock()
+    font = pygame.font.SysFont('Sans-Serif', 20)
+    stats = FrameStats()
+    show_stats = False
+    # Window areas the overlays covered last frame, they get redrawn from the view when the overlays change
+    overlay_rects = []
+    overlay_text = []
+    dragged = False
+    # Plate edits go through a WorldEditor made for the map on the first edit. Dragging with the right button moves
+    # a plate, R turns the one under the mouse and D switches it between oceanic and continental
+    editor = None
+    picked = None
+    blurred = None
+
+    def edit(change):
+        nonlocal editor
+        if editor is None:
+            try:
+                editor = WorldEditor(view.tiles, view.plates, config, blurred=blurred)
+            except ValueError as error:
+                # A world with elevation can't be edited
+                print(error)
+                return
+            if editor.tiles is not view.tiles:
+                view.show(editor.tiles, editor.plates)
+        view.patch(change(editor))
 
-    # Game loop
-    running = True
-    while running:
+    # Game loop, the window is only redrawn where something changed
+    while True:
+        frame_start = time.perf_counter()
         # Handle events
         for event in pygame.event.get():
-            # Check if the mouse is clicked:
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                # If the mouse is clicked, toggle the highlight
-                toggle_highlight = not toggle_highlight
-                draw(canvas, rect_map, toggle_highlight, plates)
             if event.type == pygame.QUIT:
+                print(stats.summary())
+                if trace_path is not None:
+                    print("\n".join(Trace.summary_lines()))
+                    Trace.save_chrome_trace(trace_path)
                 quit()
-            elif event.type == pygame.QUIT:
-                running = False
-            # If space is pressed, generate a new map
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                dragged = False
+            elif event.type == pygame.MOUSEMOTION and event.buttons[0]:
+                # Dragging with the left button pans the map
+                dragged = True
+                view.pan(-event.rel[0], -event.rel[1])
+            elif event.type == pygame.MOUSEBUTTONUP and event.button == 1 and not dragged:
+                # A left click without dragging toggles the highlight
+                view.toggle_highlight()
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 3 and view.tiles is not None:
+                picked = view.plate_at(event.pos)
+            elif event.type == pygame.MOUSEBUTTONUP and event.button == 3 and picked is not None:
+                x, y = view.map_point(event.pos)
+                center = (x % config.width, min(max(y, 0), config.height - 1))
+                edit(lambda editor, index=picked: editor.move_plate(index, center))
+                picked = None
+            elif event.type == pygame.MOUSEWHEEL:
+                view.zoom(ZOOM_STEP ** event.y, pygame.mouse.get_pos())
+            # If space is pressed, generate a new map, pressing it again before it is done starts over
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
-                    canvas.fill((255, 255, 255))
-
-                    rect_map, plates = generate_map(canvas, toggle_highlight)
+                    generator.request()
+                elif event.key in PAN_KEYS:
+                    view.pan(*PAN_KEYS[event.key])
+                elif event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_MINUS):
+                    view.zoom(ZOOM_STEP if event.key != pygame.K_MINUS else 1 / ZOOM_STEP)
+                elif event.key == pygame.K_0:
+                    view.reset()
+                elif event.key == pygame.K_f:
+                    show_stats = not show_stats
+                elif event.key in (pygame.K_r, pygame.K_d) and view.tiles is not None:
+                    index = view.plate_at(pygame.mouse.get_pos())
+                    if index is not None and event.key == pygame.K_r:
+                        angle = np.radians(ROTATE_STEP)
+                        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+                        edit(lambda editor: editor.set_direction(index, rotation @ editor.plates[index].direction))
+                    elif index is not None:
+                        edit(lambda editor: editor.set_density(index, -editor.plates[index].density))
 
         # Do logic
-
-        # Clear canvas
+        result = generator.poll()
+        if result is not None:
+            rect_map, plates, seed, blurred = result
+            print("Created rects with {} rectangles from seed {}".format(len(rect_map) * len(rect_map[0]), seed))
+            view.show(rect_map, plates)
+            editor = None
 
         # Update window
+        dirty = []
+        if view.dirty:
+            view.draw(window)
+            dirty.append(window.get_rect())
+        text = []
+        # One read of the status, the worker thread sets it to None when it finishes
+        status = generator.status
+        if status is not None:
+            text.append("Generating seed {}: {} ({}/{})".format(*status[:2], status[2] + 1, status[3]))
+        error = generator.error
+        if error is not None:
+            text.append("Generating seed {} failed: {}".format(*error))
+        if show_stats:
+            text.append(stats.summary())
+            if Trace.enabled:
+                text.extend(Trace.summary_lines(TRACE_OVERLAY_LINES))
+        if text != overlay_text or dirty:
+            for rect in overlay_rects:
+                window.blit(view.frame, rect, rect)
+            dirty.extend(overlay_rects)
+            overlay_rects = draw_overlay(window, font, text)
+            dirty.extend(overlay_rects)
+            overlay_text = text
+        if dirty:
+            pygame.display.update(dirty)
+        stats.add(time.perf_counter() - frame_start, clock.tick(FRAME_RATE) / 1000)
+
+
+class FrameStats:
+    """Frame times of the last `window` frames: the time spent working on a frame and the time between frames."""
+
+    def __init__(self, window=FRAME_STATS_WINDOW):
+        self.work = deque(maxlen=window)
+        self.intervals = deque(maxlen=window)
+
+    def add(self, work, interval):
+        self.work.append(work)
+        self.intervals.append(interval)
+
+    @property
+    def fps(self):
+        return len(self.intervals) / sum(self.intervals) if sum(self.intervals) else 0.0
+
+    def percentile(self, percent):
+        return float(np.percentile(self.work, percent)) if self.work else 0.0
+
+    def summary(self):
+        return "{:.0f} fps, frame work {:.2f}ms mean {:.2f}ms p95 {:.2f}ms max".format(
+            self.fps, 1000 * (sum(self.work) / len(self.work) if self.work else 0.0), 1000 * self.percentile(95),
+            1000 * max(self.work, default=0.0))
+
+
+class MapView:
+    """A pannable, zoomable view of a TerrainGrid, drawn from a mipmap pyramid of its image.
+
+    Level k of the pyramid has one pixel per 2^k by 2^k tiles, averaged. A frame samples the level whose pixels are
+    closest to the size of a screen pixel, so drawing costs the same at any zoom level and on any map size. left and
+    top are the map pixel at the top left of the view, scale the screen pixels per map pixel. The frame is only
+    redrawn when dirty.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.frame = pygame.Surface(size)
+        self.frame.fill((255, 255, 255))
+        self.tiles = None
+        self.plates = None
+        self.highlight = True
+        self.pyramids = {}
+        self.font = pygame.font.SysFont('Sans-Serif', 20)
+        self.reset()
+
+    def show(self, tiles, plates):
+        self.tiles = tiles
+        self.plates = plates
+        self.pyramids = {}
+        self.dirty = True
+
+    def reset(self):
+        self.left, self.top, self.scale = 0.0, 0.0, 1.0
+        self.dirty = True
+
+    def pan(self, dx, dy):
+        # Moves the view by screen pixels
+        self.left += dx / self.scale
+        self.top += dy / self.scale
+        self.dirty = True
+
+    def zoom(self, factor, anchor=None):
+        # Zooms by factor, keeping the map pixel under the anchor screen pixel where it is
+        anchor_x, anchor_y = (self.size[0] / 2, self.size[1] / 2) if anchor is None else anchor
+        scale = min(MAX_SCALE, max(MIN_SCALE, self.scale * factor))
+        self.left += anchor_x / self.scale - anchor_x / scale
+        self.top += anchor_y / self.scale - anchor_y / scale
+        self.scale = scale
+        self.dirty = True
+
+    def toggle_highlight(self):
+        self.highlight = not self.highlight
+        self.dirty = True
+
+    def pyramid(self):
+        if self.highlight not in self.pyramids:
+            # Kept columns first like surfarray wants them, with a white last row and column for outside the map
+            self.pyramids[self.highlight] = [
+                np.ascontiguousarray(np.pad(level, ((0, 1), (0, 1), (0, 0)), constant_values=255).transpose(1, 0, 2))
+                for level in mipmaps(self.tiles.image(self.highlight)[..., :3])]
+        return self.pyramids[self.highlight]
+
+    def patch(self, rects):
+        # Takes in the (top, bottom, left, right) tile rectangles of the map that changed, only the pixels of the
+        # pyramids above them are worked out again
+        for highlight, pyramid in self.pyramids.items():
+            levels = [level[:-1, :-1].transpose(1, 0, 2) for level in pyramid]
+            for top, bottom, left, right in rects:
+                region = self.tiles.crop(top, left, bottom - top, right - left)
+                levels[0][top:bottom, left:right] = region.image(highlight)[..., :3]
+                for above, level in zip(levels, levels[1:]):
+                    top, left, bottom, right = top // 2, left // 2, -(-bottom // 2), -(-right // 2)
+                    level[top:bottom, left:right] = downsample(above[2 * top:2 * bottom, 2 * left:2 * right])
+        self.dirty = True
+
+    def map_point(self, position):
+        # The map pixel under a window pixel
+        return self.left + position[0] / self.scale, self.top + position[1] / self.scale
+
+    def plate_at(self, position):
+        # The index of the plate under a window pixel, None off the map
+        x, y = self.map_point(position)
+        rows, cols = self.tiles.shape
+        row, col = int(y // self.tiles.pixel_width), int(x // self.tiles.pixel_width)
+        return int(self.tiles.plate_index[row, col]) if 0 <= row < rows and 0 <= col < cols else None
+
+    @Trace.traced("MapView.draw")
+    def draw(self, window):
+        self.dirty = False
+        if self.tiles is None:
+            window.blit(self.frame, (0, 0))
+            return
+        pixel_width = self.tiles.pixel_width
+        pyramid = self.pyramid()
+        # Tiles per screen pixel picks the level
+        level = int(np.clip(np.floor(np.log2(1 / (self.scale * pixel_width))), 0, len(pyramid) - 1))
+        image = pyramid[level]
+
+        # The level pixel under the middle of every screen column and row, tile c covers map pixels from
+        # c * pixel_width - pixel_width // 2 on like in MapRenderer
+        width, height = self.size
+        map_x = self.left + (np.arange(width) + 0.5) / self.scale
+        map_y = self.top + (np.arange(height) + 0.5) / self.scale
+        cols = np.floor((map_x + pixel_width // 2) / pixel_width).astype(np.int64) >> level
+        rows = np.floor((map_y + pixel_width // 2) / pixel_width).astype(np.int64) >> level
+        # Outside the map the white padding shows
+        cols[(cols < 0) | (cols >= image.shape[0] - 1)] = -1
+        rows[(rows < 0) | (rows >= image.shape[1] - 1)] = -1
+        pixels = image.take(cols, axis=0).take(rows, axis=1)
+        pygame.surfarray.blit_array(self.frame, pixels)
+
+        draw_ui(self.frame, self.plates, (self.left, self.top), self.scale, self.font)
+        window.blit(self.frame, (0, 0))
+
+
+def mipmaps(image):
+    # The image and every halving of it down to one pixel
+    levels = [image]
+    while max(image.shape[:2]) > 1:
+        image = downsample(image)
+        levels.append(image)
+    return levels
+
+
+def downsample(image):
+    # Averages every 2 by 2 block of pixels, odd sizes repeat their last row or column
+    rows, cols = image.shape[:2]
+    image = np.pad(image, ((0, rows % 2), (0, cols % 2), (0, 0)), mode="edge").astype(np.uint16)
+    image = ((image[0::2, 0::2] + image[1::2, 0::2] + image[0::2, 1::2] + image[1::2, 1::2] + 2) // 4)
+    return image.astype(np.uint8)
+
+
+def draw_overlay(canvas, font, lines):
+    # Draws lines of text in boxes down the top left corner and returns the rects they cover
+    rects = []
+    y = 10
+    for line in lines:
+        text = font.render(line, True, (255, 255, 255))
+        box = pygame.Surface((text.get_width() + 20, text.get_height() + 10), pygame.SRCALPHA)
+        box.fill((0, 0, 0, 160))
+        box.blit(text, (10, 5))
+        rects.append(canvas.blit(box, (10, y)))
+        y += box.get_height() + 5
+    return rects
+
+
+class BackgroundGenerator:
+    """Generates maps with a WorldGenerator on a worker thread, so the event loop never waits for one.
+
+    request() asks for a map and cancels the one being generated, requests made while one is generating collapse
+    into the last one. poll() returns (rects, plates, seed, blurred) once a map is done, blurred is the grid of the
+    blurred stage or None. status is (seed, stage, stage index, number of stages) while a map is being generated and
+    None otherwise. error is (seed, message) from the last map that failed until the next request, the worker goes
+    on serving requests after a failure. With a Service.ServiceClient the maps are generated by the service instead
+    and come back memory mapped, those can't be cancelled and are dropped instead if another map was requested in
+    the meantime.
+    """
+
+    def __init__(self, store=None, client=None):
+        self.store = ArtifactStore() if store is None else store
+        self.client = client
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.cancel = threading.Event()
+        self.pending = None
+        self.result = None
+        self.status = None
+        self.error = None
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def request(self, seed=None):
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        with self.lock:
+            self.pending = seed
+            self.error = None
+            self.cancel.set()
+            self.wakeup.notify()
+
+    def poll(self):
+        with self.lock:
+            result, self.result = self.result, None
+            return result
+
+    def work(self):
+        while True:
+            with self.lock:
+                while self.pending is None:
+                    self.wakeup.wait()
+                seed, self.pending = self.pending, None
+                self.cancel.clear()
+
+            def progress(stage, index, total):
+                self.status = (seed, stage, index, total)
+
+            try:
+                if self.client is not None:
+                    progress("server", 0, 1)
+                    world = self.client.generate(seed)
+                    rects, plates, blurred = world.tiles, world.plates, None
+                else:
+                    world_generator = WorldGenerator(seed, store=self.store)
+                    rects, plates = world_generator.generate(progress, self.cancel)
+                    blurred = world_generator.outputs["blurred"]
+            except GenerationCancelled:
+                continue
+            except Exception as error:
+                # A failed map, a ServiceError from the server for one, must not take the worker thread down with it
+                with self.lock:
+                    # Like a result, the error of a map a newer request already replaced is dropped
+                    if self.pending is None:
+                        self.error = (seed, f"{type(error).__name__}: {error}")
+                continue
+            finally:
+                self.status = None
+            with self.lock:
+                # A request that came in after the last stage started replaces this map too
+                if self.pending is None:
+                    self.result = (rects, plates, seed, blurred)
+
+
+def explore(window, canvas, seed=None):
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    print("Exploring the endless world of seed {}".format(seed))
+    renderer = ChunkRenderer(ChunkedWorld(seed))
+    toggle_highlight = True
+    renderer.draw(canvas, toggle_highlight)
+
+    clock = pygame.time.Clock()
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                toggle_highlight = not toggle_highlight
+                renderer.draw(canvas, toggle_highlight)
+            elif event.type == pygame.KEYDOWN and event.key in PAN_KEYS:
+                move = PAN_KEYS[event.key]
+                renderer.camera = (renderer.camera[0] + move[0], renderer.camera[1] + move[1])
+                renderer.draw(canvas, toggle_highlight)
+
         window.blit(canvas, (0, 0))
         pygame.display.update()
+        clock.tick(FRAME_RATE)
 
 
-def draw_arrow_on_plate_center(plate, canvas):
+# origin and scale place the map pixels on the canvas, for a view that is panned or zoomed
+def draw_arrow_on_plate_center(plate, canvas, origin=(0, 0), scale=1.0):
     # Draw an arrow on the center of the plate
-    x, y = plate.center
+    x, y = (plate.center[0] - origin[0]) * scale, (plate.center[1] - origin[1]) * scale
     direction = plate.direction
     # draw a line pointing towards the direction of the plate at its center
     pygame.draw.line(canvas, (0, 0, 0), (x, y), (x + 30 * direction[0], y + 30 * direction[1]), 2)
@@ -60,46 +486,110 @@ def draw_arrow_on_plate_center(plate, canvas):
     pygame.draw.circle(canvas, (0, 0, 0), (x, y), 5)
 
 
-def draw_plate_number(plate, canvas):
+def draw_plate_number(plate, canvas, origin=(0, 0), scale=1.0, font=None):
     # Draw the number of the plate on the center of the plate
-    x, y = plate.center
-    font = pygame.font.SysFont('Sans-Serif', 20)
+    x, y = (plate.center[0] - origin[0]) * scale, (plate.center[1] - origin[1]) * scale
+    font = pygame.font.SysFont('Sans-Serif', 20) if font is None else font
     text = font.render(str(plate.id), True, (0, 0, 0))
     canvas.blit(text, (x, y + 15))
 
 
+class MapRenderer:
+    """Draws a TerrainGrid as one surfarray blit, with the plate UI drawn on a separately cached overlay."""
+
+    def __init__(self):
+        self.terrain = None
+        self.overlay = None
+        self.overlay_plates = None
+
+    def draw(self, canvas, rects, toggle_highlight, plates):
+        rows, cols = rects.shape
+        pixel_width = rects.pixel_width
+        if self.terrain is None or self.terrain.get_size() != (cols * pixel_width, rows * pixel_width):
+            self.terrain = pygame.Surface((cols * pixel_width, rows * pixel_width))
+        if self.overlay_plates is not plates or self.overlay.get_size() != canvas.get_size():
+            self.overlay = pygame.Surface(canvas.get_size(), pygame.SRCALPHA)
+            draw_ui(self.overlay, plates)
+            self.overlay_plates = plates
+
+        # Scale every tile up to a pixel_width square, surfarray wants the columns first
+        image = rects.image(toggle_highlight)[..., :3]
+        pixels = np.repeat(np.repeat(image, pixel_width, axis=0), pixel_width, axis=1)
+        pygame.surfarray.blit_array(self.terrain, pixels.transpose(1, 0, 2))
+
+        canvas.fill((255, 255, 255))
+        # Tiles are centered on their sample point, so the first one starts half a tile off the canvas
+        canvas.blit(self.terrain, (-(pixel_width // 2), -(pixel_width // 2)))
+        canvas.blit(self.overlay, (0, 0))
+
+
+renderer = MapRenderer()
+
+
+class ChunkRenderer:
+    """Draws the chunks of a ChunkedWorld that overlap the canvas, camera is the world pixel at its top left corner.
+
+    Only the chunks in view are generated, so drawing costs the same however far the world has been explored.
+    """
+
+    def __init__(self, world, camera=(0, 0)):
+        self.world = world
+        self.camera = camera
+        # Drawn chunk surfaces, keyed on the chunk and the highlight toggle, as many as the world keeps chunks
+        self.surfaces = OrderedDict()
+
+    def visible_chunks(self, size):
+        chunk_pixels = self.world.chunk_size * self.world.config.pixel_width
+        left, top = self.camera
+        for cy in range(top // chunk_pixels, (top + size[1] - 1) // chunk_pixels + 1):
+            for cx in range(left // chunk_pixels, (left + size[0] - 1) // chunk_pixels + 1):
+                yield cx, cy, cx * chunk_pixels - left, cy * chunk_pixels - top
+
+    def draw(self, canvas, toggle_highlight):
+        canvas.fill((255, 255, 255))
+        for cx, cy, x, y in self.visible_chunks(canvas.get_size()):
+            canvas.blit(self.chunk_surface(cx, cy, toggle_highlight), (x, y))
+
+    def chunk_surface(self, cx, cy, toggle_highlight):
+        key = (cx, cy, toggle_highlight)
+        if key in self.surfaces:
+            self.surfaces.move_to_end(key)
+            return self.surfaces[key]
+        tiles, _ = self.world.get_chunk(cx, cy)
+        pixel_width = tiles.pixel_width
+        image = tiles.image(toggle_highlight)[..., :3]
+        pixels = np.repeat(np.repeat(image, pixel_width, axis=0), pixel_width, axis=1)
+        surface = pygame.surfarray.make_surface(pixels.transpose(1, 0, 2))
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.world.cache_size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+
+@Trace.traced()
 def draw(canvas, rects, toggle_highlight, plates):
-    for x, strip in enumerate(rects):
-        for y, rect in enumerate(strip):
-            if rect.highlight and toggle_highlight:
-                color = (255, 0, 0, 255)
-            else:
-                color = rect.color
-            pygame.draw.rect(canvas, color,
-                             (rect.x, rect.y, rect.width, rect.height))
-    draw_ui(canvas, plates)
-
-
-def generate_map(canvas, toggle_highlight):
+    renderer.draw(canvas, rects, toggle_highlight, plates)
+
+
+def generate_map(canvas, toggle_highlight, seed=None):
     # Set up initial conditions
-    plates = get_plates()
-    rects = polygons_to_rects(plates)
-    rects = gaussian_blur(rects, 3)
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    generator = WorldGenerator(seed, store=ArtifactStore())
+    rects, plates = generator.generate()
     # rects = smooth_edges(rects, 1)
     # rects = disturb_rectangles_with_perlin_noise(rects, 0.5)
-    rects = disturb_tiles(rects, plates)
-    # highlight_edges(plates, rects)
-    print("Created rects with {} rectangles: ".format(len(rects) * len(rects[0])))
+    print("Created rects with {} rectangles from seed {}".format(len(rects) * len(rects[0]), seed))
     draw(canvas, rects, toggle_highlight, plates)
 
     return rects, plates
 
 
-def draw_ui(canvas, plates):
+def draw_ui(canvas, plates, origin=(0, 0), scale=1.0, font=None):
     # Draw arrows on the centers of the plates
     for plate in plates:
-        draw_arrow_on_plate_center(plate, canvas)
-        draw_plate_number(plate, canvas)
+        draw_arrow_on_plate_center(plate, canvas, origin, scale)
+        draw_plate_number(plate, canvas, origin, scale, font)
 
 
 if __name__ == "__main__":